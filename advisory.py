@@ -0,0 +1,360 @@
+"""
+Advisory text generated from a declarative rule table
+
+Agronomists write the ``<INDEX> ADVISORY`` columns of the workbook by hand for
+every field. With ``--advisory-rules`` the advisories are instead generated for
+the whole sheet at once from a rule table (``advisory_rules.csv``), one row per
+rule:
+
+    index,crop,stage,language,min_value,max_value,min_change,max_change,advisory
+    NDMI,,,English,,-0.1,,,"Your field's moisture level is very low (NDMI: {value}, {change}) ..."
+
+A rule matches a field when the index value lies in [min_value, max_value), the
+change from the old value in [min_change, max_change), and the crop, growth
+stage ("Maturity") and language are among the values listed (separated by
+``|``, case-insensitive). Empty cells match anything. The first matching rule of
+an index wins, so specific rules go before general ones. The advisory text may
+use {field}, {crop}, {stage}, {index}, {value}, {old_value}, {change} (signed,
+"+0.05"), {change_abs} (unsigned, for texts that already say "down by") and
+{date}. Numbers are filled in rounded to two decimals; format specs and
+conversions ({value:.1f}, {change!r}) are rejected.
+
+Every rule is evaluated as a vectorized mask over all rows and the text is
+assembled column-wise, so the rules for 10k fields are matched in a few
+milliseconds and all 50k advisories written in well under a second. Advisories
+entered by hand in the workbook always win; only the empty ones are generated.
+
+Usage:
+    python advisory.py [--excel demo.xlsx] [--rules advisory_rules.csv] [--output advisories.csv]
+"""
+import argparse
+import csv
+import logging
+import string
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Rule table shipped with the generator
+DEFAULT_RULES = "advisory_rules.csv"
+
+# Vegetation indices with an advisory column
+INDICES = ["NDVI", "NDMI", "RECI", "MSAVI", "NDRE"]
+
+# Workbook columns the rules match against; the growth stage is in "Maturity"
+CROP_COLUMN = "Crop"
+STAGE_COLUMN = "Maturity"
+LANGUAGE_COLUMN = "Language"
+
+# Language of fields that don't have one
+DEFAULT_LANGUAGE = "english"
+
+PLACEHOLDERS = {"field", "crop", "stage", "index", "value", "old_value", "change", "change_abs", "date"}
+
+Rule = namedtuple("Rule", ["index", "crops", "stages", "languages", "min_value", "max_value",
+                           "min_change", "max_change", "advisory", "line"])
+
+
+def _bound(text, name, line):
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"line {line}: {name} must be a number, got {text!r}")
+
+
+def _choices(text):
+    """Return the lower-case alternatives of a crop/stage/language cell, None for any"""
+    choices = frozenset(part.strip().lower() for part in (text or "").split("|") if part.strip())
+    return choices or None
+
+
+def load_rules(path=DEFAULT_RULES):
+    """
+    Read a rule table
+
+    Args:
+        path (str): CSV file with the columns of advisory_rules.csv
+
+    Returns:
+        list: Rule for every row, in file order
+
+    Raises:
+        ValueError: If a rule names an unknown index, has a bound that isn't a
+            number or its text uses an unknown placeholder, or one with a format
+            spec or conversion ({value:.1f}, {change!r})
+    """
+    rules = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, record in enumerate(csv.DictReader(f), start=2):
+            index = (record.get("index") or "").strip().upper()
+            if index not in INDICES:
+                raise ValueError(f"{path} line {line}: unknown index {record.get('index')!r}")
+            advisory = (record.get("advisory") or "").strip()
+            try:
+                parsed = [(name, spec, conversion) for _, name, spec, conversion in string.Formatter().parse(advisory)
+                          if name is not None]
+            except ValueError as e:
+                raise ValueError(f"{path} line {line}: {e}")
+            # The placeholders are filled with ready-made text, so a format spec or conversion would be lost
+            for name, spec, conversion in parsed:
+                if spec or conversion:
+                    raise ValueError(f"{path} line {line}: placeholder {{{name}}} has a format spec or conversion")
+            fields = {name for name, _, _ in parsed}
+            unknown = fields - PLACEHOLDERS
+            if unknown:
+                raise ValueError(f"{path} line {line}: unknown placeholder {{{sorted(unknown)[0]}}}")
+            rules.append(Rule(
+                index=index,
+                crops=_choices(record.get("crop")),
+                stages=_choices(record.get("stage")),
+                languages=_choices(record.get("language")),
+                min_value=_bound(record.get("min_value"), "min_value", line),
+                max_value=_bound(record.get("max_value"), "max_value", line),
+                min_change=_bound(record.get("min_change"), "min_change", line),
+                max_change=_bound(record.get("max_change"), "max_change", line),
+                advisory=advisory,
+                line=line,
+            ))
+    return rules
+
+
+def map_unique(series, convert):
+    """Apply convert to each distinct value of a column only, returning an object array"""
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    converted = np.empty(len(uniques) + 1, dtype=object)
+    converted[:-1] = [convert(value) for value in uniques]
+    converted[-1] = convert(None)
+    # Missing values have code -1, the last entry
+    return converted[codes]
+
+
+def _label(value, default):
+    if value is None:
+        return default
+    label = str(value).strip().lower()
+    return default if label in ("", "-", "nan") else label
+
+
+def label_column(df, column, default=""):
+    """Lower-case, stripped text of a column, with "-" and blanks as default"""
+    import numpy as np
+
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=object)
+    return map_unique(df[column], lambda value: _label(value, default))
+
+
+def number_column(df, column):
+    """Values of a column as a float array, NaN where missing or not a number"""
+    import numpy as np
+    import pandas as pd
+
+    if column not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+
+
+def _format_number(numbers, signed=False):
+    """Numbers as text rounded to two decimals, "N/A" when missing"""
+    import pandas as pd
+
+    def convert(value):
+        if value is None:
+            return "N/A"
+        text = str(value)
+        return "+" + text if signed and value > 0 else text
+
+    return map_unique(pd.Series(numbers).round(2), convert)
+
+
+def parse_date(value):
+    """Date text of a cell as YYYY-MM-DD, None when it isn't a date"""
+    import pandas as pd
+
+    if value is None:
+        return None
+    try:
+        date = pd.to_datetime(str(value).strip())
+    except (ValueError, TypeError):
+        return None
+    return None if pd.isna(date) else date.strftime("%Y-%m-%d")
+
+
+def _dates(df, index):
+    """Image date of each row as YYYY-MM-DD: the index's own, another index's or "Current  image" """
+    import numpy as np
+
+    columns = [f"{index} Image date"] + [f"{other} Image date" for other in INDICES if other != index]
+    columns = [column for column in columns + ["Current  image"] if column in df.columns]
+    dates = np.full(len(df), None, dtype=object)
+    for column in columns:
+        missing = dates == None  # noqa: E711 - elementwise comparison
+        if not missing.any():
+            break
+        # Dates repeat across fields, so each distinct text is only parsed once
+        dates[missing] = map_unique(df[column], parse_date)[missing]
+    dates[dates == None] = "the latest image date"  # noqa: E711
+    return dates
+
+
+def generate_advisories(df, rules):
+    """
+    Generate the advisory of every field and index
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        rules (list): Rules from load_rules
+
+    Returns:
+        pandas.DataFrame: "<INDEX> ADVISORY" columns with the generated text,
+            missing where no rule matched
+    """
+    import numpy as np
+    import pandas as pd
+
+    crops = label_column(df, CROP_COLUMN)
+    stages = label_column(df, STAGE_COLUMN)
+    languages = label_column(df, LANGUAGE_COLUMN, DEFAULT_LANGUAGE)
+    fields = map_unique(df["Field"], lambda value: "" if value is None else str(value).strip()) \
+        if "Field" in df.columns else np.full(len(df), "", dtype=object)
+
+    generated = pd.DataFrame(index=df.index)
+    for index in INDICES:
+        index_rules = [rule for rule in rules if rule.index == index]
+        text = np.full(len(df), None, dtype=object)
+        if not index_rules:
+            generated[f"{index} ADVISORY"] = text
+            continue
+
+        values = number_column(df, f"{index} value")
+        old_values = number_column(df, f"Old {index} value")
+        # A missing change is computed from the old value, as the dashboard does
+        changes = number_column(df, f"{index} change")
+        changes = np.where(np.isnan(changes), values - old_values, changes)
+
+        # Number of the first matching rule for every row, -1 for none
+        matched = np.full(len(df), -1)
+        with np.errstate(invalid="ignore"):
+            for number, rule in enumerate(index_rules):
+                mask = matched == -1
+                for numbers, low, high in ((values, rule.min_value, rule.max_value),
+                                           (changes, rule.min_change, rule.max_change)):
+                    # Comparisons with NaN are False, so a bound never matches a missing number
+                    if low is not None:
+                        mask &= numbers >= low
+                    if high is not None:
+                        mask &= numbers < high
+                for labels, choices in ((crops, rule.crops), (stages, rule.stages), (languages, rule.languages)):
+                    if choices is not None:
+                        mask &= np.isin(labels, list(choices))
+                matched[mask] = number
+
+        # Placeholder columns, built on first use
+        sources = {
+            "field": lambda: fields,
+            "crop": lambda: np.where(crops == "", "your crop", crops),
+            "stage": lambda: np.where(stages == "", "current stage", stages),
+            "index": lambda: np.full(len(df), index, dtype=object),
+            "value": lambda: _format_number(values),
+            "old_value": lambda: _format_number(old_values),
+            "change": lambda: _format_number(changes, signed=True),
+            "change_abs": lambda: _format_number(np.abs(changes)),
+            "date": lambda: _dates(df, index),
+        }
+        replacements = {}
+        for number, rule in enumerate(index_rules):
+            rows = matched == number
+            if not rows.any():
+                continue
+            # Assemble the text column-wise from the literal parts and placeholder columns
+            parts = np.full(rows.sum(), "", dtype=object)
+            for literal, name, _, _ in string.Formatter().parse(rule.advisory):
+                parts = parts + literal
+                if name is not None:
+                    if name not in replacements:
+                        replacements[name] = np.asarray(sources[name](), dtype=object)
+                    parts = parts + replacements[name][rows]
+            text[rows] = parts
+        generated[f"{index} ADVISORY"] = text
+    return generated
+
+
+def apply_advisories(df, rules):
+    """
+    Fill the empty advisory columns of the workbook rows with generated text
+
+    Advisories entered by hand are kept.
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        rules (list): Rules from load_rules
+
+    Returns:
+        tuple: (copy of df with the advisories filled in, number of advisories generated)
+    """
+    import numpy as np
+
+    generated = generate_advisories(df, rules)
+    df = df.copy()
+    count = 0
+    for column in generated.columns:
+        text = generated[column].to_numpy()
+        if column in df.columns:
+            existing = df[column].to_numpy(dtype=object)
+            blank = df[column].isna().to_numpy().copy()
+            entered = np.flatnonzero(~blank)
+            blank[entered] = [str(value).strip() in ("", "-", "nan") for value in existing[entered]]
+        else:
+            existing = np.full(len(df), None, dtype=object)
+            blank = np.ones(len(df), dtype=bool)
+        fill = blank & generated[column].notna().to_numpy()
+        count += int(fill.sum())
+        df[column] = np.where(fill, text, existing)
+    return df, count
+
+
+def apply_from_path(df, path):
+    """apply_advisories with the rules of a rule table, printing how many were generated"""
+    df, count = apply_advisories(df, load_rules(path))
+    logger.info("Generated %s advisories from %s", count, path)
+    return df
+
+
+def add_argument(parser, default=None):
+    """Add --advisory-rules to an argparse parser"""
+    parser.add_argument("--advisory-rules", nargs="?", const=DEFAULT_RULES, default=default, metavar="RULES",
+                        help="Generate the empty advisory columns from a rule table "
+                             f"(default table: {DEFAULT_RULES}); hand-entered advisories are kept")
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Preview the advisories a rule table generates for a workbook")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--rules", default=DEFAULT_RULES, help=f"Rule table (default: {DEFAULT_RULES})")
+    parser.add_argument("--output", default=None, help="Write the advisories to a CSV file instead of printing them")
+    args = parser.parse_args(argv)
+
+    df = pd.read_excel(args.excel)
+    generated = generate_advisories(df, load_rules(args.rules))
+    generated.insert(0, "Field", df["Field"] if "Field" in df.columns else df.index)
+    if args.output:
+        generated.to_csv(args.output, index=False)
+        print(f"Advisories written: {args.output}")
+    else:
+        for _, row in generated.iterrows():
+            print(f"\n{row['Field']}")
+            for index in INDICES:
+                advisory = row[f"{index} ADVISORY"]
+                print(f"  {index}: {'-' if pd.isna(advisory) else advisory}")
+
+
+if __name__ == "__main__":
+    main()
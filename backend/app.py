@@ -0,0 +1,555 @@
+"""
+Local report server for the crop reports
+
+Renders ``full_report_<Field>.html`` on demand instead of writing a report for
+every field to disk. The workbook is loaded once; rendered reports and index
+images are kept in a size-bounded LRU cache and served with ETags so browsers
+can revalidate with If-None-Match. When the workbook or a page template
+changes on disk the workbook is reloaded and the cache is dropped.
+
+With ``--hashed-assets`` the reports link the content-hashed copies of the
+shared assets in static/ (see static_assets.py), which are served with
+``Cache-Control: immutable`` so browsers fetch them once for all reports.
+
+With ``--bundle`` the server instead serves a packed batch written by
+``generate_report.py --bundle``: every report, image and asset is read from
+the archive at the offset its index records, without extracting anything.
+
+Usage:
+    python backend/app.py [--excel demo.xlsx] [--host 127.0.0.1] [--port 8000] [--cache-mb 64]
+    python backend/app.py --bundle reports/batch.zip
+
+Then open http://127.0.0.1:8000/ for the list of fields.
+"""
+import argparse
+import hashlib
+import html
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+# Make the report modules in the repository root importable when run as backend/app.py
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import advisory
+import cohort
+import contours
+import generate_report
+import hotspots
+import imagery
+import index_pages
+import logs
+import tiles
+import workbooks
+import zones
+
+logger = logging.getLogger(__name__)
+
+# A response body ready to be sent, together with its validator and caching policy
+CachedResponse = namedtuple("CachedResponse", ["body", "content_type", "etag", "cache_control"],
+                            defaults=("no-cache",))
+
+# Content-hashed files never change, so they can be cached for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Content types of the static files served from assest/ and static/
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".json": "application/json",
+}
+
+
+def make_response(body, content_type, cache_control="no-cache"):
+    """Wrap a body in a CachedResponse with a strong ETag derived from its content"""
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return CachedResponse(body, content_type, etag, cache_control)
+
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header value matches the given ETag"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def source_signature(excel_file, advisory_rules=None):
+    """
+    Fingerprint the inputs a rendered report depends on
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        advisory_rules (str): Rule table the advisories are generated from, if any
+
+    Returns:
+        tuple: (path, mtime, size) of the workbook, every page template and the rule table
+    """
+    templates = [f"{name}.html" for name in ("page1", generate_report.ZONES_PAGE)]
+    templates += [entry.template for entry in index_pages.INDEX_PAGES]
+    # A pattern of workbooks is fingerprinted by every workbook it matches, so new ones reload too
+    paths = workbooks.expand(excel_file) if workbooks.is_pattern(excel_file) else [excel_file]
+    paths += [os.path.join(generate_report.TEMPLATE_DIR, name) for name in sorted(set(templates))]
+    if advisory_rules:
+        paths.append(advisory_rules)
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of the cached bodies"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry.body)
+        # A body larger than the whole cache is served but never cached
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous.body)
+            self._entries[key] = entry
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class WorkbookContext:
+    """
+    Workbook rows and anchored images, loaded once and shared by all requests
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        fields (list): Field names or glob patterns to serve, None for every field
+        advisory_rules (str): Rule table to generate the empty advisory columns from
+        cohorts (bool): Rank every field against the fields of the same crop and growth stage
+        stale_imagery (bool): Hash the images and mark the pages with no new imagery
+        tile_pyramids (bool): Build the deep-zoom tile pyramids of the images
+        hotspot_options (dict): Options for hotspots.apply_and_report, to outline the stress hotspots
+        contour_options (dict): Options for contours.apply_and_report, to lay contour lines over the images
+        zone_count: "auto" or the number of management zones to split every field into
+    """
+
+    def __init__(self, excel_file, fields=None, advisory_rules=None, cohorts=False, stale_imagery=False,
+                 tile_pyramids=False, hotspot_options=None, contour_options=None, zone_count=None):
+        self.excel_file = excel_file
+        self.fields = fields
+        self.signature = source_signature(excel_file, advisory_rules)
+
+        # Sanitized field name -> row data, and (field name, image file) -> raw image bytes
+        self.rows = {}
+        self.images = {}
+        df, field_images = generate_report.read_selected_fields(excel_file, fields)
+        if df is not None and advisory_rules:
+            df = advisory.apply_from_path(df, advisory_rules)
+        if df is not None and stale_imagery:
+            df = imagery.apply_and_report(df, field_images)
+        if df is not None and tile_pyramids:
+            df = tiles.apply_and_build(df, field_images)
+        if df is not None and hotspot_options is not None:
+            df = hotspots.apply_and_report(df, field_images, hotspot_options)
+        if df is not None and contour_options is not None:
+            df = contours.apply_and_report(df, field_images, contour_options)
+        if df is not None and zone_count is not None:
+            df = zones.apply_and_report(df, field_images, zone_count)
+        if df is not None and cohorts:
+            df = cohort.apply_and_report(df)
+        if df is not None:
+            for index, row in df.iterrows():
+                field_name = generate_report.sanitize_field_name(row, index)
+                self.rows[field_name] = row
+                for image_file, data in field_images[index].items():
+                    self.images[(field_name, image_file)] = data
+        logger.info("Loaded %s fields from %s", len(self.rows), excel_file)
+
+
+class ReportApp:
+    """Routes requests to cached or freshly rendered reports, images and assets"""
+
+    def __init__(self, excel_file, cache_bytes, fields=None, hashed_assets=False, advisory_rules=None,
+                 cohorts=False, stale_imagery=False, tile_pyramids=False, hotspot_options=None,
+                 contour_options=None, zone_count=None):
+        self.excel_file = excel_file
+        self.fields = fields
+        self.advisory_rules = advisory_rules
+        self.cohorts = cohorts
+        self.stale_imagery = stale_imagery
+        self.tile_pyramids = tile_pyramids
+        self.hotspot_options = hotspot_options
+        self.contour_options = contour_options
+        self.zone_count = zone_count
+        self.assets = None
+        if hashed_assets:
+            import static_assets
+            self.assets = static_assets.build()
+        self.cache = LRUCache(cache_bytes)
+        self._context = WorkbookContext(excel_file, fields, advisory_rules, cohorts, stale_imagery, tile_pyramids,
+                                        hotspot_options, contour_options, zone_count)
+        self._context_lock = threading.Lock()
+        self._render_locks = {}
+        self._render_locks_lock = threading.Lock()
+
+    def context(self):
+        """Return the workbook context, reloading it if the workbook or templates changed"""
+        signature = source_signature(self.excel_file, self.advisory_rules)
+        if signature != self._context.signature:
+            with self._context_lock:
+                if signature != self._context.signature:
+                    logger.info("Workbook, templates or advisory rules changed, reloading and dropping cached reports")
+                    self._context = WorkbookContext(self.excel_file, self.fields, self.advisory_rules, self.cohorts,
+                                                    self.stale_imagery, self.tile_pyramids, self.hotspot_options,
+                                                    self.contour_options, self.zone_count)
+                    self.cache.clear()
+        return self._context
+
+    def handle(self, path):
+        """
+        Resolve a request path to a response
+
+        Args:
+            path (str): URL-decoded request path
+
+        Returns:
+            CachedResponse or None: The response, or None if nothing lives at path
+        """
+        context = self.context()
+        parts = [part for part in path.split("/") if part]
+
+        if not parts or parts == ["reports"]:
+            return self._index(context)
+
+        if parts == ["_stats"]:
+            return make_response(json.dumps(self.cache.stats()).encode("utf-8"), "application/json")
+
+        if len(parts) == 2 and parts[0] == "reports":
+            name = parts[1]
+            if name.startswith("full_report_") and name.endswith(".html"):
+                field_name = name[len("full_report_"):-len(".html")]
+                if field_name in context.rows:
+                    return self._cached(context, ("report", field_name),
+                                        lambda: self._render_report(context, field_name))
+            return None
+
+        if len(parts) == 3 and parts[0] == "images":
+            field_name, image_file = parts[1], parts[2]
+            if field_name in context.rows and image_file in generate_report.IMAGE_COLUMNS.values():
+                return self._cached(context, ("image", field_name, image_file),
+                                    lambda: self._render_image(context, field_name, image_file))
+            return None
+
+        if len(parts) == 2 and parts[0] in ("assest", "static"):
+            return self._asset(parts[0], parts[1])
+
+        # static/tiles/<pyramid>/pyramid.json and static/tiles/<pyramid>/<level>/<column>_<row>.png
+        if len(parts) in (4, 5) and parts[:2] == ["static", "tiles"]:
+            return self._asset("/".join(parts[:-1]), parts[-1])
+
+        return None
+
+    def _cached(self, context, key, render):
+        """Return the cached response for key, rendering it at most once at a time"""
+        key = (context.signature,) + key
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+
+        # Single-flight: concurrent requests for the same report wait for one render
+        with self._render_locks_lock:
+            lock = self._render_locks.setdefault(key, threading.Lock())
+        with lock:
+            response = self.cache.get(key)
+            if response is None:
+                response = render()
+                if response is not None:
+                    self.cache.put(key, response)
+        with self._render_locks_lock:
+            self._render_locks.pop(key, None)
+        return response
+
+    def _render_report(self, context, field_name):
+        import pandas as pd
+
+        single_row_data = pd.DataFrame([context.rows[field_name]])
+        field_images_dir = os.path.join("images", field_name)
+        combined_html = generate_report.render_field_report(
+            context.excel_file, single_row_data, field_name, field_images_dir, self.assets)
+        return make_response(combined_html.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _render_image(self, context, field_name, image_file):
+        data = context.images.get((field_name, image_file))
+        if data is None:
+            # Same fallbacks as extract_field_images: previously extracted or default images
+            for path in (os.path.join("images", field_name, image_file), os.path.join("images", image_file)):
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        return make_response(f.read(), "image/png")
+            return None
+
+        from PIL import Image
+
+        # Re-encode as PNG, as extract_field_images does when saving to disk
+        output = io.BytesIO()
+        Image.open(io.BytesIO(data)).save(output, format="PNG")
+        return make_response(output.getvalue(), "image/png")
+
+    def _asset(self, directory, name):
+        if name != os.path.basename(name) or any(part.startswith(".") for part in directory.split("/") + [name]):
+            return None
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = ("asset", directory, name, stat.st_mtime_ns, stat.st_size)
+        response = self.cache.get(key)
+        if response is None:
+            with open(path, "rb") as f:
+                body = f.read()
+            content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+            # Everything in static/ but the manifest has a content hash in its name, or its pyramid's
+            immutable = directory.split("/")[0] == "static" and name != "manifest.json"
+            response = make_response(body, content_type, IMMUTABLE if immutable else "no-cache")
+            self.cache.put(key, response)
+        return response
+
+    def _index(self, context):
+        links = "\n".join(
+            f'    <li><a href="/reports/full_report_{quote(name)}.html">{html.escape(name)}</a></li>'
+            for name in sorted(context.rows)
+        )
+        body = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8"/>
+    <title>SiDRA Hub Crop Reports</title>
+</head>
+<body>
+    <h1>Crop Reports</h1>
+    <ul>
+{links}
+    </ul>
+</body>
+</html>
+"""
+        return make_response(body.encode("utf-8"), "text/html; charset=utf-8")
+
+
+class BundleApp:
+    """
+    Serves the reports, images and assets of a packed bundle
+
+    Args:
+        bundle_path (str): Path of a bundle written by generate_report.py --bundle
+    """
+
+    def __init__(self, bundle_path):
+        import bundle
+
+        self.bundle = bundle.Bundle(bundle_path)
+
+    def handle(self, path):
+        """
+        Resolve a request path to a response read from the bundle
+
+        Args:
+            path (str): URL-decoded request path
+
+        Returns:
+            CachedResponse or None: The response, or None if the bundle has nothing at path
+        """
+        parts = [part for part in path.split("/") if part]
+        if not parts or parts == ["reports"]:
+            return self._index()
+
+        name = "/".join(parts)
+        if ".." in parts or name not in self.bundle:
+            return None
+        entry = self.bundle.entries[name]
+        # The index already has the content hash, so the ETag costs nothing to compute
+        cache_control = IMMUTABLE if parts[0] == "static" else "no-cache"
+        return CachedResponse(self.bundle.read(name), entry["content_type"], '"' + entry["sha256"] + '"',
+                              cache_control)
+
+    def _index(self):
+        links = "\n".join(
+            f'    <li><a href="/{quote(field["report"])}">{html.escape(field["name"])}</a></li>'
+            for field in sorted(self.bundle.fields, key=lambda field: field["name"])
+        )
+        body = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8"/>
+    <title>SiDRA Hub Crop Reports</title>
+</head>
+<body>
+    <h1>Crop Reports</h1>
+    <ul>
+{links}
+    </ul>
+</body>
+</html>
+"""
+        return make_response(body.encode("utf-8"), "text/html; charset=utf-8")
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    server_version = "SiDRAReportServer/1.0"
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        path = unquote(urlparse(self.path).path)
+        try:
+            response = self.server.app.handle(path)
+        except Exception as e:
+            logger.error("Error serving %s: %s", path, e)
+            self.send_error(500, "Error rendering report")
+            return
+
+        if response is None:
+            self.send_error(404, "Not found")
+            return
+
+        # Conditional GET: the client already has this exact version
+        if etag_matches(self.headers.get("If-None-Match"), response.etag):
+            self.send_response(304)
+            self.send_header("ETag", response.etag)
+            self.send_header("Cache-Control", response.cache_control)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.send_header("ETag", response.etag)
+        self.send_header("Cache-Control", response.cache_control)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(response.body)
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, app):
+        super().__init__(address, ReportRequestHandler)
+        self.app = app
+
+
+def add_arguments(parser):
+    """Add the server options to an argparse parser"""
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--cache-mb", type=float, default=64, help="Size limit of the render cache in MB (default: 64)")
+    parser.add_argument("--bundle", default=argparse.SUPPRESS, metavar="PATH",
+                        help="Serve a packed bundle written by generate_report.py --bundle instead of rendering")
+    parser.add_argument("--hashed-assets", action="store_true", default=argparse.SUPPRESS,
+                        help="Link the shared assets as content-hashed files in static/, cached for good")
+    advisory.add_argument(parser, default=argparse.SUPPRESS)
+    cohort.add_argument(parser, default=argparse.SUPPRESS)
+    imagery.add_argument(parser, default=argparse.SUPPRESS)
+    tiles.add_argument(parser, default=argparse.SUPPRESS)
+    hotspots.add_arguments(parser, default=argparse.SUPPRESS)
+    contours.add_arguments(parser, default=argparse.SUPPRESS)
+    zones.add_argument(parser, default=argparse.SUPPRESS)
+
+
+def run_from_args(args):
+    """Start the server with options parsed by a parser set up with add_arguments"""
+    bundle_path = getattr(args, "bundle", None)
+    if bundle_path:
+        app = BundleApp(os.path.abspath(bundle_path))
+    else:
+        # Templates, assets and images are resolved relative to the repository root
+        excel_file = os.path.abspath(args.excel) if args.excel else os.path.join(ROOT_DIR, "demo.xlsx")
+        advisory_rules = getattr(args, "advisory_rules", None)
+        if advisory_rules and os.path.exists(advisory_rules):
+            advisory_rules = os.path.abspath(advisory_rules)
+        os.chdir(ROOT_DIR)
+        app = ReportApp(excel_file, int(args.cache_mb * 1024 * 1024), fields=args.field,
+                        hashed_assets=getattr(args, "hashed_assets", False),
+                        advisory_rules=advisory_rules, cohorts=getattr(args, "cohorts", False),
+                        stale_imagery=getattr(args, "stale_imagery", False),
+                        tile_pyramids=getattr(args, "tiles", False),
+                        hotspot_options=hotspots.options_from_args(args),
+                        contour_options=contours.options_from_args(args),
+                        zone_count=getattr(args, "zones", None))
+    server = ReportServer((args.host, args.port), app)
+    logger.info("Serving crop reports on http://%s:%s/", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve crop reports rendered on demand from the workbook")
+    parser.add_argument("--excel", default=None, help="Excel file with crop data (default: demo.xlsx in the repository root)")
+    generate_report.field_index.add_field_argument(parser)
+    add_arguments(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+    run_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
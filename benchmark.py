@@ -0,0 +1,309 @@
+"""
+Benchmarks for the report generator
+
+Usage:
+    python benchmark.py [startup|render|size|hotspots|contours|all] [--repeat 5]
+
+startup measures the cumulative import time of the entry point and page
+modules with ``python -X importtime`` and the wall-clock time of
+``generate_report.py --help``. It exits with status 1 when a module exceeds
+its budget or pulls in one of the heavy dependencies at import time, so
+module-level imports of pandas, openpyxl, PIL or numpy can't creep back in.
+
+render times a full batch over demo.xlsx in a scratch copy of the project.
+
+size runs the batch with and without --precompress and reports the size of the
+reports as written, minified, gzipped and brotli-compressed, together with the
+wall-clock cost of compressing.
+
+hotspots times the hotspot labeling and outline of hotspots.py on a synthetic
+HOTSPOT_MAP_SIZE x HOTSPOT_MAP_SIZE index map, and exits with status 1 when it
+takes longer than its budget.
+
+contours times tracing and simplifying the contour overlay of contours.py on
+the same map, with the same exit status.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dependencies that must only be imported on first use
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "PIL"]
+
+# Cumulative import time budget in milliseconds for each module
+STARTUP_BUDGET_MS = {
+    "generate_report": 120,
+    "page1": 40,
+    "page2": 40,
+    "page3": 40,
+    "page4": 40,
+    "page5": 40,
+    "page6": 40,
+    "page7": 40,
+    "index_pages": 40,
+    "pipeline": 250,
+    "job_queue": 250,
+    "isolation": 250,
+    "journal": 40,
+    "workbooks": 40,
+    "results": 40,
+    "bundle": 80,
+    "dashboard": 120,
+    "precompress": 80,
+    "static_assets": 80,
+    "advisory": 40,
+    "cohort": 40,
+    "validation": 40,
+    "progress": 40,
+    "logs": 40,
+    "imagery": 40,
+    "tiles": 40,
+    "index_maps": 40,
+    "hotspots": 40,
+    "contours": 40,
+    "zones": 40,
+    "backend.app": 250,
+}
+
+# Wall-clock budget in milliseconds for "generate_report.py --help", interpreter start-up included
+HELP_BUDGET_MS = 600
+
+# Side in pixels of the synthetic index map of the hotspots benchmark, and its budget in milliseconds
+HOTSPOT_MAP_SIZE = 4096
+HOTSPOT_BUDGET_MS = 500
+
+# Budget in milliseconds for the contour overlay of the same map
+CONTOUR_BUDGET_MS = 800
+
+# Data files and directories a batch run needs besides the Python modules
+PROJECT_FILES = ["demo.xlsx", "templete", "assest", "images", "backend"]
+
+
+def measure_import(module):
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Returns:
+        tuple: (cumulative import time in ms, set of all modules imported)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=ROOT_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative[fields[2].strip()] = int(fields[1])
+        except (IndexError, ValueError):
+            # Column header line
+            continue
+    return cumulative.get(module, 0) / 1000, set(cumulative)
+
+
+def bench_startup(repeat):
+    """Check import times against their budgets, returning the list of failures"""
+    failures = []
+    print("Start-up (best of %d)" % repeat)
+    for module, budget_ms in STARTUP_BUDGET_MS.items():
+        timings = []
+        imported = set()
+        for _ in range(repeat):
+            elapsed_ms, imported = measure_import(module)
+            timings.append(elapsed_ms)
+        best_ms = min(timings)
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+        status = "ok"
+        if heavy:
+            status = "FAIL (imports " + ", ".join(heavy) + ")"
+            failures.append(f"{module} imports {', '.join(heavy)} at module level")
+        elif best_ms > budget_ms:
+            status = "FAIL (over budget)"
+            failures.append(f"{module} import took {best_ms:.1f} ms, budget {budget_ms} ms")
+        print(f"  {'import ' + module:<25} {best_ms:8.1f} ms  budget {budget_ms:4d} ms  {status}")
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "generate_report.py", "--help"], cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    best_ms = min(timings)
+    status = "ok"
+    if best_ms > HELP_BUDGET_MS:
+        status = "FAIL (over budget)"
+        failures.append(f"generate_report.py --help took {best_ms:.1f} ms, budget {HELP_BUDGET_MS} ms")
+    print(f"  {'generate_report.py --help':<25} {best_ms:8.1f} ms  budget {HELP_BUDGET_MS:4d} ms  {status}")
+    return failures
+
+
+def copy_project(destination):
+    """Copy what a batch run needs into a scratch directory, leaving reports/ empty"""
+    modules = [name for name in os.listdir(ROOT_DIR) if name.endswith(".py")]
+    for name in modules + PROJECT_FILES:
+        source = os.path.join(ROOT_DIR, name)
+        target = os.path.join(destination, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, ignore=shutil.ignore_patterns("__pycache__"))
+        elif os.path.exists(source):
+            shutil.copy2(source, target)
+
+
+def bench_render(repeat):
+    """Time full batch runs of generate_report.py over demo.xlsx"""
+    print("Render (best of %d)" % repeat)
+    timings = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="sidra_bench_") as scratch:
+            copy_project(scratch)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "generate_report.py"], cwd=scratch,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            timings.append(time.perf_counter() - start)
+    print(f"  {'full batch (demo.xlsx)':<25} {min(timings) * 1000:8.1f} ms")
+    return []
+
+
+def report_sizes(directory):
+    """Total bytes of the full reports in a directory, keyed by file name suffix ("", ".gz", ".br")"""
+    sizes = {}
+    for name in os.listdir(directory):
+        if not name.startswith("full_report_"):
+            continue
+        suffix = name[name.index(".html") + len(".html"):]
+        sizes[suffix] = sizes.get(suffix, 0) + os.path.getsize(os.path.join(directory, name))
+    return sizes
+
+
+def bench_size(repeat):
+    """Compare the size and batch time of reports written with and without --precompress"""
+    print("Report size (best of %d)" % repeat)
+    results = {}
+    for label, options in (("plain", []), ("precompress", ["--precompress"])):
+        timings = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(prefix="sidra_bench_") as scratch:
+                copy_project(scratch)
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "generate_report.py"] + options, cwd=scratch,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                timings.append(time.perf_counter() - start)
+                sizes = report_sizes(os.path.join(scratch, "reports"))
+        results[label] = (min(timings), sizes)
+
+    raw = results["plain"][1].get("", 0)
+    plain_seconds, _ = results["plain"]
+    precompress_seconds, sizes = results["precompress"]
+    rows = [("as written", raw), ("minified", sizes.get("")), ("minified + gzip", sizes.get(".gz")),
+            ("minified + brotli", sizes.get(".br"))]
+    for label, size in rows:
+        if size is None:
+            print(f"  {label:<25} {'-':>10}     (brotli not installed)")
+        else:
+            reduction = 100 * (1 - size / raw) if raw else 0.0
+            print(f"  {label:<25} {size / 1024:8.1f} KB  {reduction:5.1f}% smaller")
+    print(f"  {'batch time':<25} {plain_seconds * 1000:8.1f} ms plain, "
+          f"{precompress_seconds * 1000:.1f} ms with --precompress")
+    return []
+
+
+def bench_hotspots(repeat):
+    """Time finding and outlining the hotspots of a large index map, returning the list of failures"""
+    import numpy as np
+
+    sys.path.insert(0, ROOT_DIR)
+    import hotspots
+
+    # Smooth stress patches with pixel noise on top, a round field in a transparent square
+    size = HOTSPOT_MAP_SIZE
+    y, x = np.mgrid[0:size, 0:size] / size
+    rng = np.random.default_rng(0)
+    values = (0.5 + 0.2 * np.sin(x * 20) * np.cos(y * 15)
+              + 0.05 * rng.standard_normal((size, size))).astype(np.float32)
+    values[(x - 0.5) ** 2 + (y - 0.5) ** 2 > 0.25] = np.nan
+
+    print("Hotspots (best of %d)" % repeat)
+    timings = {"find": [], "outline": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        regions, runs = hotspots.find_hotspots(values)
+        timings["find"].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        hotspots.outline_overlay(runs)
+        timings["outline"].append(time.perf_counter() - start)
+    best_ms = {name: min(times) * 1000 for name, times in timings.items()}
+    total_ms = best_ms["find"] + best_ms["outline"]
+    status = "ok" if total_ms <= HOTSPOT_BUDGET_MS else "FAIL (over budget)"
+    label = f"{size}x{size} map"
+    print(f"  {label:<25} {total_ms:8.1f} ms  budget {HOTSPOT_BUDGET_MS:4d} ms  {status}  "
+          f"({len(regions)} hotspots; labeling {best_ms['find']:.1f} ms, outline {best_ms['outline']:.1f} ms)")
+    if total_ms > HOTSPOT_BUDGET_MS:
+        return [f"hotspots of a {label} took {total_ms:.1f} ms, budget {HOTSPOT_BUDGET_MS} ms"]
+    return []
+
+
+def bench_contours(repeat):
+    """Time tracing and simplifying the contours of a large index map, returning the list of failures"""
+    import numpy as np
+
+    sys.path.insert(0, ROOT_DIR)
+    import contours
+
+    # The map of the hotspots benchmark
+    size = HOTSPOT_MAP_SIZE
+    y, x = np.mgrid[0:size, 0:size] / size
+    rng = np.random.default_rng(0)
+    values = (0.5 + 0.2 * np.sin(x * 20) * np.cos(y * 15)
+              + 0.05 * rng.standard_normal((size, size))).astype(np.float32)
+    values[(x - 0.5) ** 2 + (y - 0.5) ** 2 > 0.25] = np.nan
+
+    print("Contours (best of %d)" % repeat)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        svg, vertices = contours.contour_svg(values)
+        timings.append(time.perf_counter() - start)
+    total_ms = min(timings) * 1000
+    status = "ok" if total_ms <= CONTOUR_BUDGET_MS else "FAIL (over budget)"
+    label = f"{size}x{size} map"
+    print(f"  {label:<25} {total_ms:8.1f} ms  budget {CONTOUR_BUDGET_MS:4d} ms  {status}  "
+          f"({vertices} vertices, {len(svg)} bytes of SVG)")
+    if total_ms > CONTOUR_BUDGET_MS:
+        return [f"contours of a {label} took {total_ms:.1f} ms, budget {CONTOUR_BUDGET_MS} ms"]
+    return []
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "render": bench_render,
+    "size": bench_size,
+    "hotspots": bench_hotspots,
+    "contours": bench_contours,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crop report generator")
+    parser.add_argument("benchmark", nargs="?", default="all", choices=["all"] + list(BENCHMARKS),
+                        help="Benchmark to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the best is reported")
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    failures = []
+    for name in names:
+        failures += BENCHMARKS[name](args.repeat)
+
+    if failures:
+        print("\nBudget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
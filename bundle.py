@@ -0,0 +1,241 @@
+"""
+Packed output bundles with a random-access index
+
+Instead of one HTML file per field in reports/ and ten PNGs per field in
+images/<field>/, a batch can be written as a single zip archive. Members keep
+the project layout, so the relative links in the reports still resolve:
+
+    reports/full_report_<field>.html   deflated
+    images/<field>/<index image>.png   stored (uncompressed)
+    assest/<asset>                     stored
+    index.json                         the central index
+
+Identical content is stored once: a field image that equals another field's,
+or the default image, only adds an index entry pointing at the existing
+member. index.json maps every path to its member, the byte offset and size of
+the member's data in the archive, its compression and SHA-256, so a reader can
+serve any path with a single positioned read and no extraction.
+
+Usage:
+    python bundle.py list reports/batch.zip
+    python bundle.py cat reports/batch.zip reports/full_report_Trichy_Field_1.html > report.html
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sys
+import threading
+import zipfile
+import zlib
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+
+# Name of the index member
+INDEX_MEMBER = "index.json"
+
+METHODS = {zipfile.ZIP_STORED: "stored", zipfile.ZIP_DEFLATED: "deflated"}
+
+
+def content_type(name):
+    guessed, _ = mimetypes.guess_type(name)
+    if guessed and guessed.startswith("text/"):
+        return guessed + "; charset=utf-8"
+    return guessed or "application/octet-stream"
+
+
+class BundleWriter:
+    """
+    Stream reports and images into a bundle
+
+    The archive is written under a temporary name and renamed into place by
+    close(), so an interrupted batch never leaves a bundle without its index.
+
+    Args:
+        path (str): Path of the bundle to write
+        excel_file (str): Workbook the batch was generated from, recorded in the index
+    """
+
+    def __init__(self, path, excel_file=None):
+        self.path = path
+        self.temp_path = f"{path}.{os.getpid()}.tmp"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.excel_file = excel_file
+        self.zip = zipfile.ZipFile(self.temp_path, "w", allowZip64=True)
+        self.entries = {}
+        self.fields = []
+        # SHA-256 of every member written -> its index entry, for deduplication
+        self._members = {}
+        self._lock = threading.Lock()
+        self.stored_bytes = 0
+        self.deduplicated_bytes = 0
+
+    def add(self, name, data, compress=False):
+        """
+        Add a file to the bundle, storing its content only if it isn't there yet
+
+        Args:
+            name (str): Path of the file inside the bundle, e.g. images/<field>/old_ndvi.png
+            data (bytes): File content
+            compress (bool): Deflate the member; images are already compressed and stored as is
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            existing = self._members.get(sha256)
+            if existing is not None:
+                self.entries[name] = dict(existing, content_type=content_type(name))
+                self.deduplicated_bytes += len(data)
+                return
+
+            info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            self.zip.writestr(info, data)
+            # writestr leaves the file positioned right after the member's data
+            offset = self.zip.fp.tell() - info.compress_size
+            entry = {
+                "member": name,
+                "offset": offset,
+                "size": info.compress_size,
+                "length": len(data),
+                "method": METHODS[info.compress_type],
+                "sha256": sha256,
+            }
+            self._members[sha256] = entry
+            self.entries[name] = dict(entry, content_type=content_type(name))
+            self.stored_bytes += info.compress_size
+
+    def add_directory(self, directory, prefix=None):
+        """Add every file of a directory, e.g. the shared assets, under prefix/"""
+        prefix = prefix or os.path.basename(os.path.normpath(directory))
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    self.add(f"{prefix}/{name}", f.read())
+
+    def add_field(self, field, field_name, report_html, images):
+        """
+        Add the report and index images of one field
+
+        Args:
+            field (str): Field name as it appears in the workbook
+            field_name (str): Sanitized field name
+            report_html (str): Combined report HTML
+            images (dict): Image file name mapped to the PNG bytes
+        """
+        report = f"reports/full_report_{field_name}.html"
+        self.add(report, report_html.encode("utf-8"), compress=True)
+        for image_file, data in images.items():
+            self.add(f"images/{field_name}/{image_file}", data)
+        with self._lock:
+            self.fields.append({"field": field, "name": field_name, "report": report})
+
+    def close(self):
+        """Write the index, finish the archive and move it into place"""
+        index = {
+            "version": BUNDLE_VERSION,
+            "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "workbook": os.path.basename(self.excel_file) if self.excel_file else None,
+            "fields": self.fields,
+            "entries": self.entries,
+        }
+        self.zip.writestr(INDEX_MEMBER, json.dumps(index, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+        self.zip.close()
+        os.replace(self.temp_path, self.path)
+        logger.info("Bundle written: %s (%d fields, %d files, %.0f KB deduplicated)",
+                    self.path, len(self.fields), len(self.entries), self.deduplicated_bytes / 1024)
+
+    def abort(self):
+        """Discard a bundle that could not be completed"""
+        self.zip.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class Bundle:
+    """
+    Random-access reader for a bundle
+
+    Only the zip central directory and the index are read when the bundle is
+    opened; each file is then read with one positioned read at the offset the
+    index records. Safe to share between threads.
+
+    Args:
+        path (str): Path of the bundle
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            index = json.loads(archive.read(INDEX_MEMBER))
+        if index.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"{path} has bundle version {index.get('version')}, expected {BUNDLE_VERSION}")
+        self.fields = index["fields"]
+        self.entries = index["entries"]
+        self.workbook = index.get("workbook")
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._file.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def _read_at(self, offset, size):
+        if hasattr(os, "pread"):
+            return os.pread(self._file.fileno(), size, offset)
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def read(self, name):
+        """
+        Return the content of a file in the bundle
+
+        Raises:
+            KeyError: If the bundle has no such file
+        """
+        entry = self.entries[name]
+        data = self._read_at(entry["offset"], entry["size"])
+        if entry["method"] == "deflated":
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect packed report bundles")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    list_parser = commands.add_parser("list", help="List the files in a bundle")
+    list_parser.add_argument("bundle", help="Bundle to read")
+    cat_parser = commands.add_parser("cat", help="Write one file of a bundle to standard output")
+    cat_parser.add_argument("bundle", help="Bundle to read")
+    cat_parser.add_argument("name", help="Path inside the bundle, e.g. reports/full_report_<field>.html")
+    args = parser.parse_args(argv)
+
+    bundle = Bundle(args.bundle)
+    try:
+        if args.command == "list":
+            for name, entry in sorted(bundle.entries.items()):
+                shared = "" if entry["member"] == name else f"  -> {entry['member']}"
+                print(f"{entry['length']:>10}  {entry['method']:<8}  {name}{shared}")
+        else:
+            try:
+                sys.stdout.buffer.write(bundle.read(args.name))
+            except KeyError:
+                raise SystemExit(f"Error: {args.name} is not in {args.bundle}")
+    finally:
+        bundle.close()
+
+
+if __name__ == "__main__":
+    main()
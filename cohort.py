@@ -0,0 +1,222 @@
+"""
+Cohort statistics: how each field compares with similar fields of the batch
+
+With ``--cohorts`` the fields of a batch are grouped by crop and growth stage
+("Crop" and "Maturity" columns) before any report is rendered, and for every
+index value and its change since the old image the percentile, z-score and rank
+of each field within its cohort are computed in one vectorized groupby pass
+over the whole sheet. Pages 2-6 then show a line such as
+
+    62nd percentile among paddy fields (rank 5 of 40); change since the last image: 80th percentile
+
+under the advisory, and flag the field as an outlier when a value or change is
+more than OUTLIER_Z standard deviations from its cohort's mean. Fields without a
+crop or stage form a cohort of their own. Cohorts smaller than MIN_COHORT_SIZE
+are not ranked, so a sheet of a handful of fields renders as before.
+
+The statistics are added to the workbook rows as "Cohort ..." columns, so they
+reach the pages of the batch, pipeline, isolated and server paths alike. With
+``--field`` the cohorts are made of the selected fields only.
+
+Usage:
+    python cohort.py [--excel demo.xlsx] [--output cohorts.csv]
+"""
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fewest fields with a value a cohort needs before its fields are ranked
+MIN_COHORT_SIZE = 5
+
+# Distance from the cohort mean, in standard deviations, beyond which a field is flagged
+OUTLIER_Z = 2.5
+
+# Statistics computed for every index: "<INDEX> value" and "<INDEX> change"
+MEASURES = ["value", "change"]
+
+
+def _ordinal(number):
+    """1 -> "1st", 2 -> "2nd", 11 -> "11th", 23 -> "23rd" """
+    suffix = "th" if 10 <= number % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+
+def _flagged(value):
+    """True for an outlier flag that is set, False for one that is unset or missing"""
+    import pandas as pd
+
+    return bool(pd.notna(value) and value)
+
+
+def _cohort_label(crop, stage):
+    if not crop:
+        return "fields with no crop recorded"
+    return f"{crop} fields at the {stage} stage" if stage else f"{crop} fields"
+
+
+def compute_cohorts(df):
+    """
+    Rank every field against the fields of the same crop and growth stage
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+
+    Returns:
+        pandas.DataFrame: Same index as df with the columns "Cohort" (label),
+            "Cohort size" and, for every index and measure (value, change),
+            "Cohort <INDEX> <measure> percentile" (0 lowest to 100 highest),
+            "... zscore", "... rank" (1 for the highest) and "... outlier";
+            missing where the field has no number or its cohort is too small
+    """
+    import numpy as np
+    import pandas as pd
+
+    import advisory
+    import imagery
+
+    crops = advisory.label_column(df, advisory.CROP_COLUMN)
+    stages = advisory.label_column(df, advisory.STAGE_COLUMN)
+
+    numbers = {}
+    for index in advisory.INDICES:
+        values = advisory.number_column(df, f"{index} value")
+        old_values = advisory.number_column(df, f"Old {index} value")
+        # A missing change is computed from the old value, as the advisories do
+        changes = advisory.number_column(df, f"{index} change")
+        changes = np.where(np.isnan(changes), values - old_values, changes)
+        # and there is none where the old and current image are the same (--stale-imagery)
+        numbers[f"{index} value"] = values
+        numbers[f"{index} change"] = np.where(imagery.stale_mask(df, index), np.nan, changes)
+    numbers = pd.DataFrame(numbers, index=df.index)
+
+    # One groupby for all indices and measures at once
+    keys = [pd.Series(crops, index=df.index, name="crop"), pd.Series(stages, index=df.index, name="stage")]
+    grouped = numbers.groupby(keys, sort=False)
+    count = grouped.transform("count")
+    mean = grouped.transform("mean")
+    std = grouped.transform("std", ddof=0)
+    ascending = grouped.rank(method="average")
+    descending = grouped.rank(method="min", ascending=False)
+
+    ranked = count >= MIN_COHORT_SIZE
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentile = (100 * (ascending - 1) / (count - 1)).round().where(ranked)
+        # A cohort where every field has the same number has no spread and no outliers
+        zscore = ((numbers - mean) / std).where(std > 0, 0.0).where(ranked & numbers.notna())
+    outlier = (zscore.abs() >= OUTLIER_Z).where(zscore.notna())
+
+    stats = pd.DataFrame(index=df.index)
+    stats["Cohort"] = [_cohort_label(crop, stage) for crop, stage in zip(crops, stages)]
+    stats["Cohort size"] = grouped[numbers.columns[0]].transform("size")
+    columns = {}
+    for column in numbers.columns:
+        columns[f"Cohort {column} percentile"] = percentile[column]
+        columns[f"Cohort {column} zscore"] = zscore[column].round(2)
+        columns[f"Cohort {column} rank"] = descending[column].where(ranked[column]).astype("Int64")
+        columns[f"Cohort {column} count"] = count[column]
+        columns[f"Cohort {column} outlier"] = outlier[column].astype("boolean")
+    return pd.concat([stats, pd.DataFrame(columns, index=df.index)], axis=1)
+
+
+def apply_cohorts(df):
+    """
+    Add the cohort statistics of compute_cohorts to the workbook rows
+
+    Returns:
+        tuple: (copy of df with the "Cohort ..." columns, number of outlier fields)
+    """
+    import pandas as pd
+
+    stats = compute_cohorts(df)
+    df = pd.concat([df.drop(columns=[c for c in stats.columns if c in df.columns]), stats], axis=1)
+    flags = stats[[c for c in stats.columns if c.endswith(" outlier")]].fillna(False)
+    return df, int(flags.any(axis=1).sum())
+
+
+def apply_and_report(df):
+    """apply_cohorts, logging how many cohorts were ranked and how many fields were flagged"""
+    df, outliers = apply_cohorts(df)
+    sizes = df.drop_duplicates("Cohort")["Cohort size"]
+    logger.info("Cohorts: %d (%d large enough to rank), %d outlier fields",
+                len(sizes), int((sizes >= MIN_COHORT_SIZE).sum()), outliers)
+    return df
+
+
+def page_note(df, index):
+    """
+    HTML line comparing the field of a page with its cohort for one index
+
+    Args:
+        df (pandas.DataFrame): Row data of the field, with the columns of apply_cohorts
+        index (str): Index of the page, e.g. "NDVI"
+
+    Returns:
+        str: The line, or "" when the batch computed no cohorts or the field wasn't ranked
+    """
+    import pandas as pd
+
+    try:
+        row = df.iloc[0]
+        percentile = row[f"Cohort {index} value percentile"]
+    except (IndexError, KeyError):
+        return ""
+    if pd.isna(percentile):
+        return ""
+
+    text = (f"{_ordinal(int(percentile))} percentile among {row['Cohort']} "
+            f"(rank {int(row[f'Cohort {index} value rank'])} of {int(row[f'Cohort {index} value count'])})")
+    change = row.get(f"Cohort {index} change percentile")
+    if pd.notna(change):
+        text += f"; change since the last image: {_ordinal(int(change))} percentile"
+
+    badges = ""
+    for measure, name in (("value", index), ("change", f"{index} change")):
+        if _flagged(row.get(f"Cohort {index} {measure} outlier")):
+            zscore = row[f"Cohort {index} {measure} zscore"]
+            direction = "high" if zscore > 0 else "low"
+            badges += (f' <span class="ml-1 px-2 rounded bg-red-100 text-red-700 font-bold" '
+                       f'title="z-score {zscore:+.2f} within the cohort">Outlier: {name} unusually {direction}</span>')
+    return f'<p class="mt-2 text-[13px] text-gray-700">{text}{badges}</p>'
+
+
+def add_argument(parser, default=False):
+    """Add --cohorts to an argparse parser"""
+    parser.add_argument("--cohorts", action="store_true", default=default,
+                        help="Rank every field against the fields of the same crop and growth stage "
+                             "and flag outliers on pages 2-6")
+
+
+def main(argv=None):
+    import pandas as pd
+
+    import advisory
+
+    parser = argparse.ArgumentParser(description="Compute the cohort statistics of a workbook")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default=None, help="Write the statistics to a CSV file instead of printing them")
+    args = parser.parse_args(argv)
+
+    df = pd.read_excel(args.excel)
+    stats = compute_cohorts(df)
+    stats.insert(0, "Field", df["Field"] if "Field" in df.columns else df.index)
+    if args.output:
+        stats.to_csv(args.output, index=False)
+        print(f"Cohort statistics written: {args.output}")
+    else:
+        for _, row in stats.iterrows():
+            print(f"\n{row['Field']} - {row['Cohort']} ({row['Cohort size']} fields)")
+            for index in advisory.INDICES:
+                cells = []
+                for measure in MEASURES:
+                    percentile = row[f"Cohort {index} {measure} percentile"]
+                    if pd.isna(percentile):
+                        cells.append(f"{measure} -")
+                        continue
+                    flag = " OUTLIER" if _flagged(row[f"Cohort {index} {measure} outlier"]) else ""
+                    cells.append(f"{measure} p{int(percentile)} z{row[f'Cohort {index} {measure} zscore']:+.2f}{flag}")
+                print(f"  {index}: {', '.join(cells)}")
+
+
+if __name__ == "__main__":
+    main()
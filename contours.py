@@ -0,0 +1,585 @@
+"""
+Contour overlays: the index maps traced into SVG lines at fixed levels
+
+The index images of the reports are PNGs, which blur when zoomed and can't be
+styled. With ``--contours`` every index image of the batch is decoded into its
+values (see index_maps.py) before rendering starts, and:
+
+- maps larger than TRACE_SIZE are block-averaged down to it
+- the map is traced at every level of LEVELS (positions on the colour scale of
+  the index, 0-1) with marching squares; every cell of four pixels is looked up
+  in a segment table by the pixels above the level, saddles split by the mean of
+  the cell, and the crossing points are interpolated along the cell edges
+- the segments are joined into polylines by the edge they share, with pointer
+  jumping instead of walking them one by one
+- the polylines are simplified by dropping the vertices that add the least
+  area to their line (Visvalingam-Whyatt, many vertices per round), until the
+  overlay of an image has at most VERTEX_BUDGET vertices
+- pages 2-6 lay the lines over the old and current image as inline SVG
+
+Every step is whole-array numpy; Python only loops over levels, rounds and the
+polylines written out, so a 4k x 4k map takes well under a second (``python
+benchmark.py contours``).
+
+The overlays are added to the workbook rows as "Contours ..." columns, so they
+reach the pages of the batch, pipeline, isolated and server paths alike.
+
+Usage:
+    python contours.py images/Trichy_Field_1/current_ndvi.png [--levels 0.25,0.5,0.75] [--output ndvi.svg]
+"""
+import argparse
+import functools
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Scale positions the maps are traced at
+LEVELS = (0.25, 0.5, 0.75)
+
+# Most vertices in the overlay of one image
+VERTEX_BUDGET = 1000
+
+# Vertices adding less than this area (square pixels of the traced map) to their line are dropped
+AREA_TOLERANCE = 0.5
+
+# Longest side in pixels of the map traced; larger maps are block-averaged down to it
+# first, as the vertex budget can't show finer detail anyway
+TRACE_SIZE = 1024
+
+# Polylines smaller than this many pixels across (of the traced map) are speckle
+MIN_EXTENT = 2.0
+
+# Most simplification rounds per tolerance, and most tolerances tried to meet the budget
+SIMPLIFY_ROUNDS = 64
+BUDGET_PASSES = 12
+
+# Colour of the lines, and their width in screen pixels at the lowest and highest level
+LINE_COLOR = "#111827"
+LINE_WIDTHS = (0.6, 1.4)
+
+
+@functools.lru_cache(maxsize=None)
+def segment_table():
+    """
+    Segments of every marching squares cell
+
+    The corners of a cell are numbered clockwise from the top left (top left, top
+    right, bottom right, bottom left) and edge k runs from corner k to corner k + 1.
+    A segment runs from the edge where the level is crossed upwards, walking
+    clockwise, to an edge where it is crossed downwards, so the higher side is
+    always on the same side of the line and neighbouring cells' segments join
+    end to start.
+
+    Returns:
+        numpy.ndarray: int8 array (32, 2, 2) of (start edge, end edge) of up to two
+            segments per case, -1 for none; case = (top left << 3 | top right << 2 |
+            bottom right << 1 | bottom left) + 16 for saddles whose high corners join
+    """
+    import numpy as np
+
+    table = np.full((32, 2, 2), -1, dtype=np.int8)
+    for case in range(32):
+        high = [bool(case & bit) for bit in (8, 4, 2, 1)]
+        up = [k for k in range(4) if not high[k] and high[(k + 1) % 4]]
+        down = [k for k in range(4) if high[k] and not high[(k + 1) % 4]]
+        for number, start in enumerate(up):
+            if case >= 16:
+                # The high corners join: cut off the low ones, pairing with the previous downward edge
+                end = next((start - step) % 4 for step in range(1, 4) if (start - step) % 4 in down)
+            else:
+                end = next((start + step) % 4 for step in range(1, 4) if (start + step) % 4 in down)
+            table[case, number] = start, end
+    return table
+
+
+def reduce_map(values, size=TRACE_SIZE):
+    """
+    Block-average a map to at most size pixels on its longest side
+
+    A block is outside the field when fewer than half its pixels are inside.
+
+    Returns:
+        tuple: (reduced map, block side in pixels of the original map)
+    """
+    import numpy as np
+
+    height, width = values.shape
+    factor = -(-max(height, width) // size)
+    if factor <= 1:
+        return values, 1
+    rows, columns = -(-height // factor), -(-width // factor)
+    padded = np.full((rows * factor, columns * factor), np.nan, dtype=np.float32)
+    padded[:height, :width] = values
+    blocks = padded.reshape(rows, factor, columns, factor)
+    inside = ~np.isnan(blocks)
+    counts = inside.sum(axis=(1, 3))
+    sums = np.where(inside, blocks, 0).sum(axis=(1, 3), dtype=np.float32)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(2 * counts > factor * factor, sums / counts, np.nan).astype(np.float32), factor
+
+
+def march(values, level):
+    """
+    Contour segments of a map at one level
+
+    Args:
+        values (numpy.ndarray): float (height, width) map, NaN outside the field
+        level (float): Value to trace
+
+    Returns:
+        tuple: (start edge ids, end edge ids) of the segments; an edge id names the
+            pixel pair a point lies between, horizontal pairs first (see edge_points)
+    """
+    import numpy as np
+
+    height, width = values.shape
+    with np.errstate(invalid="ignore"):
+        high = (values >= level).view(np.uint8)
+    case = (high[:-1, :-1] << 3) | (high[:-1, 1:] << 2) | (high[1:, 1:] << 1) | high[1:, :-1]
+    cells = np.flatnonzero((case != 0) & (case != 15))
+    rows, columns = np.divmod(cells, width - 1)
+    corners = np.stack([values[rows, columns], values[rows, columns + 1],
+                        values[rows + 1, columns + 1], values[rows + 1, columns]])
+
+    # Cells touching the outside of the field have no contour
+    inside = ~np.isnan(corners).any(axis=0)
+    rows, columns, corners = rows[inside], columns[inside], corners[:, inside]
+    cases = case.ravel()[cells[inside]].astype(np.intp)
+    saddles = (cases == 5) | (cases == 10)
+    cases[saddles & (corners.mean(axis=0) >= level)] += 16
+
+    # Edge ids of the top, right, bottom and left edge of every cell
+    top = rows * width + columns
+    vertical = height * width + rows * width + columns
+    edges = np.stack([top, vertical + 1, top + width, vertical])
+
+    table = segment_table()[cases]
+    starts, ends = [], []
+    for number in range(2):
+        present = np.flatnonzero(table[:, number, 0] >= 0)
+        starts.append(edges[table[present, number, 0], present])
+        ends.append(edges[table[present, number, 1], present])
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def edge_points(values, level, ids):
+    """(x, y) of the crossing points of the level on the given edge ids, in pixel-centre coordinates"""
+    import numpy as np
+
+    height, width = values.shape
+    vertical = ids >= height * width
+    rows, columns = np.divmod(np.where(vertical, ids - height * width, ids), width)
+    first = values[rows, columns]
+    second = np.where(vertical, values[np.minimum(rows + 1, height - 1), columns],
+                      values[rows, np.minimum(columns + 1, width - 1)])
+    offset = (level - first) / (second - first)
+    x = columns + np.where(vertical, 0, offset) + 0.5
+    y = rows + np.where(vertical, offset, 0) + 0.5
+    return np.stack([x, y], axis=1)
+
+
+def link(starts, ends):
+    """
+    Join segments into polylines by the edges they share
+
+    Every segment's successor is the segment starting where it ends. Rings are cut
+    at their lowest segment, and every segment's distance to the end of its line
+    is found by pointer jumping, so no line is walked segment by segment.
+
+    Returns:
+        tuple: (segments in line order, line of every ordered segment numbered from 0,
+            closed flag of every line)
+    """
+    import numpy as np
+
+    count = len(starts)
+    order = np.argsort(starts, kind="stable")
+    position = np.minimum(np.searchsorted(starts[order], ends), max(count - 1, 0))
+    matched = starts[order][position] == ends
+    successor = np.where(matched, order[position], np.arange(count))
+    steps = max(1, count.bit_length())
+
+    # Rings: every segment in one has a predecessor and never reaches a line end
+    segments = np.arange(count)
+    lowest, jump = segments.copy(), successor.copy()
+    for _ in range(steps):
+        lowest = np.minimum(lowest, lowest[jump])
+        jump = jump[jump]
+    ring = successor[jump] != jump
+    ring_heads = ring & (lowest == segments)
+    predecessor = np.full(count, -1)
+    predecessor[successor[matched]] = segments[matched]
+    cut = predecessor[ring_heads]
+    successor[cut] = cut
+
+    # Distance of every segment to the last one of its line
+    distance = (successor != segments).astype(np.int64)
+    jump = successor.copy()
+    for _ in range(steps):
+        distance = distance + distance[jump]
+        jump = jump[jump]
+    ordered = np.lexsort((-distance, jump))
+    tails = jump[ordered]
+    line = np.concatenate([[0], np.cumsum(tails[1:] != tails[:-1])]) if count else tails
+    closed = ring_heads[ordered[np.r_[True, tails[1:] != tails[:-1]]]] if count else ring_heads
+    return ordered, line, closed
+
+
+def trace(values, level):
+    """
+    Polylines of a map at one level
+
+    Returns:
+        tuple: (points (n, 2), line of every point numbered from 0, closed flag of every
+            line); closed lines don't repeat their first point
+    """
+    import numpy as np
+
+    starts, ends = march(values, level)
+    if not len(starts):
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+    ordered, line, closed = link(starts, ends)
+    points = edge_points(values, level, starts[ordered])
+
+    # Open lines end with the end point of their last segment
+    last = np.flatnonzero(np.r_[line[1:] != line[:-1], True])
+    open_last = last[~closed[line[last]]]
+    points = np.insert(points, open_last + 1, edge_points(values, level, ends[ordered[open_last]]), axis=0)
+    line = np.insert(line, open_last + 1, line[open_last])
+    return points, line, closed
+
+
+def _neighbours(line, closed):
+    """Previous and next vertex of every vertex in its line, wrapping around closed lines"""
+    import numpy as np
+
+    vertices = np.arange(len(line))
+    first = np.r_[True, line[1:] != line[:-1]]
+    last = np.r_[line[1:] != line[:-1], True]
+    number = np.cumsum(first) - 1
+    previous, following = vertices - 1, vertices + 1
+    previous[first] = vertices[last][number[first]]
+    following[last] = vertices[first][number[last]]
+    ring = closed[line]
+    fixed = (first | last) & ~ring
+    sizes = np.bincount(number)[number]
+    # A closed line keeps at least a triangle, an open one its two ends
+    fixed |= ring & (sizes <= 3)
+    return previous, following, fixed
+
+
+def _effective_areas(points, previous, following, fixed):
+    """Area of the triangle every vertex forms with its neighbours, infinite for the fixed ones"""
+    import numpy as np
+
+    a = points[previous] - points
+    b = points[following] - points
+    areas = 0.5 * np.abs(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0])
+    areas[fixed] = np.inf
+    return areas
+
+
+def _drop_below(points, line, closed, tolerance):
+    """Drop vertices adding less than tolerance area, a set of non-adjacent ones per round"""
+    import numpy as np
+
+    for _ in range(SIMPLIFY_ROUNDS):
+        previous, following, fixed = _neighbours(line, closed)
+        areas = _effective_areas(points, previous, following, fixed)
+        # Only vertices whose area is lower than both neighbours' go in one round, so
+        # no two neighbours go at once; ties are broken by position
+        vertices = np.arange(len(points))
+        lower_than = lambda other: (areas < areas[other]) | ((areas == areas[other]) & (vertices < other))
+        drop = (areas < tolerance) & lower_than(previous) & lower_than(following)
+        if not drop.any():
+            break
+        points, line = points[~drop], line[~drop]
+    return points, line
+
+
+def simplify(points, line, closed, budget=VERTEX_BUDGET, tolerance=AREA_TOLERANCE):
+    """
+    Simplify polylines to at most budget vertices
+
+    Speckle lines are dropped first; then vertices are dropped by effective area
+    with a rising tolerance; if the budget still isn't met, the smallest lines go.
+
+    Returns:
+        tuple: (points, line of every point, closed flags, numbers the kept lines had
+            before), the kept lines renumbered from 0 in their order
+    """
+    import numpy as np
+
+    kept = np.arange(len(closed))
+
+    def keep_lines(keep):
+        nonlocal points, line, closed, kept
+        points, line = points[keep[line]], line[keep[line]]
+        line = (np.cumsum(keep) - 1)[line]
+        closed, kept = closed[keep], kept[keep]
+
+    def extents():
+        low = np.full((len(closed), 2), np.inf)
+        high = np.full((len(closed), 2), -np.inf)
+        np.minimum.at(low, line, points)
+        np.maximum.at(high, line, points)
+        return (high - low).max(axis=1)
+
+    if not len(points):
+        return points, line, closed, kept
+    keep_lines(extents() >= MIN_EXTENT)
+    for _ in range(BUDGET_PASSES):
+        points, line = _drop_below(points, line, closed, tolerance)
+        if len(points) <= budget:
+            break
+        # Next tolerance: at least double, or what the current areas say would remove enough
+        areas = _effective_areas(points, *_neighbours(line, closed))
+        finite = np.sort(areas[np.isfinite(areas)])
+        excess = min(len(points) - budget, len(finite))
+        tolerance = max(tolerance * 2, float(finite[excess - 1]) if excess else 0.0)
+    if len(points) > budget:
+        # Largest lines first, as many as fit
+        sizes = np.bincount(line, minlength=len(closed))
+        by_extent = np.argsort(-extents(), kind="stable")
+        keep = np.zeros(len(closed), dtype=bool)
+        keep[by_extent[np.cumsum(sizes[by_extent]) <= budget]] = True
+        keep_lines(keep)
+    return points, line, closed, kept
+
+
+def _path(points, line, closed):
+    """SVG path data of polylines numbered from 0, coordinates to a tenth of a pixel"""
+    import numpy as np
+
+    if not len(points):
+        return ""
+    coordinates = np.round(points, 1)
+    bounds = np.flatnonzero(np.r_[True, line[1:] != line[:-1], True])
+    parts = []
+    for number, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        pairs = " ".join(f"{x:g} {y:g}" for x, y in coordinates[start:end])
+        parts.append(f"M{pairs}{'Z' if closed[number] else ''}")
+    return "".join(parts)
+
+
+def contour_svg(values, levels=LEVELS, budget=VERTEX_BUDGET):
+    """
+    Inline SVG with the contour lines of a map
+
+    The vertex budget is shared by all levels, which are simplified together.
+
+    Args:
+        values (numpy.ndarray): float (height, width) map, NaN outside the field
+        levels (tuple): Values to trace
+        budget (int): Most vertices in the overlay
+
+    Returns:
+        tuple: (SVG markup covering a 220px page image, number of vertices)
+    """
+    import numpy as np
+
+    height, width = values.shape
+    values, factor = reduce_map(values)
+    traced = [trace(values, level) for level in levels]
+    offsets = np.cumsum([0] + [len(closed) for _, _, closed in traced])
+    line_levels = np.repeat(np.arange(len(levels)), np.diff(offsets))
+    points, line, closed, kept = simplify(
+        np.concatenate([points for points, _, _ in traced]),
+        np.concatenate([line + offset for (_, line, _), offset in zip(traced, offsets)]),
+        np.concatenate([closed for _, _, closed in traced]), budget)
+    points = points * factor
+
+    # The lines of a level stay together and in order, so each level is one slice
+    kept_levels = line_levels[kept]
+    paths = []
+    for number, level in enumerate(levels):
+        lines = np.flatnonzero(kept_levels == number)
+        if not len(lines):
+            continue
+        selected = (line >= lines[0]) & (line <= lines[-1])
+        stroke = LINE_WIDTHS[0] + (LINE_WIDTHS[1] - LINE_WIDTHS[0]) * number / max(len(levels) - 1, 1)
+        paths.append(f'<path data-level="{level:g}" stroke-width="{stroke:.2g}" vector-effect="non-scaling-stroke" '
+                     f'd="{_path(points[selected], line[selected] - lines[0], closed[lines])}"/>')
+    svg = (f'<svg aria-hidden="true" class="absolute inset-0 w-[220px] h-[220px] pointer-events-none" '
+           f'viewBox="0 0 {width} {height}" preserveAspectRatio="xMidYMid slice" fill="none" '
+           f'stroke="{LINE_COLOR}" stroke-linejoin="round" stroke-linecap="round">{"".join(paths)}</svg>')
+    return svg, len(points)
+
+
+def contour_image(data, index, levels=LEVELS, budget=VERTEX_BUDGET):
+    """contour_svg of index image bytes; None when the image can't be decoded"""
+    import index_maps
+
+    values = index_maps.decode(data, index)
+    if values is None:
+        return None
+    return contour_svg(values, levels, budget)
+
+
+def _contour(task):
+    return contour_image(*task)
+
+
+def contour_images(tasks, workers=None):
+    """contour_image over (data, index, levels, budget) tasks, in a process pool when there are several"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if len(tasks) <= 1:
+        return [_contour(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(len(tasks), workers or os.cpu_count() or 1)) as pool:
+        return list(pool.map(_contour, tasks, chunksize=4))
+
+
+def compute_contours(df, field_images, levels=LEVELS, budget=VERTEX_BUDGET):
+    """
+    Trace the contours of every index image of the batch
+
+    Old images imagery.py found to be the same as the current ones aren't traced;
+    the page shows the current image, and its contours, in both places.
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        field_images (list): Each row's {image file name: raw bytes}, in the order of df
+        levels (tuple): Scale positions to trace
+        budget (int): Most vertices in the overlay of one image
+
+    Returns:
+        tuple: (pandas.DataFrame with the same index as df and the column
+            "Contours <INDEX> <current|old>" (SVG markup) for every index and slot,
+            number of distinct images traced, total number of vertices)
+    """
+    import pandas as pd
+
+    import advisory
+    import imagery
+
+    # Every distinct image is traced once, whichever rows and slots it appears in
+    tasks, cells = {}, []
+    for index in advisory.INDICES:
+        stale = imagery.stale_mask(df, index)
+        for slot in imagery.SLOTS:
+            for position, images in enumerate(field_images):
+                data = images.get(imagery.image_file(index, slot))
+                if data is None or (slot == "old" and stale[position]):
+                    continue
+                key = (hashlib.sha256(data).hexdigest(), index)
+                tasks.setdefault(key, (data, index, tuple(levels), budget))
+                cells.append((position, index, slot, key))
+    results = dict(zip(tasks, contour_images(list(tasks.values()))))
+
+    # Images with no line at any level get no overlay
+    columns = {f"Contours {index} {slot}": [None] * len(df) for index in advisory.INDICES for slot in imagery.SLOTS}
+    for position, index, slot, key in cells:
+        if results[key] is not None and results[key][1]:
+            columns[f"Contours {index} {slot}"][position] = results[key][0]
+    traced = [result for result in results.values() if result is not None]
+    return pd.DataFrame(columns, index=df.index), len(traced), sum(vertices for _, vertices in traced)
+
+
+def apply_and_report(df, field_images, options=None):
+    """Add the columns of compute_contours to the workbook rows, with the options of options_from_args"""
+    import pandas as pd
+
+    options = options or {}
+    try:
+        overlays, traced, vertices = compute_contours(df, field_images, options.get("levels", LEVELS),
+                                              options.get("budget", VERTEX_BUDGET))
+    except Exception as e:
+        # Reports without contours are still reports
+        logger.error("Error tracing contours: %s", e)
+        return df
+    logger.info("Contours: %d images traced, %d vertices", traced, vertices)
+    return pd.concat([df.drop(columns=[c for c in overlays.columns if c in df.columns]), overlays], axis=1)
+
+
+def overlay_image(df, index, slot, image_tag):
+    """
+    An image tag of a page, with the contour lines laid over it when the image was traced
+
+    Args:
+        df (pandas.DataFrame): Row data of the field, with the columns of apply_and_report
+        index (str): Index of the page, e.g. "NDVI"
+        slot (str): "current" or "old"
+        image_tag (str): The page's <img> tag of that image
+
+    Returns:
+        str: image_tag, or image_tag and the SVG in a positioned wrapper
+    """
+    import imagery
+
+    if df.empty:
+        return image_tag
+    row = df.iloc[0]
+    if slot == "old" and imagery.is_stale(row, index):
+        slot = "current"
+    svg = row.get(f"Contours {index} {slot}")
+    if not isinstance(svg, str):
+        return image_tag
+    return f'<div class="relative w-[220px] h-[220px]">{image_tag}{svg}</div>'
+
+
+def parse_levels(value):
+    """argparse type of a comma-separated list of scale positions"""
+    try:
+        levels = tuple(sorted({float(level) for level in value.split(",") if level.strip()}))
+    except ValueError:
+        levels = ()
+    if not levels or not all(0 < level < 1 for level in levels):
+        raise argparse.ArgumentTypeError(f"levels must be scale positions between 0 and 1, e.g. "
+                                         f"{','.join(f'{level:g}' for level in LEVELS)}")
+    return levels
+
+
+def add_arguments(parser, default=None):
+    """Add --contours and --contour-vertices to an argparse parser"""
+    def option_default(value):
+        return value if default is None else default
+
+    parser.add_argument("--contours", nargs="?", const=LEVELS, default=option_default(None), type=parse_levels,
+                        metavar="LEVELS",
+                        help="Lay contour lines of every index image over pages 2-6 as SVG, at the given "
+                             f"comma-separated scale positions (default: {','.join(f'{level:g}' for level in LEVELS)})")
+    parser.add_argument("--contour-vertices", type=int, default=option_default(VERTEX_BUDGET), metavar="N",
+                        help=f"Most vertices in the contours of one image (default: {VERTEX_BUDGET})")
+
+
+def options_from_args(args):
+    """Return the contour options of parsed arguments, or None if no contours were asked for"""
+    levels = getattr(args, "contours", None)
+    if levels is None:
+        return None
+    return {"levels": levels, "budget": getattr(args, "contour_vertices", VERTEX_BUDGET)}
+
+
+def main(argv=None):
+    import index_maps
+
+    parser = argparse.ArgumentParser(description="Trace the contours of index images into SVG")
+    parser.add_argument("images", nargs="+", help="Index image files")
+    parser.add_argument("--index", choices=sorted(index_maps.INDEX_SCALES),
+                        help="Index of the images (default: from the file names, e.g. current_ndvi.png)")
+    parser.add_argument("--levels", type=parse_levels, default=LEVELS,
+                        help=f"Comma-separated scale positions (default: {','.join(f'{level:g}' for level in LEVELS)})")
+    parser.add_argument("--vertices", type=int, default=VERTEX_BUDGET,
+                        help=f"Most vertices per image (default: {VERTEX_BUDGET})")
+    parser.add_argument("--output", default=None, help="Write the SVG of the (single) image to this file")
+    args = parser.parse_args(argv)
+
+    for path in args.images:
+        index = args.index or index_maps.index_of(path) or "NDVI"
+        with open(path, "rb") as f:
+            result = contour_image(f.read(), index, args.levels, args.vertices)
+        if result is None:
+            print(f"{path}: not an image")
+            continue
+        svg, vertices = result
+        print(f"{path} ({index}): {vertices} vertices, {len(svg)} bytes of SVG")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(svg.replace("<svg ", '<svg xmlns="http://www.w3.org/2000/svg" ', 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Batch index dashboard
+
+After a batch, the output directory gets an ``index.html`` for browsing the
+reports and a compact ``summary.json`` with one row per field: crop, image
+dates and the five index values with their changes, all taken from the rows
+the generator already read. The summary is columnar so it stays small with
+thousands of fields:
+
+    {"version": 1, "workbook": "demo.xlsx", "indices": ["NDVI", ...],
+     "columns": ["field", "name", "crop", "date", "old_date", "values", "changes"],
+     "fields": [["Trichy Field 1", "Trichy_Field_1", "-", "2025-07-16", "2025-07-16",
+                 [0.18, -0.14, 0.45, 0.15, 0.1], [0.0, 0.03, 0.0, 0.03, 0.01]], ...]}
+
+The page embeds the same JSON, so it also works when opened straight from
+disk. Only the rows in view are rendered, filtering and sorting happen in the
+browser, and thumbnails and reports are only loaded when they are shown.
+
+A run over some of the fields (``--field``, a resumed subset) keeps the other
+fields of the summary.json already in the output directory, as long as their
+reports are still there.
+
+Sharded runs write ``summary-shard-I-of-N.json``; ``generate_report.py merge``
+combines them into the dashboard of the whole batch.
+"""
+import html
+import json
+import logging
+import math
+import os
+from datetime import datetime, timezone
+
+import generate_report
+import journal
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_VERSION = 1
+
+# Name of the dashboard page and its summary in the output directory
+DASHBOARD = "index.html"
+SUMMARY = "summary.json"
+
+TEMPLATE_FILE = os.path.join(generate_report.TEMPLATE_DIR, "dashboard.html")
+
+# Vegetation indices in page order
+INDICES = [index.upper() for index in generate_report.PAGE_INDICES.values()]
+
+COLUMNS = ["field", "name", "crop", "date", "old_date", "values", "changes"]
+
+
+def summary_name(shard=None):
+    """Return the summary file name, one per shard so shards can share an output directory"""
+    if shard is None:
+        return SUMMARY
+    return f"summary-shard-{shard[0]}-of-{shard[1]}.json"
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value).strip()
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else round(number, 4)
+
+
+def _date(row, columns):
+    """Return the first of the columns holding a parseable date, as YYYY-MM-DD"""
+    import pandas as pd
+
+    for column in columns:
+        value = row.get(column)
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            continue
+        try:
+            return pd.to_datetime(value.strip() if isinstance(value, str) else value).strftime("%Y-%m-%d")
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def field_summary(row, field_name):
+    """
+    Summarize one field for the dashboard
+
+    Dates fall back the way the index pages do: the NDVI image date, then the
+    other index dates and the "Current  image" column; the old NDVI image date,
+    then "Old Date". A missing change is computed from the old value.
+
+    Args:
+        row (pandas.Series): The row data for the field
+        field_name (str): Sanitized name of the field
+
+    Returns:
+        list: Values in the order of COLUMNS
+    """
+    values = [_number(row.get(f"{index} value")) for index in INDICES]
+    changes = []
+    for index, value in zip(INDICES, values):
+        change = _number(row.get(f"{index} change"))
+        if change is None and value is not None:
+            old_value = _number(row.get(f"Old {index} value"))
+            change = None if old_value is None else round(value - old_value, 4)
+        changes.append(change)
+
+    date = _date(row, [f"{index} Image date" for index in INDICES] + ["Current  image"])
+    old_date = _date(row, [f"Old {index} Image date" for index in INDICES] + ["Old Date"])
+    field = _text(row.get("Field")) or field_name
+    return [field, field_name, _text(row.get("Crop")), date, old_date, values, changes]
+
+
+def build_summary(summaries, excel_file=None):
+    """Return the summary document for a list of field summaries, sorted by field name"""
+    return {
+        "version": SUMMARY_VERSION,
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "workbook": os.path.basename(excel_file) if excel_file else None,
+        "indices": INDICES,
+        "columns": COLUMNS,
+        "fields": sorted(summaries, key=lambda summary: summary[1]),
+    }
+
+
+def summary_json(summary):
+    return json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+
+
+def render_dashboard(summary):
+    """Return the dashboard HTML with the summary embedded"""
+    with open(TEMPLATE_FILE, "r", encoding="utf-8") as f:
+        template = f.read()
+    # "</" can't appear inside a script element
+    embedded = summary_json(summary).replace("</", "<\\/")
+    title = f"Crop Reports - {summary['workbook']}" if summary.get("workbook") else "Crop Reports"
+    return template.replace("DASHBOARD TITLE", html.escape(title)).replace("DASHBOARD SUMMARY", embedded)
+
+
+def previous_fields(output_directory, summaries):
+    """
+    Fields of the directory's existing summary.json to keep on the dashboard
+
+    A --field run or a resumed subset only has the summaries of its own fields; the
+    other fields stay listed for as long as their reports are in the directory.
+
+    Returns:
+        list: Field summaries of the existing summary that aren't in summaries and
+            whose report file still exists
+    """
+    try:
+        with open(os.path.join(output_directory, SUMMARY), encoding="utf-8") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if previous.get("version") != SUMMARY_VERSION or previous.get("columns") != COLUMNS:
+        return []
+    names = {summary[1] for summary in summaries}
+    return [field for field in previous.get("fields", [])
+            if field[1] not in names
+            and os.path.exists(os.path.join(output_directory, f"full_report_{field[1]}.html"))]
+
+
+def write_dashboard(output_directory, summaries, excel_file=None, precompress=False):
+    """
+    Write index.html and summary.json for a batch
+
+    The fields of an earlier summary.json in the directory are merged in by name
+    (see previous_fields). With precompress, both files also get .gz and .br siblings.
+
+    Returns:
+        str: Path of the dashboard page
+    """
+    summaries = list(summaries) + previous_fields(output_directory, summaries)
+    summary = build_summary(summaries, excel_file)
+    import precompress as precompress_module
+
+    summary_path = os.path.join(output_directory, SUMMARY)
+    journal.write_text_atomic(summary_path, summary_json(summary))
+    path = os.path.join(output_directory, DASHBOARD)
+    journal.write_text_atomic(path, render_dashboard(summary))
+    for written in (summary_path, path):
+        if precompress:
+            precompress_module.compress_file(written)
+        else:
+            precompress_module.remove_siblings(written)
+    logger.info("Dashboard written: %s (%s fields)", path, len(summaries))
+    return path
+
+
+def write_shard_summary(output_directory, shard, summaries, excel_file=None):
+    """Write the summary of one shard, merged into the dashboard by merge_summaries"""
+    path = os.path.join(output_directory, summary_name(shard))
+    journal.write_text_atomic(path, summary_json(build_summary(summaries, excel_file)))
+    return path
+
+
+def merge_summaries(output_directory):
+    """
+    Combine the shard summaries in a directory into the dashboard of the whole batch
+
+    Returns:
+        str: Path of the dashboard page, or None if there are no shard summaries
+    """
+    names = sorted(name for name in os.listdir(output_directory)
+                   if name.startswith("summary-shard-") and name.endswith(".json"))
+    if not names:
+        return None
+    summaries = {}
+    workbook = None
+    for name in names:
+        with open(os.path.join(output_directory, name), encoding="utf-8") as f:
+            shard_summary = json.load(f)
+        workbook = workbook or shard_summary.get("workbook")
+        for field in shard_summary["fields"]:
+            summaries[field[1]] = field
+    return write_dashboard(output_directory, list(summaries.values()), workbook)
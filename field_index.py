@@ -0,0 +1,221 @@
+"""
+Field -> worksheet row index for rendering selected fields
+
+Re-rendering a few fields shouldn't mean reading every row and decoding every
+embedded image in the workbook. FieldIndex streams only the header row and the
+Field column to find the row of each field, reads just the selected rows with
+pandas, and reads the picture anchors straight from the .xlsx package so only
+the images anchored in those rows are decompressed.
+
+Field names are matched with shell-style globs (``Trichy*``, ``TN-24-*``),
+against both the name in the sheet and its sanitized form used in file names.
+"""
+import fnmatch
+import posixpath
+import zipfile
+
+# XML namespaces used by the workbook, relationship and drawing parts
+NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+    "xdr": "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+}
+
+DRAWING_REL_TYPE = NS["r"] + "/drawing"
+
+
+def sanitize_name(value):
+    """Return the file-system safe form of a field name used for report and image paths"""
+    return str(value).replace(' ', '_').replace('/', '_')
+
+
+def matches(value, patterns):
+    """Return True if a field name, or its sanitized form, matches any of the glob patterns"""
+    name = str(value)
+    sanitized = sanitize_name(value)
+    return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(sanitized, pattern)
+               for pattern in patterns)
+
+
+def add_field_argument(parser, default=None):
+    """Add the repeatable --field option to an argparse parser"""
+    parser.add_argument("--field", action="append", default=default, metavar="NAME",
+                        help="Only render fields whose name matches NAME; glob patterns allowed, repeatable")
+
+
+def _read_rels(package, part):
+    """Return {relationship id: (type, absolute part name)} for a part of the package"""
+    import xml.etree.ElementTree as ET
+
+    folder, name = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        root = ET.fromstring(package.read(rels_part))
+    except KeyError:
+        return {}
+    rels = {}
+    for rel in root.findall("rel:Relationship", NS):
+        target = rel.get("Target")
+        if rel.get("TargetMode") == "External":
+            continue
+        path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id")] = (rel.get("Type"), path)
+    return rels
+
+
+def _active_sheet_part(package):
+    """Return the part name of the active worksheet, the sheet openpyxl's Workbook.active returns"""
+    import xml.etree.ElementTree as ET
+
+    workbook = ET.fromstring(package.read("xl/workbook.xml"))
+    view = workbook.find("main:bookViews/main:workbookView", NS)
+    active = int(view.get("activeTab", 0)) if view is not None else 0
+    sheets = workbook.findall("main:sheets/main:sheet", NS)
+    sheet = sheets[active] if active < len(sheets) else sheets[0]
+    rels = _read_rels(package, "xl/workbook.xml")
+    return rels[sheet.get(f"{{{NS['r']}}}id")][1]
+
+
+class FieldIndex:
+    """
+    Index of the fields in a workbook and the worksheet row each one is on
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+    """
+
+    def __init__(self, excel_file):
+        import openpyxl
+
+        self.excel_file = excel_file
+
+        # Read-only mode streams the sheet and skips drawings, so this only costs a pass over column A
+        wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=False)
+        try:
+            sheet = wb.active
+            header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            self.headers = list(header_row)
+
+            # (field name, worksheet row) for every row with a field name, in sheet order
+            self.entries = []
+            # Field name -> first worksheet row it appears on
+            self.rows = {}
+            for r, (value,) in enumerate(sheet.iter_rows(min_row=2, min_col=1, max_col=1, values_only=True), start=2):
+                if value is None:
+                    continue
+                self.entries.append((value, r))
+                self.rows.setdefault(value, r)
+        finally:
+            wb.close()
+
+    def select(self, patterns):
+        """
+        Return the (field name, worksheet row) entries matching any of the glob patterns
+
+        Args:
+            patterns (list): Field names or glob patterns
+        """
+        return [(value, r) for value, r in self.entries if matches(value, patterns)]
+
+    def read_rows(self, rows):
+        """
+        Read only the given worksheet rows into a dataframe
+
+        Args:
+            rows (list): 1-based worksheet rows, in the order the result should have
+
+        Returns:
+            pandas.DataFrame: One row per requested worksheet row, with the sheet's columns
+        """
+        import pandas as pd
+
+        wanted = set(rows)
+        # skiprows counts from 0 and includes the header row, which is always kept;
+        # nrows lets pandas stop reading the sheet after the last wanted row
+        df = pd.read_excel(self.excel_file, skiprows=lambda i: i > 0 and i + 1 not in wanted, nrows=len(wanted))
+        df.index = sorted(wanted)
+        return df.loc[list(rows)].reset_index(drop=True)
+
+    def _anchors(self, package, image_columns):
+        """
+        Yield (worksheet row, image file name, media part) for every picture anchored in an image column
+
+        Args:
+            package (zipfile.ZipFile): The open workbook package
+            image_columns (dict): Header of each image column mapped to the file name it is saved as
+        """
+        import xml.etree.ElementTree as ET
+
+        columns = {col: image_columns[header]
+                   for col, header in enumerate(self.headers, start=1) if header in image_columns}
+        sheet_part = _active_sheet_part(package)
+        for rel_type, drawing_part in _read_rels(package, sheet_part).values():
+            if rel_type != DRAWING_REL_TYPE:
+                continue
+            media = _read_rels(package, drawing_part)
+            drawing = ET.fromstring(package.read(drawing_part))
+            for anchor in list(drawing):
+                start = anchor.find("xdr:from", NS)
+                blip = anchor.find("xdr:pic/xdr:blipFill/a:blip", NS)
+                if start is None or blip is None:
+                    continue
+                row = int(start.find("xdr:row", NS).text) + 1
+                col = int(start.find("xdr:col", NS).text) + 1
+                if col not in columns:
+                    continue
+                target = media.get(blip.get(f"{{{NS['r']}}}embed"))
+                if target is not None:
+                    yield row, columns[col], target[1]
+
+    def read_images(self, rows, image_columns):
+        """
+        Read the images anchored in the given rows directly from the workbook package
+
+        Args:
+            rows (list): 1-based worksheet rows whose images are wanted
+            image_columns (dict): Header of each image column mapped to the file name it is saved as
+
+        Returns:
+            dict: (worksheet row, image file name) mapped to the raw image bytes
+        """
+        wanted = set(rows)
+        images = {}
+        with zipfile.ZipFile(self.excel_file) as package:
+            for row, image_file, part in self._anchors(package, image_columns):
+                if row in wanted:
+                    images[(row, image_file)] = package.read(part)
+        return images
+
+    def image_parts(self, rows, image_columns):
+        """
+        Locate the images anchored in the given rows without decompressing them
+
+        Args:
+            rows (list): 1-based worksheet rows whose images are wanted
+            image_columns (dict): Header of each image column mapped to the file name it is saved as
+
+        Returns:
+            dict: (worksheet row, image file name) mapped to the media part of the package holding the image
+        """
+        wanted = set(rows)
+        with zipfile.ZipFile(self.excel_file) as package:
+            return {(row, image_file): part for row, image_file, part in self._anchors(package, image_columns)
+                    if row in wanted}
+
+    def image_anchors(self, image_columns):
+        """
+        List the images anchored in every row without decompressing them
+
+        Args:
+            image_columns (dict): Header of each image column mapped to the file name it is saved as
+
+        Returns:
+            dict: Worksheet row mapped to the set of image file names anchored in it
+        """
+        anchors = {}
+        with zipfile.ZipFile(self.excel_file) as package:
+            for row, image_file, _ in self._anchors(package, image_columns):
+                anchors.setdefault(row, set()).add(image_file)
+        return anchors
@@ -1,15 +1,182 @@
 import os
-import pandas as pd
 import page1
-import page2
-import page3
-import page4
-import page5
-import page6
-import openpyxl
-from PIL import Image
+import page7
 import io
 import shutil
+import tempfile
+import field_index
+import contours
+import hotspots
+import imagery
+import index_pages
+import journal
+import logging
+import logs
+import progress
+import results
+import tiles
+import workbooks
+import zones
+
+logger = logging.getLogger(__name__)
+
+# pandas, openpyxl and PIL are imported inside the functions that use them, so
+# that "--help", the report server and worker processes start without paying
+# for them until a workbook is actually read.
+
+# Directory holding the HTML templates for each page
+TEMPLATE_DIR = "templete"
+
+# Order in which the pages are rendered and combined: field information, then the index pages
+PAGE_NAMES = ["page1"] + [entry.page for entry in index_pages.INDEX_PAGES]
+
+# Page with the management zones, added for fields that have zones (--zones)
+ZONES_PAGE = "page7"
+
+# Every page a report can have, in order
+REPORT_PAGES = sorted(PAGE_NAMES + [ZONES_PAGE], key=index_pages.page_number)
+
+# Vegetation index shown on each index page
+PAGE_INDICES = {entry.page: entry.index.lower() for entry in index_pages.INDEX_PAGES}
+
+# Header of each image column in the workbook and the file name it is saved as
+IMAGE_COLUMNS = index_pages.image_columns()
+
+def sanitize_field_name(row, index):
+    """
+    Build the file-system safe field name used for report and image paths
+    
+    Args:
+        row (pandas.Series): The row data for the field
+        index (int): Position of the row in the sheet, used when there is no Field column
+    """
+    return field_index.sanitize_name(row['Field']) if 'Field' in row else f"field_{index+1}"
+
+def find_field_row(sheet, field_name):
+    """Return the 1-based worksheet row whose first cell matches field_name, or None"""
+    for r in range(1, sheet.max_row + 1):
+        if sheet.cell(row=r, column=1).value == field_name:
+            return r
+    return None
+
+def find_image_columns(sheet):
+    """Map 1-based worksheet column numbers to (header, image file name) for the image columns"""
+    columns = {}
+    for col in range(1, sheet.max_column + 1):
+        header = sheet.cell(row=1, column=col).value
+        if header in IMAGE_COLUMNS:
+            columns[col] = (header, IMAGE_COLUMNS[header])
+    return columns
+
+def copy_default_images(output_dir):
+    """
+    Copy the default index images into a field's image folder, where it has none yet
+    
+    Args:
+        output_dir (str): Field-specific image folder
+    """
+    # Create default copies from existing images if available
+    for image_file in IMAGE_COLUMNS.values():
+        src = os.path.join("images", image_file)
+        dest = os.path.join(output_dir, image_file)
+        
+        # Copy default images if they exist
+        if os.path.exists(src) and not os.path.exists(dest):
+            shutil.copy(src, dest)
+
+def save_field_images(images, output_dir, field_name):
+    """
+    Save a field's index images from raw image bytes already read from the workbook
+    
+    Args:
+        images (dict): Image file name mapped to the raw image bytes
+        output_dir (str): Directory where images will be saved
+        field_name (str): Name of the field, for messages
+    """
+    from PIL import Image
+    
+    try:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        copy_default_images(output_dir)
+        
+        for image_file, data in images.items():
+            img = Image.open(io.BytesIO(data))
+            output_path = os.path.join(output_dir, image_file)
+            img.save(output_path)
+            logger.debug("Saved %s for %s to %s", image_file, field_name, output_path)
+    
+    except Exception as e:
+        logger.warning("Error saving field images: %s", e)
+
+def encode_field_images(images, field_name, skip=()):
+    """
+    Encode a field's index images as PNG without writing them to disk
+    
+    Gives the same images save_field_images writes: the field's own images
+    re-encoded as PNG, and the default images where the field has none.
+    
+    Args:
+        images (dict): Image file name mapped to the raw image bytes
+        field_name (str): Name of the field, for messages
+        skip (set): Image file names the report doesn't show, e.g. imagery.redundant_images
+        
+    Returns:
+        dict: Image file name mapped to the PNG bytes
+    """
+    from PIL import Image
+    
+    encoded = {}
+    for image_file in IMAGE_COLUMNS.values():
+        if image_file in skip:
+            continue
+        if image_file in images:
+            try:
+                output = io.BytesIO()
+                Image.open(io.BytesIO(images[image_file])).save(output, format="PNG")
+                encoded[image_file] = output.getvalue()
+                continue
+            except Exception as e:
+                logger.warning("Error encoding %s for %s: %s", image_file, field_name, e)
+        
+        # Fall back to the default image, as copy_default_images does
+        default_path = os.path.join("images", image_file)
+        if os.path.exists(default_path):
+            with open(default_path, "rb") as f:
+                encoded[image_file] = f.read()
+    return encoded
+
+def read_selected_fields(excel_file, patterns=None):
+    """
+    Read only the rows, and the images anchored in them, of the fields matching the patterns
+    
+    Given a glob pattern of workbooks, the matching workbooks are merged instead,
+    one row per field with the newest image dates (see workbooks.py).
+    
+    Args:
+        excel_file (str): Path to the Excel file with crop data, or a glob pattern of workbooks
+        patterns (list): Field names or glob patterns, None for every field
+        
+    Returns:
+        tuple: (dataframe of the matching rows, list with each row's {image file name: raw bytes})
+    """
+    if workbooks.is_pattern(excel_file):
+        return workbooks.read_merged(excel_file, patterns)
+    
+    index = field_index.FieldIndex(excel_file)
+    selected = index.entries if patterns is None else index.select(patterns)
+    if not selected:
+        return None, []
+    
+    df = index.read_rows([r for _, r in selected])
+    
+    # Like extract_field_images, take the images from the first row with the field's name
+    image_rows = [index.rows[value] for value, _ in selected]
+    images_by_row = {}
+    for (r, image_file), data in index.read_images(image_rows, IMAGE_COLUMNS).items():
+        images_by_row.setdefault(r, {})[image_file] = data
+    
+    return df, [images_by_row.get(r, {}) for r in image_rows]
 
 def extract_field_images(excel_file, row, output_dir):
     """
@@ -20,6 +187,9 @@ def extract_field_images(excel_file, row, output_dir):
         row (pandas.Series): The row data for the field
         output_dir (str): Directory where images will be saved
     """
+    import openpyxl
+    from PIL import Image
+    
     # Load the workbook
     try:
         wb = openpyxl.load_workbook(excel_file, data_only=False)
@@ -30,65 +200,21 @@ def extract_field_images(excel_file, row, output_dir):
             os.makedirs(output_dir)
         
         # Initialize default images (copy from existing if available)
-        default_image_pairs = [
-            ("current_ndvi.png", "old_ndvi.png"),
-            ("current_ndmi.png", "old_ndmi.png"),
-            ("current_reci.png", "old_reci.png"),
-            ("current_msavi.png", "old_msavi.png"),
-            ("current_ndre.png", "old_ndre.png")
-        ]
-        
-        # Create default copies from existing images if available
-        for current_img, old_img in default_image_pairs:
-            src_current = os.path.join("images", current_img)
-            src_old = os.path.join("images", old_img)
-            
-            dest_current = os.path.join(output_dir, current_img)
-            dest_old = os.path.join(output_dir, old_img)
-            
-            # Copy default images if they exist
-            if os.path.exists(src_current) and not os.path.exists(dest_current):
-                shutil.copy(src_current, dest_current)
-            
-            if os.path.exists(src_old) and not os.path.exists(dest_old):
-                shutil.copy(src_old, dest_old)
+        copy_default_images(output_dir)
         
         # Now extract the field-specific images
         # Find the row in Excel that matches this field
         field_name = row['Field'] if 'Field' in row else None
-        excel_row = None
-        
-        for r in range(1, sheet.max_row + 1):
-            if sheet.cell(row=r, column=1).value == field_name:
-                excel_row = r
-                break
+        excel_row = find_field_row(sheet, field_name)
         
         if excel_row is None:
-            print(f"Could not find row for field {field_name} in Excel")
+            logger.warning("Could not find row for field %s in Excel", field_name)
             return
         
-        print(f"Found field {field_name} at row {excel_row} in Excel")
-        
-        # Column indices for different image types
-        column_indices = {
-            'NDVI Image date': ('current_ndvi.png', None),
-            'Old NDVI Image date': ('old_ndvi.png', None),
-            'NDMI Image date': ('current_ndmi.png', None),
-            'Old NDMI Image date': ('old_ndmi.png', None),
-            'RECI Image date': ('current_reci.png', None),
-            'Old RECI Image date': ('old_reci.png', None),
-            'MSAVI Image date': ('current_msavi.png', None),
-            'Old MSAVI Image date': ('old_msavi.png', None),
-            'NDRE Image date': ('current_ndre.png', None),
-            'Old NDRE Image date': ('old_ndre.png', None)
-        }
+        logger.debug("Found field %s at row %s in Excel", field_name, excel_row)
         
-        # Find column indices
-        for col in range(1, sheet.max_column + 1):
-            header = sheet.cell(row=1, column=col).value
-            if header in column_indices:
-                image_file, _ = column_indices[header]
-                column_indices[header] = (image_file, col)
+        # Column numbers of the image columns
+        image_columns = find_image_columns(sheet)
         
         # Extract images from the specific row
         for image in sheet._images:
@@ -100,133 +226,595 @@ def extract_field_images(excel_file, row, output_dir):
                 continue
                 
             # Find which image type this column corresponds to
-            for header, (image_file, col_idx) in column_indices.items():
-                if col_idx == col:
-                    # Extract and save this image
-                    img_data = io.BytesIO(image._data())
-                    img = Image.open(img_data)
-                    output_path = os.path.join(output_dir, image_file)
-                    img.save(output_path)
-                    print(f"Saved {header} image for {field_name} to {output_path}")
-                    break
+            if col in image_columns:
+                header, image_file = image_columns[col]
+                # Extract and save this image
+                img_data = io.BytesIO(image._data())
+                img = Image.open(img_data)
+                output_path = os.path.join(output_dir, image_file)
+                img.save(output_path)
+                logger.debug("Saved %s image for %s to %s", header, field_name, output_path)
     
     except Exception as e:
-        print(f"Error extracting field images: {e}")
+        logger.warning("Error extracting field images: %s", e)
 
-def generate_full_report(excel_file, output_directory="reports"):
+def index_image_paths(single_row_data, field_images_dir, index):
     """
-    Generate a comprehensive report with all pages for each field in the Excel file
+    Current and old image paths of an index page
+    
+    Where imagery.py found the old image to be the same as the current one, both
+    are the current image, so the page loads one image and the old one needn't be saved.
+    
+    Args:
+        single_row_data (pandas.DataFrame): Single row dataframe for the field
+        field_images_dir (str): Directory the field's index images are served from
+        index (str): Index of the page, e.g. "ndvi"
+        
+    Returns:
+        tuple: (current image path, old image path)
+    """
+    current_image = os.path.join(field_images_dir, f"current_{index}.png")
+    if not single_row_data.empty and imagery.is_stale(single_row_data.iloc[0], index.upper()):
+        return current_image, current_image
+    return current_image, os.path.join(field_images_dir, f"old_{index}.png")
+
+def render_field_pages(excel_file, single_row_data, field_images_dir, temp_files, pages=None):
+    """
+    Render the report pages for one field into the given page files
+    
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        single_row_data (pandas.DataFrame): Single row dataframe for the field
+        field_images_dir (str): Directory the field's index images are served from
+        temp_files (dict): Page names mapped to the HTML file each page is written to
+        pages (list): Names of the pages to render, all of them by default; the zones
+            page is only rendered for fields with management zones
+        
+    Returns:
+        dict: Page names mapped to the rendered HTML of each page
+    """
+    if pages is None:
+        pages = REPORT_PAGES
+    page_contents = {}
+    
+    if "page1" in pages:
+        # Page 1 - Field Information
+        logger.debug("Generating Page 1: Field Information")
+        page_contents["page1"] = page1.generate_report_html(
+            single_row_data, os.path.join(TEMPLATE_DIR, "page1.html"), temp_files["page1"])
+    
+    for entry in index_pages.INDEX_PAGES:
+        if entry.page not in pages:
+            continue
+        # Pages 2-6 - NDVI, NDMI, RECI, MSAVI and NDRE, and any index added to index_pages.csv
+        logger.debug("Generating %s: %s (%s)", entry.page, entry.index, entry.title)
+        # Since we already extracted the images for this field, override the image paths
+        current_image, old_image = index_image_paths(single_row_data, field_images_dir, entry.index.lower())
+        page_contents[entry.page] = index_pages.render_index_page(
+            entry, index_pages.read_template(entry), temp_files[entry.page],
+            current_image, old_image, single_row_data)
+    
+    if ZONES_PAGE in pages and zones.has_zones(single_row_data):
+        # Page 7 - Management Zones, when the batch clustered them (--zones)
+        logger.debug("Generating Page 7: Management Zones")
+        page_contents[ZONES_PAGE] = page7.generate_page7(
+            os.path.join(TEMPLATE_DIR, "page7.html"), temp_files[ZONES_PAGE], single_row_data)
+        
+    
+    return page_contents
+
+def render_field_report(excel_file, single_row_data, field_name, field_images_dir, assets=None,
+                        stage_timer=progress.untimed):
+    """
+    Render all pages for one field and return the combined report HTML
+    
+    The page files are written to a private temporary directory, so several
+    fields can be rendered at the same time (e.g. by the report server).
+    
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        single_row_data (pandas.DataFrame): Single row dataframe for the field
+        field_name (str): Sanitized name of the field
+        field_images_dir (str): Directory the field's index images are served from
+        assets (dict): Manifest of the hashed static assets to link, None to inline them
+        stage_timer (callable): Returns a context manager timing a stage by name,
+            e.g. ProgressReporter.timer
+        
+    Returns:
+        str: Combined HTML content
+    """
+    with logs.field_context(field_name), tempfile.TemporaryDirectory(prefix="sidra_pages_") as temp_dir:
+        temp_files = {name: os.path.join(temp_dir, f"temp_{name}.html") for name in REPORT_PAGES}
+        with stage_timer("render"):
+            page_contents = render_field_pages(excel_file, single_row_data, field_images_dir, temp_files)
+        with stage_timer("combine"):
+            pyramids = tiles.image_tiles(single_row_data.iloc[0]) if not single_row_data.empty else None
+            return combine_page_contents(page_contents, field_name, assets, pyramids)
+
+def build_field_report(excel_file, row, field_name, images=None, assets=None, stage_timer=progress.untimed):
+    """
+    Extract the images of one field and render its full report
+    
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        row (pandas.Series): The row data for the field
+        field_name (str): Sanitized name of the field
+        images (dict): The field's raw image bytes by image file name, if already read;
+            otherwise the images are extracted from the workbook
+        assets (dict): Manifest of the hashed static assets to link, None to inline them
+        stage_timer (callable): Returns a context manager timing a stage by name
+        
+    Returns:
+        str: Combined HTML content
+    """
+    import pandas as pd
+    
+    # Create field-specific image folder for this report
+    field_images_dir = os.path.join("images", field_name)
+    if not os.path.exists(field_images_dir):
+        os.makedirs(field_images_dir)
+    
+    # Create single row dataframe with this row
+    single_row_data = pd.DataFrame([row])
+    
+    # Extract row-specific images from Excel first
+    with logs.field_context(field_name), stage_timer("extract"):
+        if images is not None:
+            # Old images that are the same as the current ones aren't shown (see imagery.py)
+            redundant = imagery.redundant_images(row)
+            save_field_images({name: data for name, data in images.items() if name not in redundant},
+                              field_images_dir, field_name)
+        else:
+            extract_field_images(excel_file, row, field_images_dir)
+    
+    # Render all pages and combine them into one report
+    return render_field_report(excel_file, single_row_data, field_name, field_images_dir, assets, stage_timer)
+
+def generate_field_report(excel_file, row, field_name, output_directory="reports", images=None, precompress=False,
+                          assets=None, stage_timer=progress.untimed):
+    """
+    Extract the images of one field, render its pages and write its full report
     
     Args:
         excel_file (str): Path to the Excel file with crop data
+        row (pandas.Series): The row data for the field
+        field_name (str): Sanitized name of the field
+        output_directory (str): Directory where the report will be saved
+        images (dict): The field's raw image bytes by image file name, if already read;
+            otherwise the images are extracted from the workbook
+        precompress (bool): Minify the report and write .html.gz and .html.br siblings
+        assets (dict): Manifest of the hashed static assets to link, None to inline them
+        stage_timer (callable): Returns a context manager timing a stage by name
+        
+    Returns:
+        str: Path of the full report
+    """
+    import precompress as precompress_module
+    
+    combined_html = build_field_report(excel_file, row, field_name, images, assets, stage_timer)
+    
+    # Save the combined report; written to a temporary file and renamed, so a crash
+    # never leaves a truncated report behind
+    output_path = os.path.join(output_directory, f"full_report_{field_name}.html")
+    with stage_timer("write"):
+        if precompress:
+            precompress_module.write_report(output_path, combined_html)
+        else:
+            journal.write_text_atomic(output_path, combined_html)
+            precompress_module.remove_siblings(output_path)
+    return output_path
+
+def write_precompressed(pending, batch_journal, wait=False, reporter=None, export=None):
+    """
+    Write the reports whose compression has finished and journal them
+    
+    Args:
+        pending (list): (future of precompress.encode_report, output path, manifest entry, row)
+            for every report still being compressed; written ones are removed
+        batch_journal (journal.BatchJournal): Journal of the completed fields
+        wait (bool): Wait for every report instead of only those already compressed
+        reporter (progress.ProgressReporter): Progress to count the written reports in
+        export (results.ResultsExport): Results files to add the written fields to
+    """
+    import precompress
+    
+    stage_timer = reporter.timer if reporter is not None else progress.untimed
+    for item in list(pending):
+        future, output_path, manifest_entry, row = item
+        if not wait and not future.done():
+            continue
+        pending.remove(item)
+        try:
+            encoded = future.result()
+            with stage_timer("write"):
+                precompress.write_encoded(output_path, encoded)
+            batch_journal.record(manifest_entry["field"], manifest_entry["name"], manifest_entry["report"])
+            manifest_entry["status"] = "ok"
+            if export is not None:
+                export.add(row, manifest_entry["name"], manifest_entry["report"])
+            logger.info("Full report generated successfully: %s", output_path)
+            if reporter is not None:
+                reporter.field_done()
+        except Exception as e:
+            logger.error("Error compressing report for %s: %s", manifest_entry['name'], e)
+            if reporter is not None:
+                reporter.field_failed()
+
+def generate_full_report(excel_file, output_directory="reports", fields=None, shard=None, isolation=None,
+                         resume=False, bundle=None, precompress=False, hashed_assets=False, advisory_rules=None,
+                         cohorts=False, validate=False, strict=False, progress_options=None, stale_imagery=False,
+                         tile_pyramids=False, hotspot_options=None, contour_options=None,
+                         zone_count=None, export_formats=None):
+    """
+    Generate a comprehensive report with all pages for each field in the Excel file
+    
+    Args:
+        excel_file (str): Path to the Excel file with crop data, or a glob pattern of
+            workbooks to merge, one row per field with the newest imagery (see workbooks.py)
         output_directory (str): Directory where the reports will be saved
+        fields (list): Field names or glob patterns; when given, only the matching rows
+            and their images are read from the workbook
+        shard (tuple): (shard number, shard count); when given, only the fields assigned
+            to this shard are generated and a shard manifest is written
+        isolation (dict): Options for isolation.run_isolated; when given, every field is
+            rendered in its own worker process with a timeout and memory limit
+        resume (bool): Skip the fields the journal of an earlier run already has
+        bundle (str): Path of a bundle to pack the reports and images into, instead of
+            writing them as separate files
+        precompress (bool): Minify the reports and write .html.gz and .html.br siblings;
+            compression runs in a process pool while the next fields render
+        hashed_assets (bool): Link the shared stylesheet, script and images as
+            content-hashed files in static/ instead of inlining or linking assest/
+        advisory_rules (str): Rule table to generate the empty advisory columns from
+            (see advisory.py); hand-entered advisories are kept
+        cohorts (bool): Rank every field against the fields of the same crop and growth
+            stage before rendering and show its percentile on pages 2-6 (see cohort.py)
+        validate (bool): Check the columns, dates, values and image anchors of the rows
+            before rendering and write validation.csv (see validation.py)
+        strict (bool): Validate and return before rendering if there is any error
+        progress_options (dict): Options for progress.ProgressReporter; when given, fields
+            done, rate, ETA and stage latencies are reported while the batch runs
+        stale_imagery (bool): Hash every image before rendering, mark the pages whose old
+            and current image are the same as "no new imagery" and flag images reused
+            across fields (see imagery.py)
+        tile_pyramids (bool): Cut the index images into deep-zoom tile pyramids in
+            static/tiles/ before rendering and let the reports zoom into them (see tiles.py)
+        hotspot_options (dict): Options for hotspots.apply_and_report; when given, the
+            stress hotspots of every index image are found before rendering and
+            outlined on pages 2-6 (see hotspots.py)
+        contour_options (dict): Options for contours.apply_and_report; when given, every
+            index image is traced into contour lines laid over pages 2-6 as SVG (see contours.py)
+        zone_count: "auto" or the number of management zones; when given, every field
+            is split into zones by its index maps and gets a zones page (see zones.py)
+        export_formats (list): Formats to also write the values, dates, advisories and
+            statistics of every field in, as <output>/results.<ext>, built as the fields
+            are reached (see results.py)
     """
+    import pandas as pd
+    
     # Create output directory if it doesn't exist
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
     
     # Read Excel data
+    field_images = None
     try:
-        df = pd.read_excel(excel_file)
-        print(f"Successfully read Excel file: {excel_file}")
-        print(f"Found {len(df)} rows of data")
+        if (isolation is not None or bundle is not None or stale_imagery or tile_pyramids
+                or hotspot_options is not None or contour_options is not None
+                or zone_count is not None or workbooks.is_pattern(excel_file)):
+            # Workers get the raw image bytes, so images are only decoded inside the workers;
+            # bundles take the images straight from the workbook instead of images/<field>/;
+            # the images of every field are hashed before the first one is rendered;
+            # merged workbooks carry the images of the rows that won
+            df, field_images = read_selected_fields(excel_file, fields or None)
+            if df is None:
+                logger.warning("No fields found in %s", excel_file)
+                return
+        elif fields:
+            df, field_images = read_selected_fields(excel_file, fields)
+            if df is None:
+                logger.warning("No fields in %s match %s", excel_file, ', '.join(fields))
+                return
+        else:
+            df = pd.read_excel(excel_file)
+        logger.info("Successfully read Excel file: %s", excel_file)
+        logger.info("Found %s rows of data", len(df))
     except Exception as e:
-        print(f"Error reading Excel file: {e}")
+        logger.error("Error reading Excel file: %s", e)
         return
     
+    # Advisories for the whole sheet in one pass, before any field is rendered
+    if advisory_rules:
+        import advisory
+        try:
+            df = advisory.apply_from_path(df, advisory_rules)
+        except (OSError, ValueError) as e:
+            logger.error("Error reading advisory rules: %s", e)
+            return
+    
+    # Fail fast on a broken workbook instead of rendering reports full of N/A
+    if validate or strict:
+        import validation
+        if not validation.check(df, excel_file, output_directory, strict=strict):
+            return
+    
+    # Image hashes before the cohorts, which leave out the changes of stale imagery
+    if stale_imagery:
+        df = imagery.apply_and_report(df, field_images, output_directory)
+    
+    # Tile pyramids of every image, built in a process pool; stale old images need none
+    if tile_pyramids:
+        df = tiles.apply_and_build(df, field_images)
+    
+    # Hotspots of every index image, decoded and labeled in a process pool
+    if hotspot_options is not None:
+        df = hotspots.apply_and_report(df, field_images, hotspot_options, output_directory)
+    
+    # Contour lines of every index image, traced and simplified in a process pool
+    if contour_options is not None:
+        df = contours.apply_and_report(df, field_images, contour_options)
+    
+    # Management zones of every field, cached by image hash and clustered in a process pool
+    if zone_count is not None:
+        df = zones.apply_and_report(df, field_images, zone_count, output_directory)
+    
+    # Cohort statistics over the same rows, so every page sees the whole batch
+    if cohorts:
+        import cohort
+        df = cohort.apply_and_report(df)
+    
     # Create folder for field-specific images
     images_dir = "images"
     if not os.path.exists(images_dir):
         os.makedirs(images_dir)
     
-    # Process each row and generate individual reports
-    for index, row in df.iterrows():
-        # Get field name for the report filename
-        field_name = str(row['Field']).replace(' ', '_').replace('/', '_') if 'Field' in row else f"field_{index+1}"
-        print(f"\n===== Generating report for {field_name} =====")
-        
-        # Create field-specific image folder for this report
-        field_images_dir = os.path.join(images_dir, field_name)
-        if not os.path.exists(field_images_dir):
-            os.makedirs(field_images_dir)
-        
-        # Create temporary files for each page
-        temp_files = {
-            "page1": "temp_page1.html",
-            "page2": "temp_page2.html",
-            "page3": "temp_page3.html",
-            "page4": "temp_page4.html",
-            "page5": "temp_page5.html",
-            "page6": "temp_page6.html"
-        }
+    import dashboard
+    summaries = {}
+    
+    if shard is not None:
+        import sharding
+        logger.info("Generating shard %s/%s", shard[0], shard[1])
+    if isolation is not None:
+        import isolation as isolation_module
+        tasks = []
+    manifest_entries = []
+    
+    assets = None
+    if hashed_assets:
+        import static_assets
+        assets = static_assets.build()
+        logger.info("Linking %s content-hashed assets in %s/", len(assets), static_assets.STATIC_DIR)
+    
+    if precompress:
+        import precompress as precompress_module
+        logger.info("%s", precompress_module.describe())
+        if isolation is None:
+            # Reports are compressed in worker processes while the next field renders;
+            # isolated workers compress their own report
+            from concurrent.futures import ProcessPoolExecutor
+            compress_pool = ProcessPoolExecutor()
+            pending = []
+    
+    # Results rows are written as the reports are, from the rows the pages are rendered from
+    try:
+        export = results.open_export(output_directory, export_formats, df, shard)
+    except (OSError, ImportError) as e:
+        logger.error("Error opening the results export: %s", e)
+        return
+    
+    bundle_writer = None
+    try:
+        if bundle is not None:
+            import bundle as bundle_module
+            bundle_writer = bundle_module.BundleWriter(bundle, excel_file)
+            bundle_writer.add_directory("assest")
+            if assets is not None:
+                for hashed in assets.values():
+                    with open(os.path.join(static_assets.STATIC_DIR, hashed), "rb") as f:
+                        bundle_writer.add(f"{static_assets.STATIC_DIR}/{hashed}", f.read())
+            if tile_pyramids:
+                for digest in {digest for _, row in df.iterrows() for digest in tiles.image_tiles(row).values()}:
+                    for name, data in tiles.pyramid_files(digest):
+                        bundle_writer.add(f"{tiles.TILES_DIR.replace(os.sep, '/')}/{name}", data)
+            batch_journal = None
+        else:
+            # Completed fields are journaled as their reports are written
+            batch_journal = journal.BatchJournal(output_directory, excel_file, resume=resume, shard=shard)
+            if resume:
+                logger.info("Resuming: %s fields already completed in %s",
+                            len(batch_journal.completed), batch_journal.path)
         
-        # Create single row dataframe with this row
-        single_row_data = pd.DataFrame([row])
+        reporter = None
+        stage_timer = progress.untimed
+        if progress_options is not None:
+            labels = {"workbook": os.path.basename(excel_file)}
+            if shard is not None:
+                labels["shard"] = f"{shard[0]}/{shard[1]}"
+            reporter = progress.ProgressReporter(len(df), labels=labels, **progress_options).start()
+            stage_timer = reporter.timer
         
-        try:
-            # Extract row-specific images from Excel first
-            extract_field_images(excel_file, row, field_images_dir)
+        # Process each row and generate individual reports
+        for index, row in df.iterrows():
+            # Get field name for the report filename
+            field_name = sanitize_field_name(row, index)
             
-            # Page 1 - Field Information
-            print("Generating Page 1: Field Information")
-            page1.generate_report_html(single_row_data, "templete/page1.html", temp_files["page1"])
+            # Leave fields assigned to other shards to the machines running them
+            if shard is not None and sharding.shard_of(field_name, shard[1]) != shard[0]:
+                if reporter is not None:
+                    reporter.exclude()
+                continue
             
-            # Page 2 - NDVI (Green Health Score)
-            print("Generating Page 2: NDVI (Green Health Score)")
-            # Since we already extracted the images for this field, override the image paths
-            page2.generate_page2(excel_file, "templete/page2.html", temp_files["page2"], 
-                                current_image=os.path.join(field_images_dir, "current_ndvi.png"),
-                                old_image=os.path.join(field_images_dir, "old_ndvi.png"),
-                                field_data=single_row_data)
+            report_file = f"full_report_{field_name}.html"
+            manifest_entry = {
+                "field": str(row['Field']) if 'Field' in row else field_name,
+                "name": field_name,
+                "report": report_file,
+                "status": "failed",
+            }
+            manifest_entries.append(manifest_entry)
+            summaries[field_name] = dashboard.field_summary(row, field_name)
             
-            # Page 3 - NDMI (Moisture Level Indicator) 
-            print("Generating Page 3: NDMI (Moisture Level Indicator)")
-            page3.generate_page3(excel_file, "templete/page3.html", temp_files["page3"],
-                               current_image=os.path.join(field_images_dir, "current_ndmi.png"),
-                               old_image=os.path.join(field_images_dir, "old_ndmi.png"),
-                               field_data=single_row_data)
+            if batch_journal is not None and batch_journal.is_done(field_name):
+                manifest_entry["status"] = "ok"
+                if export is not None:
+                    export.add(row, field_name, report_file)
+                logger.info("Skipping %s, already completed", field_name, extra={"field": field_name})
+                if reporter is not None:
+                    reporter.field_skipped()
+                continue
             
-            # Page 4 - RECI (Leaf Freshness Index)
-            print("Generating Page 4: RECI (Leaf Freshness Index)")
-            page4.generate_page4(excel_file, "templete/page4.html", temp_files["page4"],
-                               current_image=os.path.join(field_images_dir, "current_reci.png"),
-                               old_image=os.path.join(field_images_dir, "old_reci.png"),
-                               field_data=single_row_data)
+            logger.info("===== Generating report for %s =====", field_name, extra={"field": field_name})
             
-            # Page 5 - MSAVI (Growth Strength Index)
-            print("Generating Page 5: MSAVI (Growth Strength Index)")
-            page5.generate_page5(excel_file, "templete/page5.html", temp_files["page5"],
-                               current_image=os.path.join(field_images_dir, "current_msavi.png"),
-                               old_image=os.path.join(field_images_dir, "old_msavi.png"),
-                               field_data=single_row_data)
+            if isolation is not None:
+                # Rendered below, each field in its own worker process
+                tasks.append(isolation_module.FieldTask(field_name, row, field_images[index]))
+                continue
             
-            # Page 6 - NDRE (Early Stress Checker)
-            print("Generating Page 6: NDRE (Early Stress Checker)")
-            page6.generate_page6(excel_file, "templete/page6.html", temp_files["page6"],
-                               current_image=os.path.join(field_images_dir, "current_ndre.png"),
-                               old_image=os.path.join(field_images_dir, "old_ndre.png"),
-                               field_data=single_row_data)
+            try:
+                if bundle is not None:
+                    combined_html = render_field_report(
+                        excel_file, pd.DataFrame([row]), field_name, os.path.join("images", field_name), assets,
+                        stage_timer)
+                    with stage_timer("write"):
+                        bundle_writer.add_field(manifest_entry["field"], field_name, combined_html,
+                                                encode_field_images(field_images[index], field_name,
+                                                                    imagery.redundant_images(row)))
+                    manifest_entry["status"] = "ok"
+                    if export is not None:
+                        export.add(row, field_name, report_file)
+                    logger.info("Full report added to %s: reports/%s", bundle, report_file)
+                    if reporter is not None:
+                        reporter.field_done()
+                    continue
+                
+                images = field_images[index] if field_images is not None else None
+                if precompress:
+                    combined_html = build_field_report(excel_file, row, field_name, images, assets, stage_timer)
+                    output_path = os.path.join(output_directory, report_file)
+                    pending.append((compress_pool.submit(precompress_module.encode_report, combined_html),
+                                    output_path, manifest_entry, row))
+                    write_precompressed(pending, batch_journal, reporter=reporter, export=export)
+                    continue
+                
+                output_path = generate_field_report(excel_file, row, field_name, output_directory, images,
+                                                    assets=assets, stage_timer=stage_timer)
+                batch_journal.record(manifest_entry["field"], field_name, report_file)
+                manifest_entry["status"] = "ok"
+                if export is not None:
+                    export.add(row, field_name, report_file)
+                logger.info("Full report generated successfully: %s", output_path, extra={"field": field_name})
+                if reporter is not None:
+                    reporter.field_done()
+                
+            except Exception as e:
+                logger.error("Error generating report for %s: %s", field_name, e, extra={"field": field_name})
+                if reporter is not None:
+                    reporter.field_failed()
+        
+        if isolation is not None:
+            report_name = isolation_module.FAILURE_REPORT
+            if shard is not None:
+                report_name = f"failures-shard-{shard[0]}-of-{shard[1]}.json"
+            entries_by_name = {entry["name"]: entry for entry in manifest_entries}
             
-            # Combine all pages into one report
-            combined_html = combine_html_pages(temp_files, field_name)
+            def field_done(task, output_path):
+                entry = entries_by_name[task.name]
+                batch_journal.record(entry["field"], task.name, entry["report"])
+                entry["status"] = "ok"
+                if export is not None:
+                    export.add(task.row, task.name, entry["report"])
+                if reporter is not None:
+                    reporter.field_done()
             
-            # Save the combined report
-            output_path = os.path.join(output_directory, f"full_report_{field_name}.html")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(combined_html)
-                
-            print(f"Full report generated successfully: {output_path}")
+            def attempt_done(task, outcome):
+                # Every attempt is timed as a whole, from worker start to result
+                if reporter is not None:
+                    reporter.observe("isolated", outcome["seconds"])
             
-        except Exception as e:
-            print(f"Error generating report for {field_name}: {e}")
-        finally:
-            # Clean up temporary files
-            for temp_file in temp_files.values():
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                    except Exception:
-                        pass
+            outcomes = isolation_module.run_isolated(excel_file, output_directory, tasks, report_name=report_name,
+                                                     on_success=field_done, on_outcome=attempt_done,
+                                                     precompress=precompress, assets=assets, **isolation)
+            if reporter is not None:
+                for outcome in outcomes.values():
+                    if outcome["status"] != "ok":
+                        reporter.field_failed()
+        elif precompress:
+            write_precompressed(pending, batch_journal, wait=True, reporter=reporter, export=export)
+            compress_pool.shutdown()
+        
+        # Dashboard of the reports generated, or per-shard summaries for merge to combine
+        completed = [summaries[entry["name"]] for entry in manifest_entries if entry["status"] == "ok"]
+        if shard is not None:
+            dashboard.write_shard_summary(output_directory, shard, completed, excel_file)
+        elif bundle is not None:
+            summary = dashboard.build_summary(completed, excel_file)
+            bundle_writer.add(f"reports/{dashboard.SUMMARY}", dashboard.summary_json(summary).encode("utf-8"),
+                              compress=True)
+            bundle_writer.add(f"reports/{dashboard.DASHBOARD}", dashboard.render_dashboard(summary).encode("utf-8"),
+                              compress=True)
+        else:
+            dashboard.write_dashboard(output_directory, completed, excel_file, precompress=precompress)
+        
+        if bundle is not None:
+            bundle_writer.close()
+        else:
+            batch_journal.close()
+        if export is not None:
+            export.close()
+        if reporter is not None:
+            reporter.close()
+        
+        if shard is not None:
+            generated = sum(entry["status"] == "ok" for entry in manifest_entries)
+            logger.info("Shard %s/%s generated %s of %s fields", shard[0], shard[1], generated, len(df))
+            if generated < len(manifest_entries):
+                logger.warning("Shard %s/%s: %s fields failed", shard[0], shard[1],
+                               len(manifest_entries) - generated)
+            sharding.write_shard_manifest(output_directory, shard, excel_file, len(df), manifest_entries, fields)
+    except BaseException:
+        # A failed or interrupted batch leaves no half-written bundle or results files behind
+        if bundle_writer is not None:
+            bundle_writer.abort()
+        if export is not None:
+            export.close(keep=False)
+        raise
+
+def generate_page_for_fields(page_number, excel_file, fields):
+    """
+    Generate one page report for each field matching the patterns
+    
+    Only the matching rows and their images are read from the workbook. Each
+    field's page is written to output_page<N>_<Field>.html.
+    
+    Args:
+        page_number (int): Page to generate, 1 or an index page
+        excel_file (str): Path to the Excel file with crop data
+        fields (list): Field names or glob patterns
+    """
+    import pandas as pd
+    
+    df, field_images = read_selected_fields(excel_file, fields)
+    if df is None:
+        logger.warning("No fields in %s match %s", excel_file, ', '.join(fields))
+        return
+    
+    for index, row in df.iterrows():
+        field_name = sanitize_field_name(row, index)
+        single_row_data = pd.DataFrame([row])
+        output_file = f"output_page{page_number}_{field_name}.html"
+        
+        if page_number == 1:
+            page1.generate_report_html(single_row_data, os.path.join(TEMPLATE_DIR, "page1.html"), output_file)
+            continue
+        
+        field_images_dir = os.path.join("images", field_name)
+        save_field_images(field_images[index], field_images_dir, field_name)
+        index_name = PAGE_INDICES[f"page{page_number}"]
+        index_pages.generate_index_page(
+            f"page{page_number}", excel_file, None, output_file,
+            current_image=os.path.join(field_images_dir, f"current_{index_name}.png"),
+            old_image=os.path.join(field_images_dir, f"old_{index_name}.png"),
+            field_data=single_row_data)
 
 def combine_html_pages(page_files, field_name=""):
     """
@@ -239,19 +827,20 @@ def combine_html_pages(page_files, field_name=""):
     Returns:
         str: Combined HTML content
     """
-    # Create output filename from field name
-    page_name = f"full_report_{field_name}"
-    # Start with a basic HTML structure
-    combined_html = """<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="utf-8"/>
-    <meta content="width=device-width, initial-scale=1" name="viewport"/>
-    <title>SiDRA Hub Crop Report</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.css" rel="stylesheet"/>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/html2pdf.js/0.10.1/html2pdf.bundle.min.js"></script>
-    <style>
+    page_contents = {}
+    for page_name, file_path in page_files.items():
+        try:
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    page_contents[page_name] = f.read()
+        except Exception as e:
+            logger.error("Error processing %s (%s): %s", page_name, file_path, e)
+    
+    return combine_page_contents(page_contents, field_name)
+
+# Stylesheet and PDF download script of the combined report; inlined into every
+# report, or served once from static/ under a content-hashed name (see static_assets)
+REPORT_CSS = """
     @media print {
       .page {
         page-break-after: always;
@@ -271,7 +860,107 @@ def combine_html_pages(page_files, field_name=""):
       flex-direction: column;
       justify-content: center;
     }
-    </style>
+    """
+
+REPORT_JS = """
+        document.getElementById('downloadPdf').addEventListener('click', function() {
+            console.log('PDF download button clicked');
+            
+            // Hide the download button during PDF generation
+            this.style.display = 'none';
+            
+            const element = document.getElementById('reportContent');
+            console.log('Report element found:', element);
+            
+            if (!element) {
+                alert('Report content not found!');
+                this.style.display = 'flex';
+                return;
+            }
+            
+            // Wait for any dynamic content to load
+            setTimeout(() => {
+                console.log('Starting PDF generation...');
+                
+                // Optimized options for better PDF quality and reliability
+        const opt = {
+          margin: 0,
+          filename: 'sidra_crop_report.pdf',
+          image: { 
+            type: 'jpeg', 
+            quality: 0.98
+          },
+          html2canvas: { 
+            scale: 2,
+            useCORS: true,
+            allowTaint: true,
+            letterRendering: true,
+            backgroundColor: '#dbe8f2',
+            width: 297 * 3.78, // px for A4 landscape
+            height: 210 * 3.78 // px for A4 landscape
+          },
+          jsPDF: { 
+            unit: 'mm', 
+            format: 'a4', 
+            orientation: 'landscape'
+          },
+          pagebreak: { mode: ['css', 'legacy'] }
+        };
+                
+                // Generate PDF
+                html2pdf()
+                    .from(element)
+                    .set(opt)
+                    .save()
+                    .then(() => {
+                        console.log('PDF generation successful');
+                        document.getElementById('downloadPdf').style.display = 'flex';
+                    })
+                    .catch((error) => {
+                        console.error('PDF generation failed:', error);
+                        document.getElementById('downloadPdf').style.display = 'flex';
+                        alert('PDF generation failed: ' + error.message);
+                    });
+            }, 500);
+        });
+    """
+
+def combine_page_contents(page_contents, field_name="", assets=None, pyramids=None):
+    """
+    Combine the HTML of multiple rendered pages into a single HTML document
+    
+    Args:
+        page_contents (dict): Dictionary of page names and their HTML content
+        field_name (str): Name of the field for this report
+        assets (dict): Manifest of the content-hashed static assets (static_assets.build);
+            when given, the report links the shared stylesheet, script and images in
+            static/ instead of inlining the stylesheet and script
+        pyramids (dict): Image file names mapped to their deep-zoom tile pyramid
+            (tiles.image_tiles); when given, those images open in the tile viewer
+        
+    Returns:
+        str: Combined HTML content
+    """
+    # Create output filename from field name
+    page_name = f"full_report_{field_name}"
+    if assets is None:
+        report_style = "<style>" + REPORT_CSS + "</style>"
+        report_script = "<script>" + REPORT_JS + "</script>"
+    else:
+        import static_assets
+        report_style = f'<link href="{static_assets.url(assets, static_assets.REPORT_CSS)}" rel="stylesheet"/>'
+        report_script = f'<script src="{static_assets.url(assets, static_assets.REPORT_JS)}"></script>'
+    # Start with a basic HTML structure
+    combined_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8"/>
+    <meta content="width=device-width, initial-scale=1" name="viewport"/>
+    <title>SiDRA Hub Crop Report</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.css" rel="stylesheet"/>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/html2pdf.js/0.10.1/html2pdf.bundle.min.js"></script>
+    """ + report_style + """
 </head>
 <body class="bg-gray-100">
     <!-- PDF Download Button -->
@@ -285,13 +974,10 @@ def combine_html_pages(page_files, field_name=""):
     <div id="reportContent">
 """
     
-    # Read and combine each page's content
-    for page_name, file_path in page_files.items():
+    # Combine each page's content
+    for page_name, html_content in page_contents.items():
         try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    html_content = f.read()
-                
+            if html_content is not None:
                 # Extract the body content between <body> and </body>
                 start_idx = html_content.find("<body")
                 if start_idx != -1:
@@ -339,7 +1025,7 @@ def combine_html_pages(page_files, field_name=""):
                         # Use the field_name passed to the function
                         field_path = field_name
                                                 
-                        print(f"Using field path for images: {field_path}")
+                        logger.debug("Using field path for images: %s", field_path)
                         
                         # First, manually fix the malformed image tags
                         # Look for patterns like 'src="../images/old_ndmi.png" width="220"/old_ndmi.png" width="220"'
@@ -363,84 +1049,172 @@ def combine_html_pages(page_files, field_name=""):
         <div class="page-break"></div>
 """
         except Exception as e:
-            print(f"Error processing {page_name} ({file_path}): {e}")
+            logger.error("Error processing %s: %s", page_name, e)
     
     # Add closing tags and PDF generation script
     combined_html += """
     </div>
 
-    <script>
-        document.getElementById('downloadPdf').addEventListener('click', function() {
-            console.log('PDF download button clicked');
-            
-            // Hide the download button during PDF generation
-            this.style.display = 'none';
-            
-            const element = document.getElementById('reportContent');
-            console.log('Report element found:', element);
-            
-            if (!element) {
-                alert('Report content not found!');
-                this.style.display = 'flex';
-                return;
-            }
-            
-            // Wait for any dynamic content to load
-            setTimeout(() => {
-                console.log('Starting PDF generation...');
-                
-                // Optimized options for better PDF quality and reliability
-        const opt = {
-          margin: 0,
-          filename: 'sidra_crop_report.pdf',
-          image: { 
-            type: 'jpeg', 
-            quality: 0.98
-          },
-          html2canvas: { 
-            scale: 2,
-            useCORS: true,
-            allowTaint: true,
-            letterRendering: true,
-            backgroundColor: '#dbe8f2',
-            width: 297 * 3.78, // px for A4 landscape
-            height: 210 * 3.78 // px for A4 landscape
-          },
-          jsPDF: { 
-            unit: 'mm', 
-            format: 'a4', 
-            orientation: 'landscape'
-          },
-          pagebreak: { mode: ['css', 'legacy'] }
-        };
-                
-                // Generate PDF
-                html2pdf()
-                    .from(element)
-                    .set(opt)
-                    .save()
-                    .then(() => {
-                        console.log('PDF generation successful');
-                        document.getElementById('downloadPdf').style.display = 'flex';
-                    })
-                    .catch((error) => {
-                        console.error('PDF generation failed:', error);
-                        document.getElementById('downloadPdf').style.display = 'flex';
-                        alert('PDF generation failed: ' + error.message);
-                    });
-            }, 500);
-        });
-    </script>
+    """ + report_script + """
 </body>
 </html>
 """
     
+    if pyramids:
+        combined_html = tiles.add_viewer(combined_html, field_name, pyramids)
+    if assets is not None:
+        combined_html = static_assets.rewrite(combined_html, assets)
     return combined_html
 
-if __name__ == "__main__":
-    # File paths
-    excel_file = "demo.xlsx"
-    output_directory = "reports"
+def shard_argument(value):
+    """argparse type for --shard I/N"""
+    import argparse
+    import sharding
+    
+    try:
+        return sharding.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def main(argv=None):
+    """
+    Command line entry point shared by the batch, pipeline, page, queue and server runners
+    
+    Without a command every field gets a full report, as before.
+    
+    Args:
+        argv (list): Command line arguments, defaults to sys.argv[1:]
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Generate SiDRA Hub crop reports from an Excel workbook")
+    parser.add_argument("--excel", default="demo.xlsx",
+                        help='Excel file with crop data, or a quoted glob pattern such as "weekly/*.xlsx" '
+                             'to merge several workbooks (default: demo.xlsx)')
+    parser.add_argument("--output", default="reports", help="Directory for the reports (default: reports)")
+    field_index.add_field_argument(parser)
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the fields already completed according to the journal in the output directory")
+    parser.add_argument("--bundle", default=None, metavar="PATH",
+                        help="Pack the reports and images into one zip bundle at PATH instead of separate files")
+    parser.add_argument("--precompress", action="store_true",
+                        help="Minify the reports and write .html.gz and .html.br siblings for static hosting")
+    parser.add_argument("--hashed-assets", action="store_true",
+                        help="Link the shared assets as content-hashed files in static/ for long-lived caching")
+    import advisory
+    advisory.add_argument(parser)
+    import cohort
+    cohort.add_argument(parser)
+    imagery.add_argument(parser)
+    tiles.add_argument(parser)
+    hotspots.add_arguments(parser)
+    contours.add_arguments(parser)
+    zones.add_argument(parser)
+    results.add_argument(parser)
+    import validation
+    validation.add_arguments(parser)
+    progress.add_arguments(parser)
+    parser.add_argument("--shard", default=None, type=shard_argument, metavar="I/N",
+                        help="Only generate the fields of shard I of N (1-based) and write a shard manifest")
+    import isolation
+    isolation.add_arguments(parser)
+    commands = parser.add_subparsers(dest="command", metavar="command")
     
-    # Generate the full report
-    generate_full_report(excel_file, output_directory)
+    full_parser = commands.add_parser("full", help="Generate the full report for every field (default)")
+    isolation.add_arguments(full_parser, default=argparse.SUPPRESS)
+    full_parser.add_argument("--resume", action="store_true", default=argparse.SUPPRESS,
+                             help="Skip the fields already completed according to the journal")
+    full_parser.add_argument("--bundle", default=argparse.SUPPRESS, metavar="PATH",
+                             help="Pack the reports and images into one zip bundle at PATH")
+    full_parser.add_argument("--precompress", action="store_true", default=argparse.SUPPRESS,
+                             help="Minify the reports and write .html.gz and .html.br siblings")
+    full_parser.add_argument("--hashed-assets", action="store_true", default=argparse.SUPPRESS,
+                             help="Link the shared assets as content-hashed files in static/")
+    advisory.add_argument(full_parser, default=argparse.SUPPRESS)
+    cohort.add_argument(full_parser, default=argparse.SUPPRESS)
+    imagery.add_argument(full_parser, default=argparse.SUPPRESS)
+    tiles.add_argument(full_parser, default=argparse.SUPPRESS)
+    hotspots.add_arguments(full_parser, default=argparse.SUPPRESS)
+    contours.add_arguments(full_parser, default=argparse.SUPPRESS)
+    zones.add_argument(full_parser, default=argparse.SUPPRESS)
+    results.add_argument(full_parser, default=argparse.SUPPRESS)
+    validation.add_arguments(full_parser, default=argparse.SUPPRESS)
+    progress.add_arguments(full_parser, default=argparse.SUPPRESS)
+    
+    page_parser = commands.add_parser("page", help="Generate a single page report")
+    page_numbers = [index_pages.page_number(name) for name in PAGE_NAMES]
+    page_parser.add_argument("number", type=int, choices=page_numbers,
+                             help=f"Page number ({', '.join(map(str, page_numbers))})")
+    page_parser.add_argument("--output-file", default=None, help="Output HTML file (default: output_page<N>.html)")
+    
+    import pipeline
+    pipeline_parser = commands.add_parser("pipeline", help="Generate full reports with the staged asyncio pipeline")
+    pipeline.add_arguments(pipeline_parser)
+    
+    from backend import app
+    serve_parser = commands.add_parser("serve", help="Serve reports rendered on demand")
+    app.add_arguments(serve_parser)
+    
+    import job_queue
+    queue_parser = commands.add_parser("queue", help="Queue field renders and run the workers that process them")
+    job_queue.add_arguments(queue_parser)
+    
+    merge_parser = commands.add_parser("merge", help="Merge and verify the shard manifests in the output directory")
+    merge_parser.add_argument("directory", nargs="?", default=None, help="Shared output directory (default: --output)")
+    
+    # --field is accepted after the command too, without resetting a value given before it
+    for command_parser in (full_parser, page_parser, pipeline_parser, serve_parser):
+        field_index.add_field_argument(command_parser, default=argparse.SUPPRESS)
+    # and so are the logging options, by every command
+    logs.add_arguments(parser)
+    for command_parser in (full_parser, page_parser, pipeline_parser, serve_parser, queue_parser, merge_parser):
+        logs.add_arguments(command_parser, default=argparse.SUPPRESS)
+    
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+    
+    if args.bundle and (args.isolate or args.resume):
+        parser.error("--bundle can't be combined with --isolate or --resume")
+    if args.bundle and args.precompress:
+        parser.error("--bundle can't be combined with --precompress; bundle reports are already deflated")
+    
+    if args.command == "page":
+        if args.field:
+            generate_page_for_fields(args.number, args.excel, args.field)
+        elif args.number == 1:
+            page1.generate_reports_for_all_rows(args.excel, os.path.join(TEMPLATE_DIR, "page1.html"), args.output)
+        else:
+            output_file = args.output_file or f"output_page{args.number}.html"
+            index_pages.generate_index_page(f"page{args.number}", args.excel, None, output_file)
+    elif args.command == "pipeline":
+        pipeline.run_from_args(args)
+    elif args.command == "serve":
+        app.run_from_args(args)
+    elif args.command == "queue":
+        job_queue.run_from_args(args)
+    elif args.command == "merge":
+        import sharding
+        path, problems = sharding.merge_manifests(args.directory or args.output)
+        if path:
+            logger.info("Merged manifest written: %s", path)
+            import dashboard
+            dashboard.merge_summaries(args.directory or args.output)
+        for problem in problems:
+            logger.error("Error: %s", problem)
+        if problems:
+            raise SystemExit(1)
+        logger.info("All fields are covered exactly once")
+    else:
+        generate_full_report(args.excel, args.output, fields=args.field, shard=args.shard,
+                             isolation=isolation.options_from_args(args), resume=args.resume,
+                             bundle=args.bundle, precompress=args.precompress,
+                             hashed_assets=args.hashed_assets, advisory_rules=args.advisory_rules,
+                             cohorts=args.cohorts, validate=args.validate, strict=args.strict,
+                             progress_options=progress.options_from_args(args),
+                             stale_imagery=args.stale_imagery, tile_pyramids=args.tiles,
+                             hotspot_options=hotspots.options_from_args(args),
+                             contour_options=contours.options_from_args(args), zone_count=args.zones,
+                             export_formats=args.export)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+"""
+Stress hotspots: connected low-value regions of the index maps
+
+The NDVI, NDMI, RECI, MSAVI and NDRE values of the workbook are one number per
+field, which hides whether the stress is spread over the field or sits in one
+corner. With ``--hotspots`` every index image of the batch is decoded into its
+values (see index_maps.py) before rendering starts, and:
+
+- the pixels more than DROP below the median of the field, on the colour scale
+  of the index, are stressed; with ``--hotspot-threshold`` the pixels below a
+  fixed scale position are, whatever the rest of the field looks like
+- the stressed pixels are labeled into 4-connected regions, and the regions of
+  at least MIN_AREA of the field are its hotspots, with their area and centroid
+- pages 2-6 outline the hotspots on the old and current image and say how many
+  there are, how much of the field they cover and where the largest one is
+
+Labeling is pure numpy, without SciPy: the stressed pixels are split into
+horizontal runs, runs overlapping a run of the row below are joined by a
+vectorized union-find, and areas and centroids are summed per run instead of
+per pixel, so a 4k x 4k map takes a fraction of a second (``python benchmark.py
+hotspots``).
+
+The hotspots are added to the workbook rows as "Hotspots ..." columns, so they
+reach the pages of the batch, pipeline, isolated and server paths alike, and
+are listed in ``<output>/hotspots.csv``.
+
+Usage:
+    python hotspots.py [--excel demo.xlsx] [--output hotspots.csv] [--hotspot-threshold 0.3]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Name of the report in the output directory
+REPORT = "hotspots.csv"
+
+# Scale positions below the median of the field for a pixel to be stressed
+DROP = 0.1
+
+# Smallest hotspot, as a fraction of the field's pixels; smaller regions are speckle
+MIN_AREA = 0.005
+
+# Most pixels the median of a field is taken over
+MEDIAN_SAMPLE = 1 << 20
+
+# Longest side in pixels of the outline overlays, twice the 220px of the page images
+OVERLAY_SIZE = 440
+
+# Colour of the hotspot outlines
+OUTLINE_COLOR = (17, 24, 39, 255)
+
+# Where a centroid lies, by thirds of the image from the top left
+COMPASS = [["north-west", "north", "north-east"],
+           ["west", "centre", "east"],
+           ["south-west", "south", "south-east"]]
+
+
+def _runs(mask):
+    """
+    Horizontal runs of the True pixels of a boolean image
+
+    Returns:
+        tuple: (rows, first columns, lengths, starts and ends in a flat layout with one
+            False pixel before every row, that layout's row stride), all in raster order
+    """
+    import numpy as np
+
+    height, width = mask.shape
+    stride = width + 1
+    flat = np.zeros(height * stride + 1, dtype=bool)
+    flat[:height * stride].reshape(height, stride)[:, 1:] = mask
+    # Every run starts after a False pixel and ends before one, so the changes alternate;
+    # 32-bit positions, where they fit, halve the memory traffic of the later steps
+    position_type = np.int32 if flat.size + 2 * stride < 2 ** 31 else np.int64
+    changes = np.flatnonzero(flat[1:] != flat[:-1]).astype(position_type) + 1
+    starts, ends = changes[0::2], changes[1::2]
+    rows = starts // stride
+    return rows, starts - rows * stride - 1, ends - starts, starts, ends, stride
+
+
+def _connect(starts, ends, stride):
+    """
+    Join the runs into 4-connected regions
+
+    Args:
+        starts, ends (numpy.ndarray): Flat start and end of every run, as _runs gives them
+        stride (int): Row stride of the flat layout
+
+    Returns:
+        tuple: (region of every run, numbered from 0 in raster order of the regions'
+            first pixels; number of regions)
+    """
+    import numpy as np
+
+    count = len(starts)
+    if not count:
+        return np.zeros(0, dtype=np.intp), 0
+
+    # The runs of the next row sharing a column with a run: those ending after its start
+    # and starting before its end, one row further on; they are consecutive
+    first = np.searchsorted(ends, starts + stride, side="right")
+    last = np.searchsorted(starts, ends + stride, side="left")
+    overlaps = np.maximum(last - first, 0)
+    upper = np.repeat(np.arange(count), overlaps)
+    offsets = np.arange(len(upper)) - np.repeat(np.cumsum(overlaps) - overlaps, overlaps)
+    lower = first[upper] + offsets
+
+    # Union-find over all the joins at once: every round hooks each root to the smallest
+    # root it is joined to, then flattens the trees, until no join crosses two trees
+    parent = np.arange(count)
+    while len(upper):
+        upper_roots, lower_roots = parent[upper], parent[lower]
+        crossing = upper_roots != lower_roots
+        upper, lower = upper[crossing], lower[crossing]
+        if not len(upper):
+            break
+        upper_roots, lower_roots = upper_roots[crossing], lower_roots[crossing]
+        np.minimum.at(parent, np.maximum(upper_roots, lower_roots), np.minimum(upper_roots, lower_roots))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    # A root is the first run of its region, so numbering the roots in order keeps raster order
+    is_root = parent == np.arange(count)
+    numbers = np.cumsum(is_root) - 1
+    return numbers[parent], int(numbers[-1]) + 1
+
+
+def label(mask):
+    """
+    Label the 4-connected regions of a boolean image, like scipy.ndimage.label
+
+    Returns:
+        tuple: (int32 image with 0 outside the regions and 1..count inside, count)
+    """
+    import numpy as np
+
+    _, _, lengths, starts, ends, stride = _runs(mask)
+    regions, count = _connect(starts, ends, stride)
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    labels[mask] = np.repeat(regions.astype(np.int32) + 1, lengths)
+    return labels, count
+
+
+def find_hotspots(values, threshold=None, drop=DROP, min_area=MIN_AREA):
+    """
+    Hotspots of a decoded index map
+
+    Args:
+        values (numpy.ndarray): Scale positions, NaN outside the field (index_maps.decode)
+        threshold (float): Fixed scale position below which a pixel is stressed; None
+            for DROP below the median of the field
+        drop (float): Scale positions below the median for a pixel to be stressed
+        min_area (float): Smallest hotspot, as a fraction of the field's pixels
+
+    Returns:
+        tuple: (list of hotspots as dicts with "pixels", "area" (percent of the field),
+            "x" and "y" (centroid as fractions of the width and height), largest first;
+            (image shape, rows, first columns, lengths) of the hotspots' runs for
+            outline_overlay, None when there are none)
+    """
+    import numpy as np
+
+    field_pixels = int(np.count_nonzero(~np.isnan(values)))
+    if not field_pixels:
+        return [], None
+    if threshold is None:
+        # The median of an evenly spread sample of at most MEDIAN_SAMPLE pixels
+        step = max(1, math.isqrt(values.size // MEDIAN_SAMPLE))
+        sample = values[::step, ::step]
+        sample = sample[~np.isnan(sample)]
+        if not sample.size:
+            sample = values[~np.isnan(values)]
+        threshold = float(np.median(sample)) - drop
+    with np.errstate(invalid="ignore"):
+        stressed = values < threshold
+
+    rows, columns, lengths, starts, ends, stride = _runs(stressed)
+    regions, count = _connect(starts, ends, stride)
+    if not count:
+        return [], None
+    pixels = np.bincount(regions, weights=lengths, minlength=count)
+    # Sums over a run: its length times its middle column, and times its row
+    x_sums = np.bincount(regions, weights=lengths * (columns + (lengths - 1) / 2), minlength=count)
+    y_sums = np.bincount(regions, weights=lengths * rows, minlength=count)
+
+    keep = pixels >= max(1, min_area * field_pixels)
+    height, width = values.shape
+    hotspots = [{"pixels": int(pixels[region]),
+                 "area": round(100 * float(pixels[region]) / field_pixels, 2),
+                 "x": round((float(x_sums[region] / pixels[region]) + 0.5) / width, 4),
+                 "y": round((float(y_sums[region] / pixels[region]) + 0.5) / height, 4)}
+                for region in np.flatnonzero(keep)]
+    if not hotspots:
+        return [], None
+    hotspots.sort(key=lambda hotspot: -hotspot["pixels"])
+    kept = keep[regions]
+    return hotspots, (values.shape, rows[kept], columns[kept], lengths[kept])
+
+
+def outline_overlay(runs):
+    """
+    Transparent PNG with the outlines of the hotspots, at most OVERLAY_SIZE pixels wide or high
+
+    The runs of the hotspots are drawn straight at the overlay size, never at the size
+    of the image, and the edges are traced there, so the outlines are as thick in the
+    page whatever the image's resolution.
+
+    Args:
+        runs (tuple): (image shape, rows, first columns, lengths) of the hotspots' runs,
+            as find_hotspots gives them
+
+    Returns:
+        str: data: URI of the PNG
+    """
+    import numpy as np
+    from PIL import Image
+
+    (height, width), rows, columns, lengths = runs
+    scale = OVERLAY_SIZE / max(height, width)
+    sample_rows = (np.arange(max(1, round(height * scale))) / scale).astype(np.intp).clip(0, height - 1)
+    sample_columns = (np.arange(max(1, round(width * scale))) / scale).astype(np.intp).clip(0, width - 1)
+
+    # Every overlay row sampling the row of a run gets +1 at the first overlay column the
+    # run covers and -1 after the last; the running sum along the rows fills the runs in
+    first_row = np.searchsorted(sample_rows, rows, side="left")
+    row_counts = np.searchsorted(sample_rows, rows, side="right") - first_row
+    run_numbers = np.repeat(np.arange(len(rows)), row_counts)
+    overlay_rows = first_row[run_numbers] + np.arange(len(run_numbers)) - np.repeat(
+        np.cumsum(row_counts) - row_counts, row_counts)
+    marks = np.zeros((len(sample_rows), len(sample_columns) + 1), dtype=np.int32)
+    np.add.at(marks, (overlay_rows, np.searchsorted(sample_columns, columns[run_numbers])), 1)
+    np.add.at(marks, (overlay_rows, np.searchsorted(sample_columns, (columns + lengths)[run_numbers])), -1)
+    inside = np.pad(np.cumsum(marks, axis=1)[:, :-1] > 0, 1)
+
+    # Hotspot pixels with a 4-neighbour outside, thickened by one pixel inwards
+    core = inside[1:-1, 1:-1]
+    edge = core & ~(inside[:-2, 1:-1] & inside[2:, 1:-1] & inside[1:-1, :-2] & inside[1:-1, 2:])
+    edge = np.pad(edge, 1)
+    edge = core & (edge[1:-1, 1:-1] | edge[:-2, 1:-1] | edge[2:, 1:-1] | edge[1:-1, :-2] | edge[1:-1, 2:])
+
+    overlay = np.zeros(edge.shape + (4,), dtype=np.uint8)
+    overlay[edge] = OUTLINE_COLOR
+    output = io.BytesIO()
+    Image.fromarray(overlay, "RGBA").save(output, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def analyze_image(data, index, threshold=None, min_area=MIN_AREA):
+    """
+    Hotspots and outline overlay of one index image
+
+    Returns:
+        tuple: (hotspots as find_hotspots gives them, overlay data: URI or None);
+            None when the image can't be decoded
+    """
+    import index_maps
+
+    values = index_maps.decode(data, index)
+    if values is None:
+        return None
+    hotspots, runs = find_hotspots(values, threshold, min_area=min_area)
+    return hotspots, (outline_overlay(runs) if runs is not None else None)
+
+
+def _analyze(task):
+    return analyze_image(*task)
+
+
+def analyze_images(tasks, workers=None):
+    """analyze_image over (data, index, threshold, min_area) tasks, in a process pool when there are several"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if len(tasks) <= 1:
+        return [_analyze(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(len(tasks), workers or os.cpu_count() or 1)) as pool:
+        return list(pool.map(_analyze, tasks, chunksize=4))
+
+
+def compute_hotspots(df, field_images, threshold=None, min_area=MIN_AREA):
+    """
+    Find the hotspots of every index image of the batch
+
+    Old images imagery.py found to be the same as the current ones aren't analyzed;
+    the page shows the current image, and its outlines, in both places.
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        field_images (list): Each row's {image file name: raw bytes}, in the order of df
+        threshold (float): Fixed scale position below which a pixel is stressed, None
+            for DROP below the field's median
+        min_area (float): Smallest hotspot, as a fraction of the field's pixels
+
+    Returns:
+        pandas.DataFrame: Same index as df with, for every index and slot, the columns
+            "Hotspots <INDEX> <current|old> count", "... area" (percent of the field),
+            "... regions" (JSON list of the hotspots) and "... outline" (overlay data: URI)
+    """
+    import pandas as pd
+
+    import advisory
+    import imagery
+
+    # Every distinct image is decoded once, whichever rows and slots it appears in
+    tasks, cells = {}, []
+    for index in advisory.INDICES:
+        stale = imagery.stale_mask(df, index)
+        for slot in imagery.SLOTS:
+            for position, images in enumerate(field_images):
+                data = images.get(imagery.image_file(index, slot))
+                if data is None or (slot == "old" and stale[position]):
+                    continue
+                key = (hashlib.sha256(data).hexdigest(), index)
+                tasks.setdefault(key, (data, index, threshold, min_area))
+                cells.append((position, index, slot, key))
+    results = dict(zip(tasks, analyze_images(list(tasks.values()))))
+
+    columns = {}
+    for index in advisory.INDICES:
+        for slot in imagery.SLOTS:
+            columns[f"Hotspots {index} {slot} count"] = pd.array([None] * len(df), dtype="Int64")
+            columns[f"Hotspots {index} {slot} area"] = pd.array([None] * len(df), dtype="Float64")
+            columns[f"Hotspots {index} {slot} regions"] = [None] * len(df)
+            columns[f"Hotspots {index} {slot} outline"] = [None] * len(df)
+    for position, index, slot, key in cells:
+        result = results[key]
+        if result is None:
+            continue
+        hotspots, overlay = result
+        columns[f"Hotspots {index} {slot} count"][position] = len(hotspots)
+        columns[f"Hotspots {index} {slot} area"][position] = round(sum(h["area"] for h in hotspots), 2)
+        columns[f"Hotspots {index} {slot} regions"][position] = json.dumps(hotspots)
+        columns[f"Hotspots {index} {slot} outline"][position] = overlay
+    return pd.DataFrame(columns, index=df.index)
+
+
+def apply_hotspots(df, field_images, threshold=None, min_area=MIN_AREA):
+    """
+    Add the columns of compute_hotspots to the workbook rows
+
+    Returns:
+        tuple: (copy of df with the "Hotspots ..." columns, list of report rows
+            (field, index, image, hotspot number, pixels, area, centroid x, centroid y))
+    """
+    import pandas as pd
+
+    import advisory
+    import imagery
+
+    stats = compute_hotspots(df, field_images, threshold, min_area)
+    df = pd.concat([df.drop(columns=[c for c in stats.columns if c in df.columns]), stats], axis=1)
+
+    names = df["Field"].astype(str) if "Field" in df.columns else pd.Series(df.index, index=df.index).astype(str)
+    found = []
+    for index in advisory.INDICES:
+        for slot in imagery.SLOTS:
+            for name, regions in zip(names, stats[f"Hotspots {index} {slot} regions"]):
+                if not isinstance(regions, str):
+                    continue
+                for number, hotspot in enumerate(json.loads(regions), start=1):
+                    found.append((name, index, slot, number, hotspot["pixels"], hotspot["area"],
+                                  hotspot["x"], hotspot["y"]))
+    return df, found
+
+
+def write_report(found, path):
+    """Write the hotspots as CSV, atomically"""
+    import csv
+
+    import journal
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["field", "index", "image", "hotspot", "pixels", "area_percent", "centroid_x", "centroid_y"])
+    writer.writerows(found)
+    journal.write_text_atomic(path, buffer.getvalue())
+
+
+def apply_and_report(df, field_images, options=None, output_directory=None):
+    """apply_hotspots with the options of options_from_args, logging a summary and writing hotspots.csv"""
+    import advisory
+    import imagery
+
+    options = options or {}
+    try:
+        df, found = apply_hotspots(df, field_images, options.get("threshold"), options.get("min_area", MIN_AREA))
+    except Exception as e:
+        # Reports without outlines are still reports
+        logger.error("Error finding hotspots: %s", e)
+        return df
+    analyzed = int(sum(df[f"Hotspots {index} {slot} count"].notna().sum()
+                       for index in advisory.INDICES for slot in imagery.SLOTS))
+    logger.info("Hotspots: %d images analyzed, %d hotspots found", analyzed, len(found))
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+        path = os.path.join(output_directory, REPORT)
+        write_report(found, path)
+        logger.info("Hotspot report written: %s", path)
+    return df
+
+
+def _hotspot_slot(row, index, slot):
+    """Slot whose hotspots an image of a page shows: the current one where the old image is stale"""
+    import imagery
+
+    return "current" if slot == "old" and imagery.is_stale(row, index) else slot
+
+
+def compass(hotspot):
+    """Where a hotspot lies in the image, e.g. "north-west" """
+    return COMPASS[min(int(hotspot["y"] * 3), 2)][min(int(hotspot["x"] * 3), 2)]
+
+
+def outline_image(df, index, slot, image_tag):
+    """
+    An image tag of a page, with the hotspot outlines laid over it when there are any
+
+    Args:
+        df (pandas.DataFrame): Row data of the field, with the columns of apply_hotspots
+        index (str): Index of the page, e.g. "NDVI"
+        slot (str): "current" or "old"
+        image_tag (str): The page's <img> tag of that image
+
+    Returns:
+        str: image_tag, or image_tag and the overlay in a positioned wrapper
+    """
+    if df.empty:
+        return image_tag
+    row = df.iloc[0]
+    overlay = row.get(f"Hotspots {index} {_hotspot_slot(row, index, slot)} outline")
+    if not isinstance(overlay, str):
+        return image_tag
+    return (f'<div class="relative w-[220px] h-[220px]">{image_tag}'
+            f'<img alt="" aria-hidden="true" class="absolute inset-0 w-[220px] h-[220px] object-cover '
+            f'pointer-events-none" src="{overlay}"/></div>')
+
+
+def page_note(df, index):
+    """
+    HTML line about the hotspots of the field of a page for one index
+
+    Args:
+        df (pandas.DataFrame): Row data of the field, with the columns of apply_hotspots
+        index (str): Index of the page, e.g. "NDVI"
+
+    Returns:
+        str: The line, or "" when the images weren't analyzed
+    """
+    if df.empty:
+        return ""
+    row = df.iloc[0]
+    parts = []
+    for slot in ("current", "old"):
+        regions = row.get(f"Hotspots {index} {_hotspot_slot(row, index, slot)} regions")
+        if not isinstance(regions, str):
+            continue
+        if slot == "old" and _hotspot_slot(row, index, slot) == "current":
+            continue
+        hotspots = json.loads(regions)
+        if not hotspots:
+            parts.append(f"none in the {slot} image")
+            continue
+        area = sum(hotspot["area"] for hotspot in hotspots)
+        largest = hotspots[0]
+        text = (f"{len(hotspots)} in the {slot} image, covering {area:.1f}% of the field, "
+                f"the largest ({largest['area']:.1f}%) in the {compass(largest)}")
+        parts.append(text if len(hotspots) > 1 else
+                     f"1 in the {slot} image, covering {area:.1f}% of the field, in the {compass(largest)}")
+    if not parts:
+        return ""
+    return (f'<p class="mt-2 text-[13px]"><span class="font-bold">{index} stress hotspots (outlined):</span> '
+            f'{"; ".join(parts)}</p>')
+
+
+def add_arguments(parser, default=None):
+    """Add --hotspots, --hotspot-threshold and --hotspot-min-area to an argparse parser"""
+    def option_default(value):
+        return value if default is None else default
+
+    parser.add_argument("--hotspots", action="store_true", default=option_default(False),
+                        help="Find the connected low-value regions of every index image and outline them "
+                             "on pages 2-6")
+    parser.add_argument("--hotspot-threshold", type=float, default=option_default(None), metavar="POSITION",
+                        help=f"Scale position (0-1) below which a pixel is stressed "
+                             f"(default: {DROP:g} below the median of the field)")
+    parser.add_argument("--hotspot-min-area", type=float, default=option_default(MIN_AREA), metavar="FRACTION",
+                        help=f"Smallest hotspot as a fraction of the field (default: {MIN_AREA:g})")
+
+
+def options_from_args(args):
+    """Return the hotspot options of parsed arguments, or None if no hotspots were asked for"""
+    if not getattr(args, "hotspots", False):
+        return None
+    return {
+        "threshold": getattr(args, "hotspot_threshold", None),
+        "min_area": getattr(args, "hotspot_min_area", MIN_AREA),
+    }
+
+
+def main(argv=None):
+    import generate_report
+    import logs
+
+    parser = argparse.ArgumentParser(description="Find the stress hotspots of the index images of a workbook")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default=None, help="Write the hotspots to a CSV file")
+    parser.add_argument("--hotspot-threshold", type=float, default=None, metavar="POSITION",
+                        help=f"Scale position (0-1) below which a pixel is stressed "
+                             f"(default: {DROP:g} below the median of the field)")
+    parser.add_argument("--hotspot-min-area", type=float, default=MIN_AREA, metavar="FRACTION",
+                        help=f"Smallest hotspot as a fraction of the field (default: {MIN_AREA:g})")
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df, field_images = generate_report.read_selected_fields(args.excel)
+    if df is None:
+        logger.warning("No fields found in %s", args.excel)
+        return
+    _, found = apply_hotspots(df, field_images, args.hotspot_threshold, args.hotspot_min_area)
+    if args.output:
+        write_report(found, args.output)
+        logger.info("Hotspot report written: %s", args.output)
+    else:
+        for name, index, slot, number, pixels, area, x, y in found:
+            print(f"{name}  {index:<5}  {slot:<7}  #{number}  {area:6.2f}%  ({pixels} px)  "
+                  f"centroid {x:.2f}, {y:.2f}  {compass({'x': x, 'y': y})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Perceptual hashes of the field images: stale and reused imagery
+
+When no new satellite pass arrived, the workbook often has the same picture as
+the "old" and the "current" image of an index (in the demo, old_msavi.png and
+current_msavi.png are byte-for-byte identical), and the page compares an image
+with itself. With ``--stale-imagery`` every image read from the workbook is
+hashed before any report is rendered:
+
+- every image is decoded once into a THUMBNAIL_SIZE grayscale thumbnail, and
+  the dHash (brighter than the right-hand neighbour, on a 9x8 resampling) and
+  pHash (above the median of the 8x8 lowest DCT frequencies) of all of them
+  are computed together, as matrix products over the stacked thumbnails
+- an old and current image of a field whose hashes differ in at most
+  NEAR_DUPLICATE_BITS bits, both dHash and pHash, are the same image, even
+  when re-encoded or resized; the page says "no new imagery", shows the
+  current image in both places and the old image is not saved, and the change
+  is left out of the cohort rankings (see cohort.py)
+- an image whose hashes are also those of another field's image was pasted
+  into the wrong row; the page asks to check the workbook
+
+The hashes and flags are added to the workbook rows as "Imagery ..." columns,
+so they reach the pages of the batch, pipeline, isolated and server paths
+alike, and the flagged images are listed in ``<output>/imagery.csv``.
+
+Usage:
+    python imagery.py [--excel demo.xlsx] [--output imagery.csv] [--threshold 3]
+"""
+import argparse
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Name of the report in the output directory
+REPORT = "imagery.csv"
+
+# Side of the square the hashes are sampled on: 8x8 = 64 bits
+HASH_SIZE = 8
+
+# Side of the grayscale thumbnail every image is decoded to, the pHash DCT input
+THUMBNAIL_SIZE = 32
+
+# Most bits in which both hashes of an old and current image may differ for them to be the same image
+NEAR_DUPLICATE_BITS = 3
+
+# Images of every index, in the order of the "Imagery ..." columns
+SLOTS = ["current", "old"]
+
+
+def image_file(index, slot):
+    """Image file name of an index and slot, e.g. ("NDVI", "old") -> "old_ndvi.png" """
+    return f"{slot}_{index.lower()}.png"
+
+
+def _flagged(value):
+    import pandas as pd
+
+    return bool(pd.notna(value) and value)
+
+
+def _thumbnail(data):
+    """Grayscale THUMBNAIL_SIZE square of an image as floats, None if it can't be decoded"""
+    import numpy as np
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # Lets JPEG decode at a reduced size; other formats ignore it
+            img.draft("L", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            # Transparent areas around the field are white, whatever colour the file stores in them
+            flat = Image.new("RGBA", img.size, "white")
+            flat.alpha_composite(img.convert("RGBA"))
+            thumbnail = flat.convert("L").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            return np.asarray(thumbnail, dtype=np.float32)
+    except Exception as e:
+        logger.warning("Error decoding image for hashing: %s", e)
+        return None
+
+
+def _area_matrix(source, target):
+    """(target, source) matrix averaging source samples into target equal bins"""
+    import numpy as np
+
+    edges = np.linspace(0, source, target + 1)
+    positions = np.arange(source)
+    overlap = np.clip(np.minimum(edges[1:, None], positions + 1) - np.maximum(edges[:-1, None], positions), 0, None)
+    return overlap / overlap.sum(axis=1, keepdims=True)
+
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix"""
+    import numpy as np
+
+    frequencies = np.arange(size)[:, None]
+    samples = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * samples + 1) * frequencies / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def _pack(bits):
+    """(N, ...) booleans of 64 bits each -> N uint64"""
+    import numpy as np
+
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def hash_thumbnails(thumbnails):
+    """
+    dHash and pHash of a stack of thumbnails, all at once
+
+    Args:
+        thumbnails (numpy.ndarray): (N, THUMBNAIL_SIZE, THUMBNAIL_SIZE) grayscale thumbnails
+
+    Returns:
+        tuple: (dHashes, pHashes), two uint64 arrays of N
+    """
+    import numpy as np
+
+    thumbnails = np.asarray(thumbnails, dtype=np.float64).reshape(-1, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    rows = _area_matrix(THUMBNAIL_SIZE, HASH_SIZE)
+    columns = _area_matrix(THUMBNAIL_SIZE, HASH_SIZE + 1)
+    small = rows @ thumbnails @ columns.T
+    dhashes = _pack(small[:, :, 1:] > small[:, :, :-1])
+
+    dct = _dct_matrix(THUMBNAIL_SIZE)
+    low = (dct @ thumbnails @ dct.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(thumbnails), -1)
+    phashes = _pack(low > np.median(low, axis=1, keepdims=True))
+    return dhashes, phashes
+
+
+def hamming(a, b):
+    """Number of differing bits between two arrays of uint64 hashes"""
+    import numpy as np
+
+    difference = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return np.unpackbits(difference.reshape(-1, 1).view(np.uint8), axis=1).sum(axis=1)
+
+
+def compute_imagery(df, field_images, threshold=NEAR_DUPLICATE_BITS):
+    """
+    Hash every image of the batch and flag stale and reused ones
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        field_images (list): Each row's {image file name: raw bytes}, in the order of df
+        threshold (int): Most bits in which both hashes of an old and current image may
+            differ for them to count as the same image
+
+    Returns:
+        pandas.DataFrame: Same index as df with, for every index, the columns
+            "Imagery <INDEX> current hash" and "... old hash" (hex dHash and pHash),
+            "... distance" (bits differing between old and current), "... stale"
+            (no new imagery) and "... reused" (where else the images appear, or "")
+    """
+    import numpy as np
+    import pandas as pd
+
+    import advisory
+
+    indices = advisory.INDICES
+    names = (df["Field"].astype(str).to_numpy() if "Field" in df.columns
+             else np.array([f"row {position + 1}" for position in range(len(df))], dtype=object))
+
+    # Decode every image once; positions of the decoded ones in a (row, index, slot) grid
+    thumbnails, cells = [], []
+    for position, images in enumerate(field_images):
+        for i, index in enumerate(indices):
+            for s, slot in enumerate(SLOTS):
+                data = images.get(image_file(index, slot))
+                thumbnail = _thumbnail(data) if data is not None else None
+                if thumbnail is not None:
+                    thumbnails.append(thumbnail)
+                    cells.append((position, i, s))
+
+    shape = (len(df), len(indices), len(SLOTS))
+    dgrid = np.zeros(shape, dtype=np.uint64)
+    pgrid = np.zeros(shape, dtype=np.uint64)
+    hashed = np.zeros(shape, dtype=bool)
+    if thumbnails:
+        dhashes, phashes = hash_thumbnails(np.stack(thumbnails))
+        cells = tuple(np.array(cells).T)
+        dgrid[cells], pgrid[cells], hashed[cells] = dhashes, phashes, True
+
+    # Old against current of every field and index
+    distance = np.maximum(hamming(dgrid[..., 0], dgrid[..., 1]),
+                          hamming(pgrid[..., 0], pgrid[..., 1])).reshape(shape[:2])
+    paired = hashed.all(axis=2)
+    stale = paired & (distance <= threshold)
+
+    # The same hashes in the rows of different fields
+    positions, index_numbers, slot_numbers = np.indices(shape)
+    entries = pd.DataFrame({
+        "position": positions.ravel(),
+        "index": index_numbers.ravel(),
+        "slot": slot_numbers.ravel(),
+        "dhash": dgrid.ravel(),
+        "phash": pgrid.ravel(),
+    })[hashed.ravel()]
+    keys = ["dhash", "phash"]
+    fields_per_key = entries.groupby(keys)["position"].transform("nunique")
+    reused = [[[] for _ in indices] for _ in range(len(df))]
+    for _, group in entries[fields_per_key > 1].groupby(keys, sort=False):
+        members = list(group.itertuples(index=False))
+        for member in members:
+            other = next(m for m in members if m.position != member.position)
+            reused[member.position][member.index].append(
+                f"{SLOTS[member.slot]} image is the {SLOTS[other.slot]} {indices[other.index]} "
+                f"image of {names[other.position]}")
+
+    def hex_hashes(i, s):
+        return [f"{int(d):016x}{int(p):016x}" if ok else None
+                for d, p, ok in zip(dgrid[:, i, s], pgrid[:, i, s], hashed[:, i, s])]
+
+    columns = {}
+    for i, index in enumerate(indices):
+        for s, slot in enumerate(SLOTS):
+            columns[f"Imagery {index} {slot} hash"] = hex_hashes(i, s)
+        distances = pd.array(distance[:, i], dtype="Int64")
+        distances[~paired[:, i]] = pd.NA
+        columns[f"Imagery {index} distance"] = distances
+        columns[f"Imagery {index} stale"] = pd.array(stale[:, i], dtype="boolean")
+        columns[f"Imagery {index} reused"] = ["; ".join(row[i]) for row in reused]
+    return pd.DataFrame(columns, index=df.index)
+
+
+def apply_imagery(df, field_images, threshold=NEAR_DUPLICATE_BITS):
+    """
+    Add the columns of compute_imagery to the workbook rows
+
+    Returns:
+        tuple: (copy of df with the "Imagery ..." columns, list of report rows
+            (field, index, problem, distance, detail) of the flagged images)
+    """
+    import pandas as pd
+
+    import advisory
+
+    stats = compute_imagery(df, field_images, threshold)
+    df = pd.concat([df.drop(columns=[c for c in stats.columns if c in df.columns]), stats], axis=1)
+
+    names = df["Field"].astype(str) if "Field" in df.columns else pd.Series(df.index, index=df.index).astype(str)
+    problems = []
+    for index in advisory.INDICES:
+        stale = stats[f"Imagery {index} stale"].fillna(False).to_numpy(dtype=bool)
+        for name, distance in zip(names[stale], stats[f"Imagery {index} distance"][stale]):
+            problems.append((name, index, "no new imagery", int(distance), "old and current image are the same"))
+        reused = stats[f"Imagery {index} reused"] != ""
+        for name, detail in zip(names[reused], stats[f"Imagery {index} reused"][reused]):
+            problems.append((name, index, "reused", "", detail))
+    return df, problems
+
+
+def write_report(problems, path):
+    """Write the flagged images as CSV, atomically"""
+    import csv
+
+    import journal
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["field", "index", "problem", "distance", "detail"])
+    writer.writerows(problems)
+    journal.write_text_atomic(path, buffer.getvalue())
+
+
+def apply_and_report(df, field_images, output_directory=None):
+    """apply_imagery, logging what was found and writing imagery.csv to the output directory"""
+    import os
+
+    import advisory
+
+    df, problems = apply_imagery(df, field_images)
+    stale = sum(problem[2] == "no new imagery" for problem in problems)
+    reused = len(problems) - stale
+    hashed = int(sum(df[f"Imagery {index} {slot} hash"].notna().sum()
+                     for index in advisory.INDICES for slot in SLOTS))
+    logger.info("Imagery: %d images hashed, %d index pages with no new imagery, %d reused images",
+                hashed, stale, reused)
+    for name, index, problem, _, detail in problems:
+        if problem == "reused":
+            logger.warning("%s %s: %s", name, index, detail, extra={"field": name})
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+        path = os.path.join(output_directory, REPORT)
+        write_report(problems, path)
+        logger.info("Imagery report written: %s", path)
+    return df
+
+
+def stale_mask(df, index):
+    """Boolean array of the rows whose old and current image of an index are the same"""
+    import numpy as np
+
+    column = f"Imagery {index} stale"
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df[column].fillna(False).to_numpy(dtype=bool)
+
+
+def is_stale(row, index):
+    """True when a row (pandas.Series) has no new imagery for an index"""
+    return _flagged(row.get(f"Imagery {index} stale"))
+
+
+def redundant_images(row):
+    """Image file names of a row that needn't be saved: the old images of its stale indices"""
+    import advisory
+
+    return {image_file(index, "old") for index in advisory.INDICES if is_stale(row, index)}
+
+
+def page_note(df, index):
+    """
+    HTML lines about the images of the field of a page for one index
+
+    Args:
+        df (pandas.DataFrame): Row data of the field, with the columns of apply_imagery
+        index (str): Index of the page, e.g. "NDVI"
+
+    Returns:
+        str: The lines, or "" when the images weren't hashed or nothing was found
+    """
+    if df.empty:
+        return ""
+    row = df.iloc[0]
+    note = ""
+    if is_stale(row, index):
+        note += (f'<p class="mt-2 text-[13px] font-bold text-amber-700">No new imagery: the current {index} image '
+                 f'is the same as the old image, so no new satellite pass is shown</p>')
+    reused = row.get(f"Imagery {index} reused")
+    if isinstance(reused, str) and reused:
+        details = "; ".join(f"the {index} {detail}" for detail in reused.split("; "))
+        note += f'<p class="mt-2 text-[13px] font-bold text-red-700">Check the workbook: {details}</p>'
+    return note
+
+
+def add_argument(parser, default=False):
+    """Add --stale-imagery to an argparse parser"""
+    parser.add_argument("--stale-imagery", action="store_true", default=default,
+                        help="Hash every image, mark pages whose old and current image are the same as "
+                             "'no new imagery' and flag images reused across fields")
+
+
+def main(argv=None):
+    import generate_report
+    import logs
+
+    parser = argparse.ArgumentParser(description="Find stale and reused images in a workbook")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default=None, help="Write the flagged images to a CSV file")
+    parser.add_argument("--threshold", type=int, default=NEAR_DUPLICATE_BITS,
+                        help=f"Most differing hash bits for the same image (default: {NEAR_DUPLICATE_BITS})")
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df, field_images = generate_report.read_selected_fields(args.excel)
+    if df is None:
+        logger.warning("No fields found in %s", args.excel)
+        return
+    _, problems = apply_imagery(df, field_images, args.threshold)
+    if args.output:
+        write_report(problems, args.output)
+        logger.info("Imagery report written: %s", args.output)
+    else:
+        for name, index, problem, distance, detail in problems:
+            print(f"{name}  {index:<5}  {problem:<14}  {detail}" + (f" ({distance} bits)" if distance != "" else ""))
+
+
+if __name__ == "__main__":
+    main()
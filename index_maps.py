@@ -0,0 +1,172 @@
+"""
+Decoded index maps: the index images of the workbook as arrays of values
+
+The images in the workbook are colour-mapped index rasters with the field
+outside made transparent. The NDVI, RECI, MSAVI and NDRE images use the
+ColorBrewer RdYlGn scale (red low, green high) and the NDMI images PuOr
+(orange dry, purple wet). decode() turns an image back into its values: every
+pixel's position on the colour scale of its index, from 0.0 at the low end to
+1.0 at the high end, with NaN outside the field and for colours that aren't on
+the scale (borders, labels). Positions are relative to the scale, since the
+images carry no legend with the index values at its ends.
+
+A pixel is decoded through a lookup table over 5-bit-per-channel colours, so a
+4k x 4k image costs a few array operations and no per-pixel Python.
+
+Usage:
+    python index_maps.py images/Trichy_Field_1/current_ndvi.png [--index NDVI]
+"""
+import argparse
+import functools
+import os
+
+# Colour scales, low to high, as the index images are rendered with
+COLOR_SCALES = {
+    "RdYlGn": ["#a50026", "#d73027", "#f46d43", "#fdae61", "#fee08b", "#ffffbf",
+               "#d9ef8b", "#a6d96a", "#66bd63", "#1a9850", "#006837"],
+    "PuOr": ["#7f3b08", "#b35806", "#e08214", "#fdb863", "#fee0b6", "#f7f7f7",
+             "#d8daeb", "#b2abd2", "#8073ac", "#542788", "#2d004b"],
+}
+
+# Colour scale of the images of every index
+INDEX_SCALES = {
+    "NDVI": "RdYlGn",
+    "NDMI": "PuOr",
+    "RECI": "RdYlGn",
+    "MSAVI": "RdYlGn",
+    "NDRE": "RdYlGn",
+}
+
+# Positions on a scale the lookup table is computed for
+SCALE_STEPS = 256
+
+# Bits per channel of the colours in the lookup table
+COLOR_BITS = 5
+
+# Largest RGB distance of a pixel from its scale for it to count as a value
+MAX_COLOR_DISTANCE = 48
+
+# Pixels at least this opaque are part of the field
+ALPHA_CUTOFF = 128
+
+
+def _scale_colors(scale):
+    """SCALE_STEPS colours evenly spaced along a scale, as a float32 array of shape (SCALE_STEPS, 3)"""
+    import numpy as np
+
+    stops = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in COLOR_SCALES[scale]],
+                     dtype=np.float32)
+    positions = np.linspace(0, len(stops) - 1, SCALE_STEPS)
+    return np.stack([np.interp(positions, np.arange(len(stops)), stops[:, channel]) for channel in range(3)],
+                    axis=1).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def lookup_table(scale):
+    """
+    Scale position of every quantized colour
+
+    Returns:
+        numpy.ndarray: float32 array of 2 ** (3 * COLOR_BITS) positions, indexed by
+            (r >> shift) << 2 * COLOR_BITS | (g >> shift) << COLOR_BITS | b >> shift,
+            NaN for the colours farther than MAX_COLOR_DISTANCE from the scale
+    """
+    import numpy as np
+
+    levels = 1 << COLOR_BITS
+    step = 256 // levels
+    centers = np.arange(levels, dtype=np.float32) * step + (step - 1) / 2
+    colors = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 3)
+    ramp = _scale_colors(scale)
+
+    # Squared distances of every colour to every scale step, as one matrix product
+    distances = ((colors ** 2).sum(axis=1)[:, None] - 2 * colors @ ramp.T + (ramp ** 2).sum(axis=1)[None, :])
+    nearest = distances.argmin(axis=1)
+    table = (nearest / (SCALE_STEPS - 1)).astype(np.float32)
+    table[distances[np.arange(len(colors)), nearest] > MAX_COLOR_DISTANCE ** 2] = np.nan
+    return table
+
+
+def color_keys(rgba):
+    """Lookup table keys of the pixels of an (height, width, 4) uint8 image"""
+    import numpy as np
+
+    shift = 8 - COLOR_BITS
+    keys = (rgba[..., 0] >> shift).astype(np.uint16) << (2 * COLOR_BITS)
+    keys |= (rgba[..., 1] >> shift).astype(np.uint16) << COLOR_BITS
+    keys |= rgba[..., 2] >> shift
+    return keys
+
+
+def load_rgba(data):
+    """Decode image bytes into an (height, width, 4) uint8 array, None if they aren't an image"""
+    import io
+
+    import numpy as np
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return np.asarray(image.convert("RGBA"))
+    except (OSError, UnidentifiedImageError, ValueError):
+        return None
+
+
+def decode_rgba(rgba, index):
+    """
+    Index values of an RGBA image
+
+    Args:
+        rgba (numpy.ndarray): (height, width, 4) uint8 image
+        index (str): Index the image shows, e.g. "NDVI"
+
+    Returns:
+        numpy.ndarray: float32 (height, width) scale positions in [0, 1], NaN outside the field
+    """
+    import numpy as np
+
+    values = lookup_table(INDEX_SCALES.get(index, "RdYlGn"))[color_keys(rgba)]
+    values[rgba[..., 3] < ALPHA_CUTOFF] = np.nan
+    return values
+
+
+def decode(data, index):
+    """Index values of image bytes, as decode_rgba; None if the bytes aren't an image"""
+    rgba = load_rgba(data)
+    return None if rgba is None else decode_rgba(rgba, index)
+
+
+def index_of(path):
+    """Index of an image file named like the workbook images, e.g. "old_ndvi.png" -> "NDVI", else None"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    index = stem.rsplit("_", 1)[-1].upper()
+    return index if index in INDEX_SCALES else None
+
+
+def main(argv=None):
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Decode index images into values and summarize them")
+    parser.add_argument("images", nargs="+", help="Index image files")
+    parser.add_argument("--index", choices=sorted(INDEX_SCALES),
+                        help="Index of the images (default: from the file names, e.g. current_ndvi.png)")
+    args = parser.parse_args(argv)
+
+    for path in args.images:
+        index = args.index or index_of(path) or "NDVI"
+        with open(path, "rb") as f:
+            values = decode(f.read(), index)
+        if values is None:
+            print(f"{path}: not an image")
+            continue
+        field = values[~np.isnan(values)]
+        if not field.size:
+            print(f"{path} ({index}): no pixels on the {INDEX_SCALES[index]} scale")
+            continue
+        low, median, high = np.percentile(field, [5, 50, 95])
+        print(f"{path} ({index}, {INDEX_SCALES[index]}): {field.size} field pixels, "
+              f"5% {low:.2f}  median {median:.2f}  95% {high:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Index pages: one renderer for every vegetation index page of the report
+
+Pages 2-6 show the same thing for a different index: the old and current index
+image with their dates and values, the advisory and the notes of the batch
+options. Every index page is described by an entry of the registry, INDEX_PAGES,
+and rendered by render_index_page from that entry:
+
+- page: the page name the report and the page command know it by, e.g. "page2"
+- index and title: e.g. "NDVI" and "Green Health Score"
+- template: the page template in templete/
+- the workbook columns of its images, values and advisory, by default
+  "<INDEX> Image date", "Old <INDEX> Image date", "<INDEX> value",
+  "Old <INDEX> value" and "<INDEX> ADVISORY"
+
+The registry also gives generate_report its page order and image columns, so
+all the images of a field are read in one pass over the workbook, whatever the
+number of indices.
+
+More indices (e.g. GNDVI or EVI) are added by configuration: every row of
+``index_pages.csv`` next to this file adds an index page, or replaces the entry
+of a built-in index. Empty cells take the defaults above; new indices are
+numbered from page 8 (page 7 is the management zones page) and use the generic
+``templete/index_page.html``:
+
+    index,title,page,template,image_column,old_image_column,value_column,old_value_column,advisory_column
+    GNDVI,Green Chlorophyll Index,,,,,,,
+
+Usage:
+    python index_pages.py --list
+    python index_pages.py NDVI [--field "Trichy Field 1"]
+"""
+import argparse
+import csv
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Optional table of extra or changed index pages
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_pages.csv")
+
+# Template of the index pages that don't have their own
+GENERIC_TEMPLATE = "index_page.html"
+
+# Number of the first configured index page; page 7 is the management zones page
+FIRST_EXTRA_PAGE = 8
+
+# Worksheet row of the first field, whose images a page rendered without field data shows
+FIRST_ROW = 2
+
+# Columns the image dates fall back to, in order, when the index's own is empty
+CURRENT_DATE_FALLBACKS = ["NDMI Image date", "Current  image"]
+OLD_DATE_FALLBACKS = ["Old Date"]
+
+IndexPage = namedtuple("IndexPage", ["page", "index", "title", "template", "image_column", "old_image_column",
+                                     "value_column", "old_value_column", "advisory_column"])
+
+
+def index_page(index, title, page, template=None, image_column=None, old_image_column=None, value_column=None,
+               old_value_column=None, advisory_column=None):
+    """An IndexPage, with the conventional template and column names for the ones not given"""
+    return IndexPage(
+        page=page,
+        index=index,
+        title=title,
+        template=template or GENERIC_TEMPLATE,
+        image_column=image_column or f"{index} Image date",
+        old_image_column=old_image_column or f"Old {index} Image date",
+        value_column=value_column or f"{index} value",
+        old_value_column=old_value_column or f"Old {index} value",
+        advisory_column=advisory_column or f"{index} ADVISORY",
+    )
+
+
+# The five index pages of the report, in page order
+BUILTIN_PAGES = [
+    index_page("NDVI", "Green Health Score", "page2", "page2.html"),
+    index_page("NDMI", "Moisture Level Indicator", "page3", "page3.html"),
+    index_page("RECI", "Leaf Freshness Index", "page4", "page4.html"),
+    index_page("MSAVI", "Growth Strength Index", "page5", "page5.html"),
+    index_page("NDRE", "Early Stress Checker", "page6", "page6.html"),
+]
+
+
+def load_registry(path=REGISTRY_FILE):
+    """
+    The built-in index pages, with the rows of a registry table added or replacing them
+
+    Args:
+        path (str): CSV file with the columns of IndexPage; read if it exists
+
+    Returns:
+        list: IndexPage of every index page, in page order
+
+    Raises:
+        ValueError: If a row has no index or title, or its page isn't named "page<N>"
+    """
+    pages = list(BUILTIN_PAGES)
+    if not os.path.exists(path):
+        return pages
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, record in enumerate(csv.DictReader(f), start=2):
+            values = {name: (record.get(name) or "").strip() or None for name in IndexPage._fields}
+            if not values["index"] or not values["title"]:
+                raise ValueError(f"{path} line {line}: an index page needs an index and a title")
+            values["index"] = values["index"].upper()
+            existing = next((number for number, entry in enumerate(pages) if entry.index == values["index"]), None)
+            if values["page"] is None:
+                if existing is not None:
+                    values["page"] = pages[existing].page
+                else:
+                    values["page"] = f"page{max([FIRST_EXTRA_PAGE - 1] + [page_number(e.page) for e in pages]) + 1}"
+            elif not re.fullmatch(r"page\d+", values["page"]):
+                raise ValueError(f"{path} line {line}: page must be named page<N>, got {values['page']!r}")
+            if existing is not None and values["template"] is None:
+                values["template"] = pages[existing].template
+            entry = index_page(**values)
+            if existing is not None:
+                pages[existing] = entry
+            else:
+                pages.append(entry)
+    return sorted(pages, key=lambda entry: page_number(entry.page))
+
+
+def page_number(page):
+    """Number of a page name, e.g. "page4" -> 4"""
+    return int(page[len("page"):])
+
+
+def _registry():
+    try:
+        return load_registry()
+    except (OSError, ValueError) as e:
+        # A broken table mustn't stop every report; the built-in pages still render
+        logger.error("Error reading index pages: %s", e)
+        return list(BUILTIN_PAGES)
+
+
+# Every index page, in page order
+INDEX_PAGES = _registry()
+
+
+def find(name):
+    """IndexPage of a page name ("page4") or index ("RECI", case-insensitive), None if there is none"""
+    return next((entry for entry in INDEX_PAGES if name in (entry.page, entry.index) or name.upper() == entry.index),
+                None)
+
+
+def image_columns():
+    """Header of every index image column mapped to the file name the image is saved as"""
+    import imagery
+
+    columns = {}
+    for entry in INDEX_PAGES:
+        columns[entry.image_column] = imagery.image_file(entry.index, "current")
+        columns[entry.old_image_column] = imagery.image_file(entry.index, "old")
+    return columns
+
+
+def extract_images(excel_file, output_dir="images"):
+    """
+    Save the index images of the first field of the workbook, every index in one pass
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        output_dir (str): Directory to save the images in
+
+    Returns:
+        dict: Image file name mapped to the saved path, for the images the field has
+    """
+    from PIL import Image
+    import io
+
+    import field_index
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    try:
+        images = field_index.FieldIndex(excel_file).read_images([FIRST_ROW], image_columns())
+        for (_, image_file), data in images.items():
+            path = os.path.join(output_dir, image_file)
+            Image.open(io.BytesIO(data)).save(path)
+            logger.debug("Saved %s to %s", image_file, path)
+            paths[image_file] = path
+    except Exception as e:
+        logger.warning("Error extracting images: %s", e)
+    return paths
+
+
+def _cell(df, column, what):
+    """A cell of the first row as text, "N/A" when the column is missing"""
+    try:
+        return str(df[column].iloc[0])
+    except Exception as e:
+        logger.warning("Error getting %s: %s", what, e)
+        return "N/A"
+
+
+def _date(df, columns, what):
+    """The first non-empty date of the columns, as dd/mm/yyyy, "N/A" when there is none"""
+    import pandas as pd
+
+    try:
+        date = None
+        for column in columns:
+            if column in df.columns and not pd.isna(df[column].iloc[0]):
+                date = df[column].iloc[0]
+                break
+            logger.debug("%s is empty", column)
+        if isinstance(date, str):
+            date = date.strip()  # Remove any whitespace or newlines
+        return pd.to_datetime(date).strftime('%d/%m/%Y')
+    except Exception as e:
+        logger.warning("Error processing %s date: %s", what, e)
+        return "N/A"
+
+
+def read_template(entry, template_file=None):
+    """
+    HTML template of an index page, with the generic template filled in for its index
+
+    Args:
+        entry (IndexPage): The page
+        template_file (str): Template to use instead of the entry's one in templete/
+    """
+    with open(template_file or os.path.join("templete", entry.template), 'r', encoding='utf-8') as f:
+        html_content = f.read()
+    if entry.template == GENERIC_TEMPLATE and template_file is None:
+        # The index first: the titles may have "INDEX" in them
+        html_content = html_content.replace('INDEX', entry.index)
+        html_content = html_content.replace('PAGE NUMBER', str(page_number(entry.page)))
+        html_content = html_content.replace('PAGE HEADING', f'{entry.title.upper()} ({entry.index})')
+        html_content = html_content.replace('PAGE LABEL', f'{entry.title} ({entry.index})')
+    return html_content
+
+
+def _has_columns(df, prefix):
+    """True if the field's row has any column starting with prefix, i.e. the batch option adding them ran"""
+    return any(str(column).startswith(prefix) for column in df.columns)
+
+
+def render_index_page(entry, html_content, output_file, current_image, old_image, df):
+    """
+    Render an index page for one field
+
+    Args:
+        entry (IndexPage): The page
+        html_content (str): Its template, as read_template gives it
+        output_file (str): Path the page is written to
+        current_image (str): Path of the current index image, relative to the report
+        old_image (str): Path of the old index image
+        df (pandas.DataFrame): Single row dataframe for the field
+
+    Returns:
+        str: The page HTML
+    """
+    index = entry.index
+    old_value = _cell(df, entry.old_value_column, entry.old_value_column)
+    current_value = _cell(df, entry.value_column, entry.value_column)
+    advisory = _cell(df, entry.advisory_column, entry.advisory_column)
+    old_image_date = _date(df, [entry.old_image_column] + OLD_DATE_FALLBACKS, "old")
+    new_image_date = _date(df, [entry.image_column] + CURRENT_DATE_FALLBACKS, "current")
+    logger.debug("%s dates from Excel: old %s, new %s", index, old_image_date, new_image_date)
+
+    # Replace the date placeholders in the HTML
+    html_content = html_content.replace('IMAGE DATE1', old_image_date)
+    html_content = html_content.replace('IMAGE DATE2', new_image_date)
+
+    # The old image goes in the first box and the current one in the second, with the
+    # overlays of the batch options (--contours, --hotspots) laid over them; the modules
+    # drawing them are only imported when the row has their columns
+    for slot, alt, path in (('old', f'Old {index}', old_image), ('current', f'Current {index}', current_image)):
+        image_tag = f'<img alt="{alt}" class="w-[220px] h-[220px] object-cover" height="220" src="{path}" width="220"/>'
+        if _has_columns(df, f"Contours {index} "):
+            import contours
+            image_tag = contours.overlay_image(df, index, slot, image_tag)
+        if _has_columns(df, f"Hotspots {index} "):
+            import hotspots
+            image_tag = hotspots.outline_image(df, index, slot, image_tag)
+        html_content = html_content.replace(
+            f'<img alt="{alt}" class="w-[220px] h-[220px] object-cover" height="220" src=" " width="220"/>',
+            image_tag
+        )
+
+    # Fix farmland.png path (ensure it uses the correct relative path)
+    html_content = html_content.replace(
+        'src="/assest/farmland.png"',
+        'src="../assest/farmland.png"'
+    )
+
+    # Values and advisory; the old value first, as "<INDEX> VALUE" is part of it
+    html_content = html_content.replace(f'OLD {index} VALUE', old_value)
+    html_content = html_content.replace(f'{index} VALUE', current_value)
+    html_content = html_content.replace(f'{index} ADVISORY', advisory)
+
+    # "No new imagery" or reused images, when the batch hashed them (--stale-imagery)
+    note = ""
+    if _has_columns(df, f"Imagery {index} "):
+        import imagery
+        note = imagery.page_note(df, index)
+    html_content = html_content.replace(f'{index} IMAGERY', note)
+
+    # Where the field's stress is concentrated, when the batch looked for hotspots (--hotspots)
+    note = ""
+    if _has_columns(df, f"Hotspots {index} "):
+        import hotspots
+        note = hotspots.page_note(df, index)
+    html_content = html_content.replace(f'{index} HOTSPOTS', note)
+
+    # Percentile among fields of the same crop and stage, when the batch ranked them (--cohorts)
+    note = ""
+    if _has_columns(df, f"Cohort {index} "):
+        import cohort
+        note = cohort.page_note(df, index)
+    html_content = html_content.replace(f'{index} COHORT', note)
+
+    # Remove any remaining "Value: ... (Change: ...)" text if it exists
+    value_change_pattern = r'<p class="mt-2">\s*Value:[^<]*<span class="font-bold">\s*[^<]*</span>\s*<span>\s*\(Change:\s*</span>\s*<span class="font-bold">\s*[^<]*</span>\s*<span>\s*\)\s*</span>\s*</p>'
+    html_content = re.sub(value_change_pattern, '', html_content)
+
+    # Save the generated HTML
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+    logger.debug("%s page generated successfully: %s", index, output_file)
+    return html_content
+
+
+def generate_index_page(name, excel_file, template_file, output_file, current_image=None, old_image=None,
+                        field_data=None):
+    """
+    Generate an index page, as the page<N>.generate_page<N> functions do
+
+    Without images, the images of the first field are extracted to images/ (all
+    indices in one pass); without field data, the first field's row is read.
+
+    Args:
+        name (str): Page name or index, e.g. "page4" or "RECI"
+        excel_file (str): Path to the Excel file with crop data
+        template_file (str): Path to the page template, None for the entry's one
+        output_file (str): Path the page is written to
+        current_image (str): Path of the current index image
+        old_image (str): Path of the old index image
+        field_data (pandas.DataFrame): Single row dataframe for the field
+
+    Returns:
+        str: The page HTML
+    """
+    entry = find(name)
+    if entry is None:
+        raise ValueError(f"Unknown index page {name!r}")
+
+    if current_image is None or old_image is None:
+        import imagery
+        extract_images(excel_file)
+        current_image = os.path.join("images", imagery.image_file(entry.index, "current"))
+        old_image = os.path.join("images", imagery.image_file(entry.index, "old"))
+    else:
+        logger.debug("Using provided image paths: %s, %s", current_image, old_image)
+
+    if field_data is None:
+        import field_index
+        field_data = field_index.FieldIndex(excel_file).read_rows([FIRST_ROW])
+
+    return render_index_page(entry, read_template(entry, template_file), output_file, current_image, old_image,
+                             field_data)
+
+
+def main(argv=None):
+    import field_index
+    import logs
+
+    parser = argparse.ArgumentParser(description="Generate an index report page")
+    parser.add_argument("page", nargs="?", help="Page name or index, e.g. page4 or RECI")
+    parser.add_argument("--list", action="store_true", help="List the index pages and their columns")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output-file", default=None, help="Output HTML file (default: output_<page>.html)")
+    field_index.add_field_argument(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    if args.list or not args.page:
+        for entry in INDEX_PAGES:
+            print(f"{entry.page:<7} {entry.index:<6} {entry.title:<26} {entry.template:<16} "
+                  f"{entry.image_column} / {entry.old_image_column}")
+        return
+    entry = find(args.page)
+    if entry is None:
+        parser.error(f"unknown index page {args.page!r}; see --list")
+
+    if args.field:
+        # Only the matching rows and their images are read, one output file per field
+        import generate_report
+        generate_report.generate_page_for_fields(page_number(entry.page), args.excel, args.field)
+    else:
+        generate_index_page(entry.page, args.excel, None, args.output_file or f"output_{entry.page}.html")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Per-field crash isolation for batch runs
+
+A corrupt or gigantic embedded image can hang Pillow or exhaust memory while a
+field is rendered, taking the whole batch down with it. With isolation every
+field is rendered in its own worker process with a wall-clock timeout and a
+memory limit (RLIMIT_AS, where the platform supports it). A field that times
+out, runs out of memory, crashes or raises is recorded and the batch moves on.
+
+Failed fields are retried after the rest of the batch, in rounds separated by
+an exponential backoff, and whatever still fails is written to
+``<output>/failures.json`` (``failures-shard-I-of-N.json`` for a shard):
+
+    {"workbook": "demo.xlsx", "fields": 2, "failed": 1, "failures": [
+        {"field": "Trichy Field 1", "name": "Trichy_Field_1", "reason": "timeout",
+         "error": "No result after 300s", "attempts": 3, "seconds": 300.2, "exit_code": -9}]}
+
+reason is one of timeout, memory, crash (the worker died without reporting,
+e.g. on a signal) or error (an exception in the worker).
+"""
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from multiprocessing.connection import wait
+
+import generate_report
+
+logger = logging.getLogger(__name__)
+
+# Name of the failure report written to the output directory
+FAILURE_REPORT = "failures.json"
+
+# A field to render: sanitized name, worksheet row data and raw image bytes
+FieldTask = namedtuple("FieldTask", ["name", "row", "images"])
+
+
+def add_arguments(parser, default=None):
+    """
+    Add the isolation options to an argparse parser
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to add the options to
+        default: Default for every option; argparse.SUPPRESS keeps values given before a subcommand
+    """
+    def option_default(value):
+        return value if default is None else default
+
+    group = parser.add_argument_group("isolation")
+    group.add_argument("--isolate", action="store_true", default=option_default(False),
+                       help="Render every field in its own worker process with a timeout and memory limit")
+    group.add_argument("--timeout", type=float, default=option_default(300.0),
+                       help="Seconds a field may take before its worker is killed (default: 300)")
+    group.add_argument("--memory-mb", type=int, default=option_default(4096),
+                       help="Address space limit of each worker in MB, 0 for none (default: 4096)")
+    group.add_argument("--retries", type=int, default=option_default(2),
+                       help="Retry rounds for failed fields (default: 2)")
+    group.add_argument("--backoff", type=float, default=option_default(5.0),
+                       help="Seconds before the first retry round, doubled every round (default: 5)")
+    group.add_argument("--jobs", type=int, default=option_default(1),
+                       help="Fields rendered at the same time (default: 1)")
+
+
+def options_from_args(args):
+    """Return the run_isolated options selected on the command line, or None without --isolate"""
+    if not args.isolate:
+        return None
+    return {
+        "timeout": args.timeout,
+        "memory_mb": args.memory_mb or None,
+        "retries": args.retries,
+        "backoff": args.backoff,
+        "jobs": args.jobs,
+    }
+
+
+def _limit_memory(memory_mb):
+    try:
+        import resource
+    except ImportError:
+        # No rlimits on this platform; the timeout still applies
+        return
+    limit = memory_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _render_field(connection, excel_file, output_directory, task, memory_mb, precompress=False, assets=None):
+    """Worker process: render one field and report the outcome on the pipe"""
+    if memory_mb:
+        _limit_memory(memory_mb)
+    try:
+        output_path = generate_report.generate_field_report(
+            excel_file, task.row, task.name, output_directory, task.images, precompress, assets)
+        connection.send(("ok", output_path))
+    except MemoryError:
+        connection.send(("memory", f"Out of memory (limit {memory_mb} MB)"))
+    except BaseException as e:
+        connection.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+def _context():
+    # fork lets workers reuse the parent's imports; fall back to the default elsewhere
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def run_round(excel_file, output_directory, tasks, timeout, memory_mb=None, jobs=1, on_success=None,
+              precompress=False, assets=None, on_outcome=None):
+    """
+    Render each task in its own worker process, at most jobs at a time
+
+    on_success(task, output path) is called as soon as a field's report is written,
+    and on_outcome(task, outcome) as soon as any attempt finishes.
+
+    Returns:
+        dict: Field name mapped to its outcome: status, error, seconds and exit_code
+    """
+    context = _context()
+    pending = deque(tasks)
+    running = {}
+    outcomes = {}
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            task = pending.popleft()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_render_field,
+                                      args=(sender, excel_file, output_directory, task, memory_mb, precompress, assets),
+                                      name=f"field-{task.name}", daemon=True)
+            started = time.monotonic()
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, receiver, task, started)
+
+        deadline = min(started + timeout for _, _, _, started in running.values())
+        finished = wait(list(running), timeout=max(0.0, deadline - time.monotonic()))
+
+        now = time.monotonic()
+        for sentinel in list(running):
+            process, receiver, task, started = running[sentinel]
+            if sentinel in finished:
+                process.join()
+                try:
+                    # poll() is also true when the worker died and closed the pipe
+                    message = receiver.recv() if receiver.poll() else None
+                except EOFError:
+                    message = None
+                if message is not None:
+                    status, detail = message
+                elif process.exitcode is not None and process.exitcode < 0:
+                    status, detail = "crash", f"Worker killed by signal {-process.exitcode}"
+                else:
+                    status, detail = "crash", f"Worker exited with code {process.exitcode} without a result"
+            elif now - started >= timeout:
+                process.kill()
+                process.join()
+                status, detail = "timeout", f"No result after {timeout:g}s"
+            else:
+                continue
+
+            receiver.close()
+            del running[sentinel]
+            outcomes[task.name] = {
+                "status": status,
+                "error": None if status == "ok" else detail,
+                "seconds": round(now - started, 3),
+                "exit_code": process.exitcode,
+            }
+            if on_outcome is not None:
+                on_outcome(task, outcomes[task.name])
+            if status == "ok":
+                logger.info("Full report generated successfully: %s", detail)
+                if on_success is not None:
+                    on_success(task, detail)
+            else:
+                logger.error("Error generating report for %s (%s): %s", task.name, status, detail)
+    return outcomes
+
+
+def run_isolated(excel_file, output_directory, tasks, timeout=300.0, memory_mb=4096, retries=2, backoff=5.0,
+                 jobs=1, report_name=FAILURE_REPORT, on_success=None, precompress=False,
+                 assets=None, on_outcome=None):
+    """
+    Render every field in an isolated worker, retrying failures, and write the failure report
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        output_directory (str): Directory where the reports will be saved
+        tasks (list): FieldTask for every field to render
+        timeout (float): Seconds a field may take before its worker is killed
+        memory_mb (int): Address space limit of each worker in MB, None for none
+        retries (int): Retry rounds for fields that failed
+        backoff (float): Seconds before the first retry round, doubled every round
+        jobs (int): Fields rendered at the same time
+        report_name (str): File name of the failure report in the output directory
+        on_success (callable): Called with (task, report path) as soon as a field's report is written
+        precompress (bool): Workers minify their report and write .html.gz and .html.br siblings
+        assets (dict): Manifest of the hashed static assets the reports link, None to inline them
+        on_outcome (callable): Called with (task, outcome) when any attempt finishes, failed or not
+
+    Returns:
+        dict: Field name mapped to the outcome of its last attempt, with its number of attempts
+    """
+    import journal
+
+    outcomes = {}
+    attempts = {task.name: 0 for task in tasks}
+    remaining = list(tasks)
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning("Retrying %s failed fields in %gs (round %s of %s)", len(remaining), delay, attempt, retries)
+            time.sleep(delay)
+        for task in remaining:
+            attempts[task.name] += 1
+        outcomes.update(run_round(excel_file, output_directory, remaining, timeout, memory_mb, jobs, on_success,
+                                  precompress, assets, on_outcome))
+        remaining = [task for task in remaining if outcomes[task.name]["status"] != "ok"]
+        if not remaining:
+            break
+
+    failures = []
+    for task in remaining:
+        outcome = outcomes[task.name]
+        failures.append({
+            "field": str(task.row["Field"]) if "Field" in task.row else task.name,
+            "name": task.name,
+            "reason": outcome["status"],
+            "error": outcome["error"],
+            "attempts": attempts[task.name],
+            "seconds": outcome["seconds"],
+            "exit_code": outcome["exit_code"],
+        })
+    report = {
+        "workbook": os.path.basename(excel_file),
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "fields": len(tasks),
+        "failed": len(failures),
+        "failures": failures,
+    }
+    path = os.path.join(output_directory, report_name)
+    journal.write_json_atomic(path, report)
+    logger.info("%s of %s fields generated, failure report written: %s", len(tasks) - len(failures), len(tasks), path)
+
+    for name, outcome in outcomes.items():
+        outcome["attempts"] = attempts[name]
+    return outcomes
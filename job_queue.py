@@ -0,0 +1,498 @@
+"""
+Durable local job queue for regenerating individual fields
+
+Regeneration requests (a new workbook ingest, an agronomist asking for a
+field again) are enqueued as (field, pages) jobs in a SQLite database, and
+worker processes claim them, render the requested pages and acknowledge them.
+SQLite stands in for a real broker: the queue survives restarts and can be
+shared by several workers on one machine.
+
+Jobs for the same field are coalesced: while a field has a job waiting, new
+requests for it only add their pages to that job, so a burst of updates
+produces one render. A job that fails is retried with exponential backoff
+until it runs out of attempts, and a job whose worker died is handed out again
+once its lease expires.
+
+Each worker keeps the rendered pages of a field in
+``<output>/pages/<field>/`` and rebuilds ``full_report_<field>.html`` from
+them, so a job for one page only re-renders that page.
+
+Usage:
+    python job_queue.py enqueue "Trichy Field 1" --pages 2,3
+    python job_queue.py enqueue --all --excel demo.xlsx
+    python job_queue.py work --workers 4 [--once]
+    python job_queue.py status
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+
+import generate_report
+import logs
+import workbooks
+from journal import write_text_atomic
+
+logger = logging.getLogger(__name__)
+
+# Default location of the queue database
+DEFAULT_QUEUE = "jobs.db"
+
+ALL_PAGES = [int(name[len("page"):]) for name in generate_report.PAGE_NAMES]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    field TEXT NOT NULL,
+    pages TEXT NOT NULL,
+    excel TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    requests INTEGER NOT NULL DEFAULT 1,
+    sources TEXT NOT NULL DEFAULT '[]',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_expires REAL,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- At most one waiting job per field; new requests are merged into it
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_waiting_field ON jobs(field) WHERE state = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(state, available_at);
+"""
+
+# A claimed job handed to a worker
+Job = namedtuple("Job", ["id", "field", "pages", "excel", "attempts"])
+
+
+def parse_pages(value):
+    """
+    Parse a page list such as "2,3" or "all"
+
+    Returns:
+        list: Sorted page numbers
+    """
+    if value in (None, "", "all"):
+        return list(ALL_PAGES)
+    try:
+        pages = sorted({int(part) for part in value.split(",")})
+    except ValueError:
+        raise ValueError(f"Invalid page list '{value}', expected numbers such as 2,3 or 'all'")
+    if not pages or not set(pages) <= set(ALL_PAGES):
+        raise ValueError(f"Invalid page list '{value}', the pages are {', '.join(map(str, ALL_PAGES))}")
+    return pages
+
+
+def format_pages(pages):
+    return ",".join(str(page) for page in sorted(set(pages)))
+
+
+class JobQueue:
+    """
+    SQLite backed queue of (field, pages) render jobs
+
+    Every method runs in its own transaction, so any number of processes can
+    enqueue and claim jobs on the same database.
+
+    Args:
+        path (str): Path of the queue database, created if missing
+        lease_seconds (float): How long a claimed job may run before it is handed out again
+        max_attempts (int): Attempts before a failing job is marked failed, for jobs enqueued here
+        retry_delay (float): Backoff before the first retry, doubled for every further attempt
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE, lease_seconds=600.0, max_attempts=3, retry_delay=30.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self):
+        """Start a write transaction, taking the database write lock up front"""
+        return _Transaction(self.connection)
+
+    def enqueue(self, field, pages=None, excel_file="demo.xlsx", source=None):
+        """
+        Request a render of some pages of a field
+
+        If the field already has a waiting job the pages are merged into it and
+        the job is made to use the latest workbook; otherwise a new job is added.
+
+        Args:
+            field (str): Field name as it appears in the workbook
+            pages (list): Page numbers to render, all pages by default
+            excel_file (str): Workbook to render the field from
+            source (str): Who asked for the render, kept for auditing
+
+        Returns:
+            tuple: (job id, True if the request was merged into a waiting job)
+        """
+        pages = list(ALL_PAGES) if pages is None else pages
+        excel_file = os.path.abspath(excel_file)
+        now = time.time()
+        with self._transaction() as db:
+            waiting = db.execute("SELECT * FROM jobs WHERE field = ? AND state = 'queued'", (field,)).fetchone()
+            if waiting is None:
+                cursor = db.execute(
+                    "INSERT INTO jobs (field, pages, excel, sources, max_attempts, available_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (field, format_pages(pages), excel_file, json.dumps([source] if source else []),
+                     self.max_attempts, now, now, now))
+                return cursor.lastrowid, False
+            self._merge(db, waiting, pages, excel_file, [source] if source else [], now)
+            return waiting["id"], True
+
+    def enqueue_many(self, fields, pages=None, excel_file="demo.xlsx", source=None):
+        """Enqueue several fields, returning (number of new jobs, number merged into waiting jobs)"""
+        added = merged = 0
+        for field in fields:
+            _, was_merged = self.enqueue(field, pages, excel_file, source)
+            merged += was_merged
+            added += not was_merged
+        return added, merged
+
+    def _merge(self, db, waiting, pages, excel_file, sources, now, requests=1):
+        """Fold a request into a waiting job of the same field"""
+        merged_pages = parse_pages(waiting["pages"]) + list(pages)
+        merged_sources = json.loads(waiting["sources"])
+        merged_sources += [source for source in sources if source not in merged_sources]
+        db.execute("UPDATE jobs SET pages = ?, excel = ?, sources = ?, requests = requests + ?, updated_at = ? "
+                   "WHERE id = ?",
+                   (format_pages(merged_pages), excel_file, json.dumps(merged_sources), requests, now,
+                    waiting["id"]))
+
+    def _requeue(self, db, job, available_at, error, now):
+        """
+        Put a claimed job back in the queue
+
+        If a newer request for the same field is already waiting, the job's pages
+        are merged into it and the claimed job is closed as superseded.
+        """
+        waiting = db.execute("SELECT * FROM jobs WHERE field = ? AND state = 'queued'", (job["field"],)).fetchone()
+        if waiting is None:
+            db.execute("UPDATE jobs SET state = 'queued', available_at = ?, lease_expires = NULL, worker = NULL, "
+                       "error = ?, updated_at = ? WHERE id = ?", (available_at, error, now, job["id"]))
+            return
+        self._merge(db, waiting, parse_pages(job["pages"]), waiting["excel"], json.loads(job["sources"]), now,
+                    requests=job["requests"])
+        db.execute("UPDATE jobs SET state = 'superseded', lease_expires = NULL, error = ?, updated_at = ? "
+                   "WHERE id = ?", (error, now, job["id"]))
+
+    def _recover_expired(self, db, now):
+        """Requeue jobs whose worker stopped renewing its lease, counting it as a failed attempt"""
+        expired = db.execute("SELECT * FROM jobs WHERE state = 'running' AND lease_expires < ?", (now,)).fetchall()
+        for job in expired:
+            error = f"Lease expired on worker {job['worker']}"
+            if job["attempts"] >= job["max_attempts"]:
+                db.execute("UPDATE jobs SET state = 'failed', lease_expires = NULL, error = ?, updated_at = ? "
+                           "WHERE id = ?", (error, now, job["id"]))
+            else:
+                self._requeue(db, job, now, error, now)
+
+    def claim(self, worker):
+        """
+        Claim the oldest job that is ready to run
+
+        Args:
+            worker (str): Name of the claiming worker, recorded on the job
+
+        Returns:
+            Job: The claimed job, or None if no job is ready
+        """
+        now = time.time()
+        with self._transaction() as db:
+            self._recover_expired(db, now)
+            job = db.execute("SELECT * FROM jobs WHERE state = 'queued' AND available_at <= ? "
+                             "ORDER BY available_at, id LIMIT 1", (now,)).fetchone()
+            if job is None:
+                return None
+            db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, lease_expires = ?, "
+                       "updated_at = ? WHERE id = ?", (worker, now + self.lease_seconds, now, job["id"]))
+            return Job(job["id"], job["field"], parse_pages(job["pages"]), job["excel"], job["attempts"] + 1)
+
+    def ack(self, job_id):
+        """Mark a claimed job as done"""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = 'done', lease_expires = NULL, error = NULL, updated_at = ? "
+                       "WHERE id = ? AND state = 'running'", (now, job_id))
+
+    def fail(self, job_id, error):
+        """
+        Record a failed attempt of a claimed job
+
+        The job is retried after retry_delay * 2 ** (attempts - 1) seconds, or
+        marked failed once it has used all its attempts.
+
+        Returns:
+            bool: True if the job will be retried
+        """
+        now = time.time()
+        with self._transaction() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ? AND state = 'running'", (job_id,)).fetchone()
+            if job is None:
+                return False
+            if job["attempts"] >= job["max_attempts"]:
+                db.execute("UPDATE jobs SET state = 'failed', lease_expires = NULL, error = ?, updated_at = ? "
+                           "WHERE id = ?", (error, now, job_id))
+                return False
+            delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+            self._requeue(db, job, now + delay, error, now)
+            return True
+
+    def retry_failed(self):
+        """Give every failed job a fresh set of attempts, returning how many were requeued"""
+        now = time.time()
+        count = 0
+        with self._transaction() as db:
+            for job in db.execute("SELECT * FROM jobs WHERE state = 'failed'").fetchall():
+                db.execute("UPDATE jobs SET attempts = 0 WHERE id = ?", (job["id"],))
+                self._requeue(db, dict(job, attempts=0), now, job["error"], now)
+                count += 1
+        return count
+
+    def counts(self):
+        """Return the number of jobs in each state"""
+        rows = self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def failures(self):
+        """Return (field, attempts, error) for every failed job"""
+        return [tuple(row) for row in self.connection.execute(
+            "SELECT field, attempts, error FROM jobs WHERE state = 'failed' ORDER BY updated_at")]
+
+
+class _Transaction:
+    """Context manager wrapping BEGIN IMMEDIATE ... COMMIT/ROLLBACK"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def render_job(excel_file, field, pages, output_directory="reports"):
+    """
+    Render the requested pages of one field and rebuild its full report
+
+    Rendered pages are kept in <output>/pages/<field>/; pages the job didn't ask
+    for are reused from there, and rendered too if they don't exist yet.
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        field (str): Field name as it appears in the workbook
+        pages (list): Page numbers to render
+        output_directory (str): Directory where the reports are saved
+
+    Returns:
+        str: Path of the full report
+    """
+    import pandas as pd
+
+    # Escape the name so fields containing glob characters only match themselves
+    df, field_images = generate_report.read_selected_fields(excel_file, [glob.escape(field)])
+    if df is None:
+        raise LookupError(f"Field {field} is not in {excel_file}")
+    row = df.iloc[0]
+    field_name = generate_report.sanitize_field_name(row, 0)
+
+    pages_dir = os.path.join(output_directory, "pages", field_name)
+    os.makedirs(pages_dir, exist_ok=True)
+    page_files = {name: os.path.join(pages_dir, f"{name}.html") for name in generate_report.PAGE_NAMES}
+    wanted = {f"page{number}" for number in pages}
+    render = [name for name in generate_report.PAGE_NAMES
+              if name in wanted or not os.path.exists(page_files[name])]
+
+    field_images_dir = os.path.join("images", field_name)
+    os.makedirs(field_images_dir, exist_ok=True)
+    if any(name != "page1" for name in render):
+        generate_report.save_field_images(field_images[0], field_images_dir, field_name)
+
+    with tempfile.TemporaryDirectory(prefix="sidra_pages_") as temp_dir:
+        temp_files = {name: os.path.join(temp_dir, f"temp_{name}.html") for name in render}
+        page_contents = generate_report.render_field_pages(
+            excel_file, pd.DataFrame([row]), field_images_dir, temp_files, pages=render)
+    for name, html in page_contents.items():
+        write_text_atomic(page_files[name], html)
+
+    # Combine in page order, reusing the pages this job didn't render
+    all_contents = {}
+    for name in generate_report.PAGE_NAMES:
+        if name in page_contents:
+            all_contents[name] = page_contents[name]
+        else:
+            with open(page_files[name], 'r', encoding='utf-8') as f:
+                all_contents[name] = f.read()
+    combined_html = generate_report.combine_page_contents(all_contents, field_name)
+
+    output_path = os.path.join(output_directory, f"full_report_{field_name}.html")
+    write_text_atomic(output_path, combined_html)
+    return output_path
+
+
+def run_worker(queue_path=DEFAULT_QUEUE, output_directory="reports", worker=None, poll_interval=1.0,
+               once=False, **queue_options):
+    """
+    Claim and render jobs until stopped
+
+    Args:
+        queue_path (str): Path of the queue database
+        output_directory (str): Directory where the reports are saved
+        worker (str): Worker name recorded on claimed jobs, host:pid by default
+        poll_interval (float): Seconds to wait when no job is ready
+        once (bool): Exit once no job is ready instead of waiting for more
+        **queue_options: Lease and retry options passed to JobQueue
+
+    Returns:
+        tuple: (jobs done, jobs failed)
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(queue_path, **queue_options)
+    done = failed = 0
+    try:
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                if once:
+                    return done, failed
+                time.sleep(poll_interval)
+                continue
+
+            logger.info("===== [%s] Job %s: %s pages %s (attempt %s) =====",
+                        worker, job.id, job.field, format_pages(job.pages), job.attempts)
+            try:
+                output_path = render_job(job.excel, job.field, job.pages, output_directory)
+                queue.ack(job.id)
+                done += 1
+                logger.info("Full report generated successfully: %s", output_path)
+            except Exception as e:
+                failed += 1
+                retried = queue.fail(job.id, f"{type(e).__name__}: {e}")
+                logger.error("Error rendering %s: %s (%s)", job.field, e, 'will retry' if retried else 'giving up')
+    finally:
+        queue.close()
+
+
+def _worker_main(queue_path, output_directory, poll_interval, once, queue_options):
+    run_worker(queue_path, output_directory, poll_interval=poll_interval, once=once, **queue_options)
+
+
+def run_workers(count, queue_path=DEFAULT_QUEUE, output_directory="reports", poll_interval=1.0, once=False,
+                **queue_options):
+    """Run several worker processes against the same queue and wait for them"""
+    import multiprocessing
+
+    if count <= 1:
+        return run_worker(queue_path, output_directory, poll_interval=poll_interval, once=once, **queue_options)
+    processes = [multiprocessing.Process(target=_worker_main,
+                                         args=(queue_path, output_directory, poll_interval, once, queue_options))
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+def add_arguments(parser):
+    """Add the queue commands (enqueue, work, status, retry) to an argparse parser"""
+    parser.add_argument("--queue", default=DEFAULT_QUEUE, help=f"Queue database (default: {DEFAULT_QUEUE})")
+    commands = parser.add_subparsers(dest="queue_command", metavar="queue_command")
+    commands.required = True
+
+    enqueue_parser = commands.add_parser("enqueue", help="Request renders of fields")
+    enqueue_parser.add_argument("fields", nargs="*", metavar="FIELD",
+                                help="Field names as they appear in the workbook; glob patterns allowed")
+    generate_report.field_index.add_field_argument(enqueue_parser, default=argparse.SUPPRESS)
+    enqueue_parser.add_argument("--all", action="store_true", help="Enqueue every field of the workbook")
+    enqueue_parser.add_argument("--pages", default="all", help="Pages to render, e.g. 2,3 (default: all)")
+    enqueue_parser.add_argument("--source", default=None, help="Who requested the render, kept on the job")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=3, help="Attempts before a job is marked failed")
+
+    work_parser = commands.add_parser("work", help="Run workers that render queued jobs")
+    work_parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1)")
+    work_parser.add_argument("--once", action="store_true", help="Exit when no job is ready")
+    work_parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    work_parser.add_argument("--lease", type=float, default=600.0, help="Seconds before a running job is handed out again")
+    work_parser.add_argument("--retry-delay", type=float, default=30.0, help="Seconds before the first retry, doubled per attempt")
+
+    commands.add_parser("status", help="Show job counts and failed jobs")
+    commands.add_parser("retry", help="Requeue every failed job")
+
+
+def run_from_args(args):
+    """Run a queue command parsed by a parser set up with add_arguments"""
+    if args.queue_command == "work":
+        return run_workers(args.workers, args.queue, args.output, poll_interval=args.poll_interval, once=args.once,
+                           lease_seconds=args.lease, retry_delay=args.retry_delay)
+
+    queue = JobQueue(args.queue, max_attempts=getattr(args, "max_attempts", 3))
+    try:
+        if args.queue_command == "enqueue":
+            try:
+                pages = parse_pages(args.pages)
+            except ValueError as e:
+                raise SystemExit(f"Error: {e}")
+            patterns = list(args.fields) + list(args.field or [])
+            if not patterns and not args.all:
+                raise SystemExit("Error: no fields given, name some fields or use --all")
+            # Resolve names and glob patterns against the workbook, so jobs always name real fields
+            entries = workbooks.field_entries(args.excel)
+            if not args.all:
+                entries = [(value, r) for value, r in entries if generate_report.field_index.matches(value, patterns)]
+            for pattern in patterns:
+                if not any(generate_report.field_index.matches(value, [pattern]) for value, _ in entries):
+                    logger.warning("No fields in %s match %s", args.excel, pattern)
+            fields = list(dict.fromkeys(str(value) for value, _ in entries))
+            added, merged = queue.enqueue_many(fields, pages, args.excel, args.source)
+            print(f"Enqueued {added} new jobs, merged {merged} requests into waiting jobs")
+        elif args.queue_command == "retry":
+            print(f"Requeued {queue.retry_failed()} failed jobs")
+        else:
+            counts = queue.counts()
+            for state in ("queued", "running", "done", "failed", "superseded"):
+                print(f"{state:<11} {counts.get(state, 0)}")
+            for field, attempts, error in queue.failures():
+                print(f"  failed: {field} after {attempts} attempts: {error}")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue field renders and run the workers that process them")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default="reports", help="Directory for the reports (default: reports)")
+    generate_report.field_index.add_field_argument(parser)
+    add_arguments(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args()
+    logs.configure_from_args(args)
+    run_from_args(args)
@@ -0,0 +1,140 @@
+"""
+Atomic output writes and the journal of completed fields
+
+Reports are written under a temporary name in the same directory and renamed
+into place, so a crash never leaves a truncated report behind and readers only
+ever see complete files.
+
+Every field whose report has been written is appended to
+``<output>/journal.jsonl`` (``journal-shard-I-of-N.jsonl`` for a shard), one
+JSON line per field, flushed to disk before the next field starts. A batch run
+with ``--resume`` skips the fields the journal already has for the same
+workbook, so recovering from an interrupted batch only costs the remaining
+fields. A run without ``--resume`` starts a new journal.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import workbooks
+
+# Name of the journal in the output directory
+JOURNAL = "journal.jsonl"
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 of a file, read in chunks"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_bytes_atomic(path, data):
+    """Write a file under a temporary name and rename it into place, so readers never see a partial file"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_text_atomic(path, text):
+    """Write a UTF-8 text file atomically, as write_bytes_atomic"""
+    write_bytes_atomic(path, text.encode("utf-8"))
+
+
+def write_json_atomic(path, data):
+    """Write JSON under a temporary name and rename it into place"""
+    write_text_atomic(path, json.dumps(data, indent=2, ensure_ascii=False))
+
+
+def journal_name(shard=None):
+    """Return the journal file name, one per shard so shards can share an output directory"""
+    if shard is None:
+        return JOURNAL
+    return f"journal-shard-{shard[0]}-of-{shard[1]}.jsonl"
+
+
+class BatchJournal:
+    """
+    Append-only journal of the fields whose report has been written
+
+    Args:
+        output_directory (str): Directory where the reports are saved
+        excel_file (str): Path to the Excel file with crop data, or a glob pattern of workbooks
+        resume (bool): Keep the existing journal and skip the fields it has;
+            otherwise a new journal is started
+        shard (tuple): (shard number, shard count) of a sharded run
+    """
+
+    def __init__(self, output_directory, excel_file, resume=False, shard=None):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, journal_name(shard))
+        self.workbook = workbooks.workbook_sha256(excel_file)
+        self.completed = self._read() if resume else {}
+        self._lock = threading.Lock()
+
+        os.makedirs(output_directory, exist_ok=True)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        # A crash in the middle of an append leaves a torn last line; start on a fresh one
+        if resume and self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def _read(self):
+        """Return {field name: entry} for the entries of this workbook, ignoring a torn last line"""
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("workbook") == self.workbook:
+                    completed[entry["name"]] = entry
+        return completed
+
+    def is_done(self, field_name):
+        """Return True if the journal has the field and its report is still there"""
+        entry = self.completed.get(field_name)
+        return entry is not None and os.path.exists(os.path.join(self.output_directory, entry["report"]))
+
+    def record(self, field, field_name, report_file):
+        """
+        Append a completed field and flush it to disk
+
+        Args:
+            field (str): Field name as it appears in the workbook
+            field_name (str): Sanitized field name
+            report_file (str): File name of the report in the output directory
+        """
+        entry = {
+            "name": field_name,
+            "field": field,
+            "report": report_file,
+            "workbook": self.workbook,
+            "completed": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.completed[field_name] = entry
+
+    def close(self):
+        self._file.close()
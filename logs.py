@@ -0,0 +1,131 @@
+"""
+Leveled logging with per-field context and a JSON-lines sink
+
+The report modules log through the standard ``logging`` module, one logger per
+module (``logging.getLogger(__name__)``), instead of printing:
+
+- DEBUG: per-page and per-image detail (dates picked, images saved, pages combined)
+- INFO: one line per field and the batch summaries, as printed before
+- WARNING: a value or image that fell back to "N/A" or a default
+- ERROR: a field, page or file that failed
+
+The console shows INFO and above by default, as plain messages. ``--log-level
+DEBUG`` brings back the per-page detail, ``--quiet`` only shows warnings and
+errors, and ``--log-file PATH`` additionally writes every record at the log level
+as one JSON object per line:
+
+    {"time": "2025-08-08T10:15:02.113Z", "level": "WARNING", "logger": "page4",
+     "field": "Trichy_Field_1", "pid": 4121, "message": "Error getting RECI change: ..."}
+
+``field_context`` tags every record logged while a field is rendered with the
+field's name, including records from other modules and threads started inside
+it. Messages use %-style arguments, so a disabled DEBUG record costs a level
+check and its string is never built.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LEVEL = "INFO"
+
+# Field being rendered in the current thread or task, None outside a field
+_field = contextvars.ContextVar("field", default=None)
+
+
+@contextlib.contextmanager
+def field_context(field_name):
+    """Tag the records logged inside the block with a field name"""
+    token = _field.set(field_name)
+    try:
+        yield
+    finally:
+        _field.reset(token)
+
+
+class FieldFilter(logging.Filter):
+    """Adds the current field name to every record as record.field"""
+
+    def filter(self, record):
+        if not hasattr(record, "field"):
+            record.field = _field.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.")
+                    + f"{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "field": getattr(record, "field", None),
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure(level=DEFAULT_LEVEL, quiet=False, log_file=None):
+    """
+    Set up the console handler and, optionally, the JSON-lines file
+
+    Calling it again replaces the handlers of an earlier call.
+
+    Args:
+        level (str): Lowest level logged, one of LEVELS
+        quiet (bool): Only show warnings and errors on the console
+        log_file (str): Path of a JSON-lines log written at the log level, appended to
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "_sidra", False):
+            root.removeHandler(handler)
+            handler.close()
+
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    root.setLevel(level)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    console.setLevel(max(level, logging.WARNING) if quiet else level)
+    handlers = [console]
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        sink = logging.FileHandler(log_file, encoding="utf-8")
+        sink.setFormatter(JSONFormatter())
+        sink.setLevel(level)
+        handlers.append(sink)
+    for handler in handlers:
+        handler._sidra = True
+        handler.addFilter(FieldFilter())
+        root.addHandler(handler)
+
+
+def add_arguments(parser, default=None):
+    """Add --log-level, --quiet and --log-file to an argparse parser"""
+    def option_default(value):
+        return value if default is None else default
+
+    parser.add_argument("--log-level", type=str.upper, choices=LEVELS, default=option_default(DEFAULT_LEVEL),
+                        help=f"Lowest level logged (default: {DEFAULT_LEVEL}; DEBUG shows per-page detail)")
+    parser.add_argument("--quiet", action="store_true", default=option_default(False),
+                        help="Only show warnings and errors on the console")
+    parser.add_argument("--log-file", default=option_default(None), metavar="PATH",
+                        help="Also write the log as JSON lines to PATH")
+
+
+def configure_from_args(args):
+    """configure with the options of add_arguments"""
+    configure(getattr(args, "log_level", DEFAULT_LEVEL), getattr(args, "quiet", False),
+              getattr(args, "log_file", None))
@@ -1,23 +1,29 @@
-import pandas as pd
+import logging
 import os
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 def read_excel_data(excel_path):
     """Read data from Excel file"""
+    import pandas as pd
+    
     try:
         # Read the Excel file
         df = pd.read_excel(excel_path)
-        print("Excel data structure:")
-        print(df.head())
-        print("\nColumn names:")
-        print(df.columns.tolist())
+        # Only build the preview when it is going to be logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Excel data structure:\n%s", df.head())
+            logger.debug("Column names: %s", df.columns.tolist())
         return df
     except Exception as e:
-        print(f"Error reading Excel file: {e}")
+        logger.error("Error reading Excel file: %s", e)
         return None
 
 def generate_report_html(data, template_path, output_path):
     """Generate report HTML from template and data"""
+    import pandas as pd
+    
     
     # Read the template
     with open(template_path, 'r', encoding='utf-8') as f:
@@ -41,7 +47,7 @@ def generate_report_html(data, template_path, output_path):
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(report_content)
         
-        print(f"Report generated with default values: {output_path}")
+        logger.debug("Report generated with default values: %s", output_path)
         return report_content
     
     # Extract actual values from Excel data
@@ -290,23 +296,25 @@ def generate_report_html(data, template_path, output_path):
     
     report_content = report_content.replace('</body>', pdf_footer_script + '\n </body>')
     
-    print(f"Data used in report:")
-    print(f"Field Name: {field_name}")
-    print(f"Crop Name: {crop_name}")
-    print(f"Sowing Date: {sowing_date}")
-    print(f"Report Date: {current_date}")
-    print(f"Area Coverage: {area_coverage}")
-    print(f"Growth Stage: {growth_stage}")
+    logger.debug("Data used in report:")
+    logger.debug("Field Name: %s", field_name)
+    logger.debug("Crop Name: %s", crop_name)
+    logger.debug("Sowing Date: %s", sowing_date)
+    logger.debug("Report Date: %s", current_date)
+    logger.debug("Area Coverage: %s", area_coverage)
+    logger.debug("Growth Stage: %s", growth_stage)
     
     # Write the generated report
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(report_content)
     
-    print(f"Report generated successfully: {output_path}")
+    logger.debug("Report generated successfully: %s", output_path)
     return report_content
 
 def generate_reports_for_all_rows(excel_path, template_path, output_dir="reports"):
     """Generate individual reports for each row in the Excel file"""
+    import pandas as pd
+    
     # Create output directory if it doesn't exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -315,7 +323,7 @@ def generate_reports_for_all_rows(excel_path, template_path, output_dir="reports
     data = read_excel_data(excel_path)
     
     if data is not None and len(data) > 0:
-        print(f"Generating reports for {len(data)} rows of data...")
+        logger.info("Generating reports for %s rows of data...", len(data))
         
         # Process each row and generate individual reports
         for index, row in data.iterrows():
@@ -329,20 +337,35 @@ def generate_reports_for_all_rows(excel_path, template_path, output_dir="reports
             # Generate report for this row
             generate_report_html(single_row_data, template_path, output_path)
             
-        print(f"All reports generated successfully in '{output_dir}' directory.")
+        logger.info("All reports generated successfully in '%s' directory.", output_dir)
     else:
-        print("No data found in the Excel file.")
+        logger.warning("No data found in the Excel file.")
 
 if __name__ == "__main__":
+    import argparse
+    import field_index
+    import logs
+    
+    parser = argparse.ArgumentParser(description="Generate the Field Information report page")
+    field_index.add_field_argument(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args()
+    logs.configure_from_args(args)
+    
     # Paths
     excel_path = "demo.xlsx"  # Using the test Excel file
     template_path = "templete/page1.html"
     
-    # Generate individual reports for each row
-    generate_reports_for_all_rows(excel_path, template_path)
-    
-    # Also generate a single report with the second row for backward compatibility
-    output_path = "crop_report.html"
-    data = read_excel_data(excel_path)
-    if data is not None and len(data) > 0:
-        generate_report_html(data, template_path, output_path)
+    if args.field:
+        # Only the matching rows are read, one output file per field
+        import generate_report
+        generate_report.generate_page_for_fields(1, excel_path, args.field)
+    else:
+        # Generate individual reports for each row
+        generate_reports_for_all_rows(excel_path, template_path)
+        
+        # Also generate a single report with the second row for backward compatibility
+        output_path = "crop_report.html"
+        data = read_excel_data(excel_path)
+        if data is not None and len(data) > 0:
+            generate_report_html(data, template_path, output_path)
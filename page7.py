@@ -0,0 +1,98 @@
+import html
+import json
+import logging
+
+import zones
+
+logger = logging.getLogger(__name__)
+
+def zone_table(stats, indices):
+    """
+    Header cells and body rows of the zone table
+
+    Args:
+        stats (list): The zones of the field, as in the "Zones stats" column
+        indices (list): Indices the field was zoned by
+
+    Returns:
+        tuple: (header cells HTML, body rows HTML)
+    """
+    colors = zones.ZONE_COLORS[len(stats)]
+    header = "".join(f'<th class="px-3 py-2 text-left">{name}</th>'
+                     for name in ["Zone", "Share of field"] + [f"Mean {index}" for index in indices])
+    rows = []
+    for zone in stats:
+        swatch = (f'<span class="inline-block w-3 h-3 rounded-sm mr-2 align-middle" '
+                  f'style="background:{colors[zone["zone"] - 1]}"></span>')
+        cells = [f'{swatch}Zone {zone["zone"]}', f'{zone["share"]:.1f}%']
+        cells += [f'{zone["means"][index]:.2f}' if index in zone["means"] else "N/A" for index in indices]
+        rows.append('<tr class="border-b border-gray-200">'
+                    + "".join(f'<td class="px-3 py-2">{cell}</td>' for cell in cells) + '</tr>')
+    return header, "\n".join(rows)
+
+def zone_summary(stats, indices):
+    """One paragraph on what the zones are and how the weakest and strongest zone compare"""
+    weakest, strongest = stats[0], stats[-1]
+    summary = (f"The field is split into {len(stats)} zones by its current {', '.join(indices)} maps. "
+               f"Zone 1 is the weakest part of the field and covers {weakest['share']:.1f}% of it")
+    if len(stats) > 1:
+        summary += f"; zone {strongest['zone']} is the strongest and covers {strongest['share']:.1f}%"
+    return (summary + ". Values are positions on the colour scale of each index map, "
+            "from 0.00 at its low end to 1.00 at its high end.")
+
+def generate_page7(template_file, output_file, field_data):
+    """
+    Generate the management zones page of a field
+
+    Args:
+        template_file (str): Path to the page template
+        output_file (str): Path the page is written to
+        field_data (pandas.DataFrame): Single row dataframe with the "Zones ..." columns (zones.py)
+
+    Returns:
+        str: The page HTML
+    """
+    import pandas as pd
+
+    df = field_data
+
+    # Read the HTML template
+    with open(template_file, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+
+    row = df.iloc[0]
+    stats = json.loads(row['Zones stats'])
+    indices = str(row['Zones indices']).split(", ")
+
+    field_name = str(row['Field']) if 'Field' in df.columns else "N/A"
+    try:
+        # The zones are clustered on the current images; same date fallbacks as page 2
+        current_date = next((row[column] for column in ('NDVI Image date', 'NDMI Image date', 'Current  image')
+                             if column in row and not pd.isna(row[column])), None)
+        if isinstance(current_date, str):
+            current_date = current_date.strip()
+        image_date = pd.to_datetime(current_date).strftime('%d/%m/%Y')
+    except Exception as e:
+        logger.warning("Error processing image date: %s", e)
+        image_date = "N/A"
+
+    html_content = html_content.replace('FIELD:<br/>FIELD NAME', f'FIELD:<br/>{html.escape(field_name)}')
+    html_content = html_content.replace('IMAGE DATE<br/>ZONES DATE', f'IMAGE DATE<br/>{image_date}')
+
+    # The zone map is a data: URI made by zones.zone_map
+    html_content = html_content.replace(
+        '<img alt="Management zones" class="w-[220px] h-[220px] object-contain" height="220" src=" " width="220"/>',
+        f'<img alt="Management zones" class="w-[220px] h-[220px] object-contain" height="220" src="{row["Zones map"]}" width="220"/>'
+    )
+
+    header, rows = zone_table(stats, indices)
+    html_content = html_content.replace('ZONE HEADER', header)
+    html_content = html_content.replace('ZONE ROWS', rows)
+    html_content = html_content.replace('ZONES SUMMARY', zone_summary(stats, indices))
+
+    # Save the generated HTML
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+    logger.debug("Page 7 report generated successfully: %s", output_file)
+    return html_content
@@ -0,0 +1,466 @@
+"""
+Staged asyncio pipeline for generating the full reports
+
+generate_full_report handles one field at a time: extract images, render the
+six pages, combine them and write the report. This module runs the same steps
+as separate stages connected by bounded queues, so the image extraction and
+file writes of one field overlap with the rendering of another:
+
+    rows -> [extract] -> [render] -> [combine] -> [write]
+
+The rows and the raw bytes of their images are read once up front, straight
+from the workbook package (generate_report.read_selected_fields), so the
+extraction threads share no openpyxl objects and only save bytes. Rendering
+and combining run in a process pool, and finished reports are written in batches.
+Queue depths are printed while the batch runs and a per-stage throughput
+summary at the end, so the slowest stage is easy to spot.
+
+Usage:
+    python pipeline.py [--excel demo.xlsx] [--output reports]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import advisory
+import cohort
+import contours
+import dashboard
+import generate_report
+import hotspots
+import imagery
+import journal
+import logs
+import precompress
+import progress
+import results
+import tiles
+import validation
+import zones
+
+logger = logging.getLogger(__name__)
+
+STAGE_NAMES = ["extract", "render", "combine", "write"]
+
+
+class StageStats:
+    """Counters for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def throughput(self, wall_seconds):
+        return self.completed / wall_seconds if wall_seconds > 0 else 0.0
+
+    def summary(self, wall_seconds):
+        average = self.busy_seconds / self.completed if self.completed else 0.0
+        return (f"{self.name:<8} completed={self.completed:<6} failed={self.failed:<4} "
+                f"throughput={self.throughput(wall_seconds):7.2f} fields/s  "
+                f"avg={average * 1000:8.1f} ms  max queue={self.max_queue_depth}")
+
+
+def render_pages(excel_file, single_row_data, field_images_dir):
+    """Render the pages of one field in a private temporary directory and return their HTML"""
+    with logs.field_context(os.path.basename(field_images_dir)), \
+            tempfile.TemporaryDirectory(prefix="sidra_pages_") as temp_dir:
+        temp_files = {name: os.path.join(temp_dir, f"temp_{name}.html") for name in generate_report.REPORT_PAGES}
+        return generate_report.render_field_pages(excel_file, single_row_data, field_images_dir, temp_files)
+
+
+def write_reports(batch, batch_journal=None):
+    """
+    Write a batch of (output path, HTML, field, field name) reports atomically, journaling each one
+
+    The HTML may instead be the output of precompress.encode_report, written with its compressed siblings.
+    """
+    for output_path, combined_html, field, field_name in batch:
+        if isinstance(combined_html, dict):
+            precompress.write_encoded(output_path, combined_html)
+        else:
+            journal.write_text_atomic(output_path, combined_html)
+            precompress.remove_siblings(output_path)
+        if batch_journal is not None:
+            batch_journal.record(field, field_name, os.path.basename(output_path))
+        logger.info("Full report generated successfully: %s", output_path)
+
+
+class ReportPipeline:
+    """
+    Asyncio pipeline generating the full report of every field in a workbook
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        output_directory (str): Directory where the reports will be saved
+        queue_size (int): Capacity of each queue between stages
+        extract_workers (int): Threads extracting field images
+        render_workers (int): Processes rendering and combining pages
+        write_batch (int): Maximum number of reports written in one batch
+        report_interval (float): Seconds between queue depth reports, 0 to disable
+        fields (list): Field names or glob patterns; when given, only the matching rows
+            and their images are read from the workbook, otherwise every field's
+        resume (bool): Skip the fields the journal of an earlier run already has
+        precompress (bool): Minify the reports and write .html.gz and .html.br siblings,
+            compressed in the process pool by the combine stage
+        hashed_assets (bool): Link the shared assets as content-hashed files in static/
+        advisory_rules (str): Rule table to generate the empty advisory columns from
+        cohorts (bool): Rank every field against the fields of the same crop and growth stage
+        validate (bool): Check the rows before rendering and write validation.csv
+        strict (bool): Validate and stop before rendering if there is any error
+        progress_options (dict): Options for progress.ProgressReporter, to report fields done,
+            rate, ETA and stage latencies while the batch runs
+        stale_imagery (bool): Hash every image and mark the pages whose old and current image
+            are the same as "no new imagery"
+        tile_pyramids (bool): Cut the index images into deep-zoom tile pyramids in static/tiles/
+        hotspot_options (dict): Options for hotspots.apply_and_report, to outline the stress
+            hotspots of every index image on pages 2-6
+        contour_options (dict): Options for contours.apply_and_report, to lay the contour lines
+            of every index image over pages 2-6
+        zone_count: "auto" or the number of management zones to split every field into,
+            shown on a zones page
+        export_formats (list): Formats to also write the results of every field in, as
+            <output>/results.<ext> (see results.py)
+    """
+
+    def __init__(self, excel_file, output_directory="reports", queue_size=8, extract_workers=4,
+                 render_workers=None, write_batch=8, report_interval=5.0, fields=None, resume=False,
+                 precompress=False, hashed_assets=False, advisory_rules=None, cohorts=False,
+                 validate=False, strict=False, progress_options=None, stale_imagery=False,
+                 tile_pyramids=False, hotspot_options=None, contour_options=None, zone_count=None,
+                 export_formats=None):
+        self.excel_file = excel_file
+        self.precompress = precompress
+        self.hashed_assets = hashed_assets
+        self.advisory_rules = advisory_rules
+        self.cohorts = cohorts
+        self.validate = validate
+        self.strict = strict
+        self.progress_options = progress_options
+        self.stale_imagery = stale_imagery
+        self.tile_pyramids = tile_pyramids
+        self.hotspot_options = hotspot_options
+        self.contour_options = contour_options
+        self.zone_count = zone_count
+        self.export_formats = export_formats
+        # Results files the written fields are added to, while the batch runs
+        self.export = None
+        self.reporter = None
+        self.fields = fields
+        self.resume = resume
+        self.journal = None
+        # Dashboard summaries of the fields in the batch, and the names of those completed
+        self.summaries = {}
+        self.completed = set()
+        self.output_directory = output_directory
+        self.queue_size = queue_size
+        self.extract_workers = extract_workers
+        self.render_workers = render_workers or os.cpu_count() or 1
+        self.write_batch = write_batch
+        self.report_interval = report_interval
+        self.stats = {name: StageStats(name) for name in STAGE_NAMES}
+        self.queues = {}
+
+    async def run(self):
+        """Run the whole batch and return the per-stage statistics"""
+        import pandas as pd
+
+        loop = asyncio.get_running_loop()
+        os.makedirs(self.output_directory, exist_ok=True)
+        os.makedirs("images", exist_ok=True)
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.extract_workers) as io_executor, \
+                ProcessPoolExecutor(max_workers=self.render_workers) as cpu_executor:
+            # Read the rows, every field's or just the selected ones, and the raw bytes of
+            # their images; the extraction threads then only save bytes, sharing no workbook
+            try:
+                df, field_images = await loop.run_in_executor(
+                    io_executor, generate_report.read_selected_fields, self.excel_file, self.fields or None)
+                if df is None and self.fields:
+                    logger.warning("No fields in %s match %s", self.excel_file, ', '.join(self.fields))
+                    return self.stats
+                if df is None:
+                    logger.warning("No fields found in %s", self.excel_file)
+                    return self.stats
+            except Exception as e:
+                logger.error("Error reading Excel file: %s", e)
+                return self.stats
+            logger.info("Successfully read Excel file: %s", self.excel_file)
+            logger.info("Found %s rows of data", len(df))
+            if self.advisory_rules:
+                try:
+                    df = advisory.apply_from_path(df, self.advisory_rules)
+                except (OSError, ValueError) as e:
+                    logger.error("Error reading advisory rules: %s", e)
+                    return self.stats
+            if self.validate or self.strict:
+                if not validation.check(df, self.excel_file, self.output_directory, strict=self.strict):
+                    return self.stats
+            if self.stale_imagery:
+                df = imagery.apply_and_report(df, field_images, self.output_directory)
+            if self.tile_pyramids:
+                df = tiles.apply_and_build(df, field_images)
+            if self.hotspot_options is not None:
+                df = hotspots.apply_and_report(df, field_images, self.hotspot_options, self.output_directory)
+            if self.contour_options is not None:
+                df = contours.apply_and_report(df, field_images, self.contour_options)
+            if self.zone_count is not None:
+                df = zones.apply_and_report(df, field_images, self.zone_count, self.output_directory)
+            if self.cohorts:
+                df = cohort.apply_and_report(df)
+
+            self.queues = {name: asyncio.Queue(maxsize=self.queue_size) for name in STAGE_NAMES}
+            # Results rows are written as the reports are; a run that stops early leaves no results files
+            try:
+                self.export = results.open_export(self.output_directory, self.export_formats, df)
+            except (OSError, ImportError) as e:
+                logger.error("Error opening the results export: %s", e)
+                return self.stats
+            self.journal = journal.BatchJournal(self.output_directory, self.excel_file, resume=self.resume)
+            try:
+                assets = None
+                if self.hashed_assets:
+                    import static_assets
+                    assets = static_assets.build()
+                if self.precompress:
+                    logger.info("%s", precompress.describe())
+                if self.resume:
+                    logger.info("Resuming: %s fields already completed in %s",
+                                len(self.journal.completed), self.journal.path)
+                if self.progress_options is not None:
+                    self.reporter = progress.ProgressReporter(
+                        len(df), labels={"workbook": os.path.basename(self.excel_file)},
+                        **self.progress_options).start()
+
+                async def extract(job):
+                    os.makedirs(job["field_images_dir"], exist_ok=True)
+                    redundant = imagery.redundant_images(job["row"])
+                    images = {name: data for name, data in job.pop("images").items() if name not in redundant}
+                    await loop.run_in_executor(
+                        io_executor, generate_report.save_field_images,
+                        images, job["field_images_dir"], job["field_name"])
+                    return job
+
+                async def render(job):
+                    single_row_data = pd.DataFrame([job["row"]])
+                    job["pages"] = await loop.run_in_executor(
+                        cpu_executor, render_pages, self.excel_file, single_row_data, job["field_images_dir"])
+                    return job
+
+                async def combine(job):
+                    job["html"] = await loop.run_in_executor(
+                        cpu_executor, generate_report.combine_page_contents, job.pop("pages"), job["field_name"],
+                        assets, tiles.image_tiles(job["row"]))
+                    if self.precompress:
+                        job["html"] = await loop.run_in_executor(cpu_executor, precompress.encode_report, job["html"])
+                    return job
+
+                workers = []
+                for name, work, count in (("extract", extract, self.extract_workers),
+                                          ("render", render, self.render_workers),
+                                          ("combine", combine, self.render_workers)):
+                    downstream = STAGE_NAMES[STAGE_NAMES.index(name) + 1]
+                    for _ in range(count):
+                        workers.append(asyncio.create_task(
+                            self._stage_worker(name, work, self.queues[name], self.queues[downstream])))
+                workers.append(asyncio.create_task(self._writer(io_executor)))
+                monitor = asyncio.create_task(self._monitor()) if self.report_interval > 0 else None
+
+                # Feed the rows, blocking whenever extraction falls behind
+                for index, row in df.iterrows():
+                    field_name = generate_report.sanitize_field_name(row, index)
+                    self.summaries[field_name] = dashboard.field_summary(row, field_name)
+                    if self.journal.is_done(field_name):
+                        self.completed.add(field_name)
+                        if self.export is not None:
+                            self.export.add(row, field_name, f"full_report_{field_name}.html")
+                        logger.info("Skipping %s, already completed", field_name)
+                        if self.reporter is not None:
+                            self.reporter.field_skipped()
+                        continue
+                    job = {
+                        "field": str(row['Field']) if 'Field' in row else field_name,
+                        "field_name": field_name,
+                        "row": row,
+                        "field_images_dir": os.path.join("images", field_name),
+                        "images": field_images[index],
+                    }
+                    await self.queues["extract"].put(job)
+                    self._sample_depths()
+
+                # Drain the stages in order; each stage only marks a job done after handing it on
+                for name in STAGE_NAMES:
+                    await self.queues[name].join()
+                for task in workers:
+                    task.cancel()
+                if monitor is not None:
+                    monitor.cancel()
+                await asyncio.gather(*workers, *([monitor] if monitor else []), return_exceptions=True)
+                self.journal.close()
+                if self.export is not None:
+                    self.export.close()
+                if self.reporter is not None:
+                    self.reporter.close()
+                dashboard.write_dashboard(self.output_directory,
+                                          [self.summaries[name] for name in self.completed], self.excel_file,
+                                          precompress=self.precompress)
+            finally:
+                # Unless closed above, the unfinished results files are removed
+                if self.export is not None:
+                    self.export.close(keep=False)
+
+        wall_seconds = time.perf_counter() - start
+        logger.info("===== Pipeline finished in %.2fs =====", wall_seconds)
+        for name in STAGE_NAMES:
+            logger.info("%s", self.stats[name].summary(wall_seconds))
+        return self.stats
+
+    async def _stage_worker(self, name, work, inbox, outbox):
+        stats = self.stats[name]
+        while True:
+            job = await inbox.get()
+            try:
+                started = time.perf_counter()
+                job = await work(job)
+                elapsed = time.perf_counter() - started
+                stats.busy_seconds += elapsed
+                stats.completed += 1
+                if self.reporter is not None:
+                    self.reporter.observe(name, elapsed)
+                await outbox.put(job)
+                self._sample_depths()
+            except Exception as e:
+                stats.failed += 1
+                logger.error("Error generating report for %s (%s): %s", job['field_name'], name, e)
+                if self.reporter is not None:
+                    self.reporter.field_failed()
+            finally:
+                inbox.task_done()
+
+    async def _writer(self, io_executor):
+        """Collect combined reports and write them in batches"""
+        loop = asyncio.get_running_loop()
+        inbox = self.queues["write"]
+        stats = self.stats["write"]
+        while True:
+            jobs = [await inbox.get()]
+            while len(jobs) < self.write_batch and not inbox.empty():
+                jobs.append(inbox.get_nowait())
+            batch = [(os.path.join(self.output_directory, f"full_report_{job['field_name']}.html"), job["html"],
+                      job["field"], job["field_name"]) for job in jobs]
+            try:
+                started = time.perf_counter()
+                await loop.run_in_executor(io_executor, write_reports, batch, self.journal)
+                elapsed = time.perf_counter() - started
+                stats.busy_seconds += elapsed
+                stats.completed += len(jobs)
+                self.completed.update(job["field_name"] for job in jobs)
+                if self.export is not None:
+                    for job in jobs:
+                        self.export.add(job["row"], job["field_name"], f"full_report_{job['field_name']}.html")
+                if self.reporter is not None:
+                    # A batch write is shared by its reports
+                    for _ in jobs:
+                        self.reporter.observe("write", elapsed / len(jobs))
+                        self.reporter.field_done()
+            except Exception as e:
+                stats.failed += len(jobs)
+                logger.error("Error writing reports: %s", e)
+                if self.reporter is not None:
+                    for _ in jobs:
+                        self.reporter.field_failed()
+            finally:
+                for _ in jobs:
+                    inbox.task_done()
+
+    def _sample_depths(self):
+        for name, queue in self.queues.items():
+            stats = self.stats[name]
+            stats.max_queue_depth = max(stats.max_queue_depth, queue.qsize())
+
+    async def _monitor(self):
+        """Periodically print queue depths and completed counts"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            depths = "  ".join(f"{name}={queue.qsize()}/{self.queue_size}" for name, queue in self.queues.items())
+            done = "  ".join(f"{name}={self.stats[name].completed}" for name in STAGE_NAMES)
+            logger.info("[pipeline] queue depths: %s | completed: %s", depths, done)
+
+
+def run_pipeline(excel_file, output_directory="reports", **options):
+    """
+    Generate the full report for each field using the staged pipeline
+
+    Args:
+        excel_file (str): Path to the Excel file with crop data
+        output_directory (str): Directory where the reports will be saved
+        **options: Tuning options passed to ReportPipeline
+
+    Returns:
+        dict: Stage names mapped to their StageStats
+    """
+    return asyncio.run(ReportPipeline(excel_file, output_directory, **options).run())
+
+
+def add_arguments(parser):
+    """Add the pipeline tuning options to an argparse parser"""
+    parser.add_argument("--queue-size", type=int, default=8, help="Capacity of each queue between stages")
+    parser.add_argument("--extract-workers", type=int, default=4, help="Threads extracting field images")
+    parser.add_argument("--render-workers", type=int, default=None, help="Processes rendering pages (default: CPU count)")
+    parser.add_argument("--write-batch", type=int, default=8, help="Maximum reports written per batch")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between queue depth reports (0 disables)")
+    # SUPPRESS keeps a --resume given before the "pipeline" command
+    parser.add_argument("--resume", action="store_true", default=argparse.SUPPRESS,
+                        help="Skip the fields already completed according to the journal in the output directory")
+    parser.add_argument("--precompress", action="store_true", default=argparse.SUPPRESS,
+                        help="Minify the reports and write .html.gz and .html.br siblings")
+    parser.add_argument("--hashed-assets", action="store_true", default=argparse.SUPPRESS,
+                        help="Link the shared assets as content-hashed files in static/")
+    advisory.add_argument(parser, default=argparse.SUPPRESS)
+    cohort.add_argument(parser, default=argparse.SUPPRESS)
+    imagery.add_argument(parser, default=argparse.SUPPRESS)
+    tiles.add_argument(parser, default=argparse.SUPPRESS)
+    hotspots.add_arguments(parser, default=argparse.SUPPRESS)
+    contours.add_arguments(parser, default=argparse.SUPPRESS)
+    zones.add_argument(parser, default=argparse.SUPPRESS)
+    results.add_argument(parser, default=argparse.SUPPRESS)
+    validation.add_arguments(parser, default=argparse.SUPPRESS)
+    progress.add_arguments(parser, default=argparse.SUPPRESS)
+
+
+def run_from_args(args):
+    """Run the pipeline with options parsed by a parser set up with add_arguments"""
+    return run_pipeline(args.excel, args.output, queue_size=args.queue_size, extract_workers=args.extract_workers,
+                        render_workers=args.render_workers, write_batch=args.write_batch,
+                        report_interval=args.report_interval, fields=args.field, resume=getattr(args, "resume", False),
+                        precompress=getattr(args, "precompress", False),
+                        hashed_assets=getattr(args, "hashed_assets", False),
+                        advisory_rules=getattr(args, "advisory_rules", None),
+                        cohorts=getattr(args, "cohorts", False), validate=getattr(args, "validate", False),
+                        strict=getattr(args, "strict", False), progress_options=progress.options_from_args(args),
+                        stale_imagery=getattr(args, "stale_imagery", False),
+                        tile_pyramids=getattr(args, "tiles", False),
+                        hotspot_options=hotspots.options_from_args(args),
+                        contour_options=contours.options_from_args(args),
+                        zone_count=getattr(args, "zones", None),
+                        export_formats=getattr(args, "export", None))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate full reports with a staged asyncio pipeline")
+    parser.add_argument("--excel", default="demo.xlsx",
+                        help="Excel file with crop data, or a glob pattern of workbooks to merge (default: demo.xlsx)")
+    parser.add_argument("--output", default="reports", help="Directory for the reports (default: reports)")
+    generate_report.field_index.add_field_argument(parser)
+    add_arguments(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args()
+    logs.configure_from_args(args)
+    run_from_args(args)
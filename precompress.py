@@ -0,0 +1,157 @@
+"""
+Minified, precompressed report output for static hosting
+
+With ``--precompress`` every full report is minified and written together with
+``.html.gz`` and ``.html.br`` siblings, so a static web server (e.g. nginx with
+gzip_static/brotli_static) can send the compressed file as is instead of
+compressing the report again on every request.
+
+Minification is conservative: comments are dropped and runs of whitespace
+collapse to a single space, which doesn't change how the page renders.
+<pre> and <textarea> are left alone; inline <script> and <style> blocks only
+lose their indentation and blank lines.
+
+Brotli needs the optional ``brotli`` package (``pip install brotli``); without
+it only the .gz siblings are written, and a .br left by an earlier run is removed.
+"""
+import gzip
+import os
+import re
+
+import journal
+
+# Elements whose content is copied through the whitespace collapsing untouched, or only lightly trimmed
+RAW_ELEMENTS = re.compile(r"(<(script|style|pre|textarea)\b[^>]*>)(.*?)(</\2\s*>)", re.IGNORECASE | re.DOTALL)
+
+# HTML comments, except conditional comments
+COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+
+WHITESPACE = re.compile(r"\s+")
+
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+_brotli = None
+
+
+def _brotli_module():
+    """Return the brotli module, or False when it isn't installed"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            try:
+                import brotlicffi as brotli
+                _brotli = brotli
+            except ImportError:
+                _brotli = False
+    return _brotli
+
+
+def describe():
+    """One line saying which compressed siblings will be written, for the batch log"""
+    if _brotli_module():
+        return "Precompressing reports: minified .html with .gz and .br siblings"
+    return "Precompressing reports: minified .html with .gz siblings (brotli is not installed, pip install brotli)"
+
+
+def _trim_lines(text):
+    """Drop indentation and blank lines, keeping line breaks for JavaScript's automatic semicolons"""
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def minify_html(html):
+    """
+    Minify an HTML document without changing how it renders
+
+    Args:
+        html (str): HTML document
+
+    Returns:
+        str: Minified HTML
+    """
+    parts = []
+    position = 0
+    for match in RAW_ELEMENTS.finditer(html):
+        parts.append(WHITESPACE.sub(" ", COMMENT.sub("", html[position:match.start()])))
+        opening, tag, content, closing = match.group(1), match.group(2).lower(), match.group(3), match.group(4)
+        if tag == "style":
+            content = _trim_lines(CSS_COMMENT.sub("", content))
+        elif tag == "script":
+            content = _trim_lines(content)
+        parts.append(WHITESPACE.sub(" ", opening) + content + closing)
+        position = match.end()
+    parts.append(WHITESPACE.sub(" ", COMMENT.sub("", html[position:])))
+    return "".join(parts).strip()
+
+
+def encode(data):
+    """
+    Compress a file's content for every encoding available
+
+    Args:
+        data (bytes): File content
+
+    Returns:
+        dict: File name suffix ("" for the file itself, ".gz", ".br") mapped to the bytes to write
+    """
+    # mtime=0 keeps the .gz output identical between builds
+    encoded = {"": data, ".gz": gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+    brotli = _brotli_module()
+    if brotli:
+        encoded[".br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return encoded
+
+
+def encode_report(html):
+    """Minify a report and compress it, returning the files to write as for encode()"""
+    return encode(minify_html(html).encode("utf-8"))
+
+
+def write_encoded(path, encoded):
+    """
+    Write a file and its compressed siblings, each atomically
+
+    Args:
+        path (str): Path of the uncompressed file
+        encoded (dict): Output of encode() or encode_report()
+
+    Returns:
+        dict: File name suffix mapped to the number of bytes written
+    """
+    # Siblings first, so a server never finds a new .html next to stale .gz/.br files for long;
+    # the ones this run doesn't write (.br without brotli) are removed rather than left stale
+    remove_siblings(path, keep=encoded)
+    for suffix in sorted(encoded, key=len, reverse=True):
+        journal.write_bytes_atomic(path + suffix, encoded[suffix])
+    return {suffix: len(data) for suffix, data in encoded.items()}
+
+
+def write_report(path, html):
+    """Minify a report and write it with its compressed siblings"""
+    return write_encoded(path, encode_report(html))
+
+
+def compress_file(path):
+    """Write compressed siblings for an existing file, e.g. the batch dashboard"""
+    with open(path, "rb") as f:
+        encoded = encode(f.read())
+    del encoded[""]
+    return write_encoded(path, encoded)
+
+
+def remove_siblings(path, keep=()):
+    """
+    Remove stale compressed siblings of a file
+
+    Args:
+        path (str): Path of the uncompressed file
+        keep (iterable): Suffixes about to be written, which are left alone; none without --precompress
+    """
+    for suffix in (".gz", ".br"):
+        if suffix not in keep and os.path.exists(path + suffix):
+            os.remove(path + suffix)
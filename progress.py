@@ -0,0 +1,292 @@
+"""
+Live progress, ETA and Prometheus metrics for batch runs
+
+A multi-hour batch otherwise only prints a "===== Generating report for X ====="
+line per field. With ``--progress`` a ProgressReporter counts the fields
+completed, failed and skipped, times every stage of every field (extract,
+render, combine, write) into latency histograms and prints a status line every
+``--progress-interval`` seconds:
+
+    [progress] 1200/10000 fields, 3 failed, 40 skipped | 2.41 fields/s (last 5m00s) | ETA 1h00m | ...
+
+The rate and ETA are computed over a rolling window (ROLLING_WINDOW), from a
+background thread, so a batch that slows to a crawl or stalls on one field shows
+a falling rate and a growing "last completion" age while it is happening.
+
+With ``--metrics-file PATH`` the same numbers are written at every interval, and
+once more at the end, in the Prometheus text format for the node exporter's
+textfile collector, e.g. ``--metrics-file /var/lib/node_exporter/sidra.prom``.
+The file is replaced atomically, so the collector never reads a partial file
+and no network service is needed. ``sidra_report_last_completion_timestamp_seconds``
+makes a stall easy to alert on.
+"""
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+
+import journal
+
+logger = logging.getLogger(__name__)
+
+# Seconds between status lines and metrics file updates
+DEFAULT_INTERVAL = 10.0
+
+# Seconds of completions the rate and ETA are computed over
+ROLLING_WINDOW = 300.0
+
+# Upper bounds in seconds of the stage latency histogram buckets
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+METRIC_PREFIX = "sidra_report"
+
+
+def untimed(stage):
+    """Stand-in for ProgressReporter.timer when there is no reporter"""
+    return contextlib.nullcontext()
+
+
+def format_duration(seconds):
+    """Return seconds as "45s", "12m05s" or "3h20m" """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets, as Prometheus expects"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class ProgressReporter:
+    """
+    Counts fields, times stages and reports progress while a batch runs
+
+    Args:
+        total (int): Fields in the batch
+        metrics_file (str): Prometheus textfile to write, None for none
+        interval (float): Seconds between status lines and metrics file updates
+        print_status (bool): Print a status line at every interval
+        labels (dict): Labels added to every metric, e.g. {"workbook": "demo.xlsx"}
+    """
+
+    def __init__(self, total, metrics_file=None, interval=DEFAULT_INTERVAL, print_status=True, labels=None):
+        self.total = total
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.print_status = print_status
+        self.labels = labels or {}
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.histograms = {}
+        self.started = time.time()
+        self.last_completion = None
+        # Wall-clock times of the recent completions, for the rolling rate
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start reporting every interval from a background thread"""
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def close(self):
+        """Stop the background thread and report the final numbers"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report(final=True)
+
+    def exclude(self, count=1):
+        """Take fields that turn out not to be part of this run (e.g. another shard's) out of the total"""
+        with self._lock:
+            self.total -= count
+
+    def observe(self, stage, seconds):
+        """Record how long one field spent in a stage"""
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Context manager timing the block as one field's time in a stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def _finish(self):
+        now = time.time()
+        self.last_completion = now
+        self._recent.append(now)
+
+    def field_done(self):
+        with self._lock:
+            self.completed += 1
+            self._finish()
+
+    def field_failed(self):
+        with self._lock:
+            self.failed += 1
+            self._finish()
+
+    def field_skipped(self):
+        with self._lock:
+            self.skipped += 1
+
+    def snapshot(self):
+        """Return the current counters, rolling rate and ETA as a dict"""
+        with self._lock:
+            now = time.time()
+            while self._recent and self._recent[0] < now - ROLLING_WINDOW:
+                self._recent.popleft()
+            elapsed = now - self.started
+            window = min(ROLLING_WINDOW, elapsed)
+            rate = len(self._recent) / window if window > 0 else 0.0
+            remaining = max(0, self.total - self.completed - self.failed - self.skipped)
+            return {
+                "total": self.total,
+                "completed": self.completed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "remaining": remaining,
+                "elapsed": elapsed,
+                "rate": rate,
+                "eta": remaining / rate if rate > 0 else (0.0 if remaining == 0 else None),
+                "last_completion": self.last_completion,
+                "stages": {name: (h.count, h.sum, list(h.counts), h.mean()) for name, h in self.histograms.items()},
+            }
+
+    def status_line(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        done = snapshot["completed"] + snapshot["failed"] + snapshot["skipped"]
+        parts = [f"{done}/{snapshot['total']} fields, {snapshot['failed']} failed, {snapshot['skipped']} skipped",
+                 f"{snapshot['rate']:.2f} fields/s (last {format_duration(ROLLING_WINDOW)})",
+                 "ETA " + ("unknown" if snapshot["eta"] is None else format_duration(snapshot["eta"]))]
+        if snapshot["last_completion"] is not None:
+            idle = time.time() - snapshot["last_completion"]
+            if idle >= self.interval:
+                parts.append(f"last completion {format_duration(idle)} ago")
+        if snapshot["stages"]:
+            parts.append("avg " + " ".join(f"{name}={mean * 1000:.0f}ms"
+                                           for name, (_, _, _, mean) in snapshot["stages"].items()))
+        return "[progress] " + " | ".join(parts)
+
+    def render_metrics(self, snapshot=None, running=True):
+        """Return the metrics in the Prometheus text exposition format"""
+        snapshot = snapshot or self.snapshot()
+        labels = _labels(self.labels)
+        lines = []
+
+        def metric(name, kind, help_text, value):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            lines.append(f"{METRIC_PREFIX}_{name}{labels} {_number(value)}")
+
+        metric("fields", "gauge", "Fields in the batch.", snapshot["total"])
+        metric("fields_completed_total", "counter", "Fields whose report was written.", snapshot["completed"])
+        metric("fields_failed_total", "counter", "Fields whose report failed.", snapshot["failed"])
+        metric("fields_skipped_total", "counter", "Fields skipped as already completed.", snapshot["skipped"])
+        metric("fields_per_second", "gauge",
+               f"Fields finished per second over the last {ROLLING_WINDOW:g} seconds.", round(snapshot["rate"], 4))
+        metric("eta_seconds", "gauge", "Estimated seconds until the batch finishes.",
+               None if snapshot["eta"] is None else round(snapshot["eta"], 1))
+        metric("start_timestamp_seconds", "gauge", "Unix time the batch started.", round(self.started, 3))
+        metric("last_completion_timestamp_seconds", "gauge", "Unix time the last field finished.",
+               None if snapshot["last_completion"] is None else round(snapshot["last_completion"], 3))
+        metric("running", "gauge", "1 while the batch runs, 0 once it has finished.", 1 if running else 0)
+
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} Seconds one field spent in each stage.")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, (count, total, counts, _) in snapshot["stages"].items():
+            stage_labels = dict(self.labels, stage=stage)
+            for bound, bucket_count in zip(BUCKETS, counts):
+                lines.append(f"{name}_bucket{_labels(dict(stage_labels, le=f'{bound:g}'))} {bucket_count}")
+            lines.append(f"{name}_bucket{_labels(dict(stage_labels, le='+Inf'))} {count}")
+            lines.append(f"{name}_sum{_labels(stage_labels)} {_number(round(total, 6))}")
+            lines.append(f"{name}_count{_labels(stage_labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def report(self, final=False):
+        """Log a status line and write the metrics file"""
+        snapshot = self.snapshot()
+        if self.print_status or final:
+            logger.info("%s", self.status_line(snapshot))
+        if self.metrics_file:
+            try:
+                journal.write_text_atomic(self.metrics_file, self.render_metrics(snapshot, running=not final))
+            except OSError as e:
+                logger.error("Error writing metrics file %s: %s", self.metrics_file, e)
+
+
+def add_arguments(parser, default=None):
+    """Add --progress, --progress-interval and --metrics-file to an argparse parser"""
+    def option_default(value):
+        return value if default is None else default
+
+    parser.add_argument("--progress", action="store_true", default=option_default(False),
+                        help="Print fields done, rate and ETA while the batch runs")
+    parser.add_argument("--progress-interval", type=float, default=option_default(DEFAULT_INTERVAL),
+                        metavar="SECONDS",
+                        help=f"Seconds between progress lines and metrics updates (default: {DEFAULT_INTERVAL:g})")
+    parser.add_argument("--metrics-file", default=option_default(None), metavar="PATH",
+                        help="Write Prometheus metrics to PATH for the node exporter's textfile collector")
+
+
+def options_from_args(args):
+    """Return the ProgressReporter options of parsed arguments, or None if no progress was asked for"""
+    show = getattr(args, "progress", False)
+    metrics_file = getattr(args, "metrics_file", None)
+    if not show and not metrics_file:
+        return None
+    return {
+        "interval": getattr(args, "progress_interval", DEFAULT_INTERVAL),
+        "metrics_file": metrics_file,
+        "print_status": show,
+    }
@@ -0,0 +1,386 @@
+"""
+Machine-readable results of a batch: one row per field
+
+GIS and ERP systems need the values the reports show, not the HTML. With
+``--export csv,jsonl,parquet,xlsx`` the batch writes ``<output>/results.<ext>``
+in every format asked for, one row per field with:
+
+- the field: its name in the sheet, the sanitized name, the report file and,
+  for merged workbooks, the source workbook (see workbooks.py), then the
+  crop, maturity, area, sowing, tillage and irrigation columns page 1 shows
+- for every index page (see index_pages.py): current and old value, change,
+  current and old image date as YYYY-MM-DD, and the advisory
+- the pixel statistics of the batch options that were on: "Imagery ...",
+  "Hotspots ...", "Cohort ..." and "Zones ..." columns, without the image
+  overlays, as snake_case columns (``hotspots_ndvi_current_area``)
+
+The rows are built from the same field records the pages are rendered from,
+as each field's report is written (or found already written on --resume), and
+written straight to the open files, so the workbook isn't read twice and
+memory doesn't grow with the number of fields. Fields whose report failed get
+no row. The xlsx file is written with openpyxl's write-only mode and the
+Parquet file in row groups of ROW_GROUP_SIZE rows; Parquet needs the optional
+``pyarrow`` package (``pip install pyarrow``). The files are written under a
+temporary name and renamed into place when the batch ends; a failed or
+interrupted batch removes them.
+
+Sharded runs write ``results-shard-I-of-N.<ext>``.
+
+Usage:
+    python results.py [--excel demo.xlsx] --export csv,jsonl [--output reports]
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# File formats by name, and the extension each is written with
+FORMATS = {"csv": "csv", "jsonl": "jsonl", "parquet": "parquet", "xlsx": "xlsx"}
+
+# Rows buffered per Parquet row group
+ROW_GROUP_SIZE = 1024
+
+# Field information columns of page 1 and the export column each is written as
+FIELD_COLUMNS = {
+    "crop": "Crop",
+    "maturity": "Maturity",
+    "area": "Area",
+    "sowing": "Sowing / Planting",
+    "tillage": "Tillage type",
+    "irrigation": "Irrigation type",
+}
+
+# Columns of the batch options exported as pixel statistics
+ANALYSIS_PREFIXES = ("Imagery ", "Hotspots ", "Cohort ", "Zones ")
+
+# Analysis columns holding overlays and maps for the pages rather than statistics
+OVERLAY_SUFFIXES = (" outline", " map")
+
+# Type of a column: text, float, int or bool
+TEXT, FLOAT, INT, BOOL = "text", "float", "int", "bool"
+
+
+def export_formats(value):
+    """argparse type for --export: a comma-separated list of FORMATS"""
+    formats = list(dict.fromkeys(part.strip().lower() for part in value.split(",") if part.strip()))
+    unknown = [name for name in formats if name not in FORMATS]
+    if not formats or unknown:
+        raise argparse.ArgumentTypeError(f"expected formats from {', '.join(FORMATS)}, got {value!r}")
+    if "parquet" in formats:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise argparse.ArgumentTypeError("parquet export needs pyarrow (pip install pyarrow)")
+    return formats
+
+
+def results_name(extension, shard=None):
+    """Return the results file name, one per shard so shards can share an output directory"""
+    if shard is None:
+        return f"results.{extension}"
+    return f"results-shard-{shard[0]}-of-{shard[1]}.{extension}"
+
+
+def snake_case(name):
+    """Export column name of a workbook column, e.g. "Hotspots NDVI current area" -> "hotspots_ndvi_current_area" """
+    return re.sub(r"[^0-9a-z]+", "_", str(name).lower()).strip("_")
+
+
+def _kind(dtype):
+    import pandas as pd
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return BOOL
+    if pd.api.types.is_integer_dtype(dtype):
+        return INT
+    if pd.api.types.is_float_dtype(dtype):
+        return FLOAT
+    return TEXT
+
+
+def schema(df):
+    """
+    Columns of the results of a batch, from the columns its rows have
+
+    Args:
+        df (pandas.DataFrame): The rows of the batch, after the batch options added their columns
+
+    Returns:
+        list: (export column, type) pairs in export order
+    """
+    import index_pages
+    import workbooks
+
+    columns = [("field", TEXT), ("name", TEXT), ("report", TEXT)]
+    if workbooks.SOURCE_COLUMN in df.columns:
+        columns.append(("source_workbook", TEXT))
+    columns += [(name, TEXT) for name, column in FIELD_COLUMNS.items() if column in df.columns]
+    for entry in index_pages.INDEX_PAGES:
+        index = entry.index.lower()
+        columns += [(f"{index}_value", FLOAT), (f"{index}_old_value", FLOAT), (f"{index}_change", FLOAT),
+                    (f"{index}_date", TEXT), (f"{index}_old_date", TEXT), (f"{index}_advisory", TEXT)]
+    columns += [(snake_case(column), _kind(df[column].dtype)) for column in df.columns if is_analysis(column)]
+    return columns
+
+
+def is_analysis(column):
+    """True for the columns of the batch options that are exported"""
+    return str(column).startswith(ANALYSIS_PREFIXES) and not str(column).endswith(OVERLAY_SUFFIXES)
+
+
+def _missing(value):
+    import pandas as pd
+
+    return value is None or (pd.api.types.is_scalar(value) and bool(pd.isna(value)))
+
+
+def _number(value):
+    if _missing(value):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _text(value):
+    return None if _missing(value) else str(value).strip()
+
+
+def _date(row, columns):
+    """First of the columns holding a parseable date, as YYYY-MM-DD, with the fallbacks of the index pages"""
+    import pandas as pd
+
+    for column in columns:
+        value = row.get(column)
+        if _missing(value):
+            continue
+        try:
+            return pd.to_datetime(value.strip() if isinstance(value, str) else value).strftime("%Y-%m-%d")
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def _value(value, kind):
+    if _missing(value):
+        return None
+    if kind == FLOAT:
+        return _number(value)
+    if kind == INT:
+        return int(value)
+    if kind == BOOL:
+        return bool(value)
+    return str(value)
+
+
+def field_record(row, field_name, report, columns):
+    """
+    Results row of one field
+
+    Args:
+        row (pandas.Series): The row data for the field, as the pages are rendered from
+        field_name (str): Sanitized name of the field
+        report (str): File name of the field's report
+        columns (list): The schema of the batch
+
+    Returns:
+        list: Values in the order of the schema, None where there is none
+    """
+    import index_pages
+    import workbooks
+
+    values = {"field": _text(row.get("Field")) or field_name, "name": field_name, "report": report,
+              "source_workbook": _text(row.get(workbooks.SOURCE_COLUMN))}
+    for name, column in FIELD_COLUMNS.items():
+        values[name] = _text(row.get(column))
+    for entry in index_pages.INDEX_PAGES:
+        index = entry.index.lower()
+        value = _number(row.get(entry.value_column))
+        old_value = _number(row.get(entry.old_value_column))
+        change = _number(row.get(f"{entry.index} change"))
+        if change is None and value is not None and old_value is not None:
+            change = round(value - old_value, 4)
+        values[f"{index}_value"] = value
+        values[f"{index}_old_value"] = old_value
+        values[f"{index}_change"] = change
+        values[f"{index}_date"] = _date(row, [entry.image_column] + index_pages.CURRENT_DATE_FALLBACKS)
+        values[f"{index}_old_date"] = _date(row, [entry.old_image_column] + index_pages.OLD_DATE_FALLBACKS)
+        values[f"{index}_advisory"] = _text(row.get(entry.advisory_column))
+    for column, value in row.items():
+        if is_analysis(column):
+            values[snake_case(column)] = value
+    return [_value(values.get(name), kind) for name, kind in columns]
+
+
+class _CsvWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, record):
+        self._writer.writerow(["" if value is None else value for value in record])
+
+    def close(self):
+        self._file.close()
+
+
+class _JsonLinesWriter:
+    def __init__(self, path, columns):
+        self._file = open(path, "w", encoding="utf-8")
+        self._names = [name for name, _ in columns]
+
+    def write(self, record):
+        self._file.write(json.dumps(dict(zip(self._names, record)), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path, columns):
+        import openpyxl
+
+        self._path = path
+        # Write-only mode streams the rows to a temporary file instead of keeping the sheet in memory
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Results")
+        self._sheet.append([name for name, _ in columns])
+
+    def write(self, record):
+        self._sheet.append(record)
+
+    def close(self):
+        self._workbook.save(self._path)
+
+
+class _ParquetWriter:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {TEXT: pa.string(), FLOAT: pa.float64(), INT: pa.int64(), BOOL: pa.bool_()}
+        self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows = []
+
+    def _flush(self):
+        import pyarrow as pa
+
+        if self._rows:
+            columns = list(zip(*self._rows))
+            self._writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+                schema=self._schema))
+            self._rows = []
+
+    def write(self, record):
+        self._rows.append(record)
+        if len(self._rows) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {"csv": _CsvWriter, "jsonl": _JsonLinesWriter, "parquet": _ParquetWriter, "xlsx": _XlsxWriter}
+
+
+class ResultsExport:
+    """
+    Results files of a batch, written a field at a time
+
+    Args:
+        output_directory (str): Directory the results files are written to
+        formats (list): Names of FORMATS to write
+        df (pandas.DataFrame): The rows of the batch, for the schema
+        shard (tuple): (shard number, shard count) of a sharded run
+    """
+
+    def __init__(self, output_directory, formats, df, shard=None):
+        os.makedirs(output_directory, exist_ok=True)
+        self.columns = schema(df)
+        self.paths = [os.path.join(output_directory, results_name(FORMATS[name], shard)) for name in formats]
+        self.count = 0
+        self._writers = []
+        try:
+            for name, path in zip(formats, self.paths):
+                self._writers.append((WRITERS[name](self._temp_path(path), self.columns), path))
+        except Exception:
+            self.close(keep=False)
+            raise
+
+    @staticmethod
+    def _temp_path(path):
+        # The extension stays last, so openpyxl accepts the name
+        root, extension = os.path.splitext(path)
+        return f"{root}.{os.getpid()}.tmp{extension}"
+
+    def add(self, row, field_name, report):
+        """Write the results row of a field to every file"""
+        record = field_record(row, field_name, report, self.columns)
+        for writer, _ in self._writers:
+            writer.write(record)
+        self.count += 1
+
+    def close(self, keep=True):
+        """Finish the files and rename them into place, or remove them when keep is False"""
+        for writer, path in self._writers:
+            temp_path = self._temp_path(path)
+            writer.close()
+            if keep:
+                os.replace(temp_path, path)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+        if keep and self._writers:
+            logger.info("Results of %d fields written: %s", self.count, ", ".join(self.paths))
+        self._writers = []
+
+
+def open_export(output_directory, formats, df, shard=None):
+    """ResultsExport for the formats, None when there are none"""
+    if not formats:
+        return None
+    return ResultsExport(output_directory, formats, df, shard)
+
+
+def add_argument(parser, default=None):
+    """Add --export to an argparse parser"""
+    parser.add_argument("--export", type=export_formats, default=default, metavar="FORMATS",
+                        help=f"Also write the values, dates, advisories and statistics of every field to "
+                             f"<output>/results.<ext>; comma-separated formats from {', '.join(FORMATS)}")
+
+
+def main(argv=None):
+    import generate_report
+    import logs
+
+    parser = argparse.ArgumentParser(description="Export the values, dates and advisories of every field")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default="reports", help="Directory to write the results to (default: reports)")
+    add_argument(parser, default=["csv"])
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df, _ = generate_report.read_selected_fields(args.excel)
+    if df is None:
+        logger.warning("No fields found in %s", args.excel)
+        return
+    export = ResultsExport(args.output, args.export, df)
+    for index, row in df.iterrows():
+        field_name = generate_report.sanitize_field_name(row, index)
+        export.add(row, field_name, f"full_report_{field_name}.html")
+    export.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Deterministic sharding of a batch across machines
+
+Every machine runs the same batch with ``--shard I/N`` (1-based) against a
+shared output directory. A field belongs to the shard picked by a stable hash
+of its sanitized name, so the shards never need to talk to each other. Each
+shard writes ``manifest-shard-I-of-N.json`` next to its reports, and
+``generate_report.py merge`` combines the shard manifests into one
+``manifest.json`` after checking that together they cover every field exactly
+once.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timezone
+
+from journal import write_json_atomic
+from workbooks import workbook_sha256
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# Name of the merged manifest written by merge_manifests
+MERGED_MANIFEST = "manifest.json"
+
+
+def parse_shard(spec):
+    """
+    Parse a shard specification of the form "I/N"
+
+    Args:
+        spec (str): Shard number and shard count, e.g. "2/8"
+
+    Returns:
+        tuple: (shard number, shard count), with 1 <= shard number <= shard count
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected I/N such as 1/4")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{spec}', I must be between 1 and N")
+    return index, count
+
+
+def shard_of(field_name, count):
+    """
+    Return the 1-based shard a field belongs to
+
+    The shard depends only on the sanitized field name and the shard count, so
+    every machine computes the same assignment without coordination.
+
+    Args:
+        field_name (str): Sanitized field name
+        count (int): Number of shards
+    """
+    digest = hashlib.sha1(field_name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def manifest_name(index, count):
+    return f"manifest-shard-{index}-of-{count}.json"
+
+
+def write_shard_manifest(output_directory, shard, excel_file, total_fields, entries, fields=None):
+    """
+    Write the manifest of one shard into the shared output directory
+
+    Args:
+        output_directory (str): Directory where the reports were saved
+        shard (tuple): (shard number, shard count)
+        excel_file (str): Path to the Excel file with crop data
+        total_fields (int): Number of fields in the batch across all shards
+        entries (list): One dict per field of this shard with field, name, report and status
+        fields (list): Field patterns the batch was restricted to, if any
+
+    Returns:
+        str: Path of the manifest
+    """
+    index, count = shard
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "shard": index,
+        "shards": count,
+        "workbook": {
+            "name": os.path.basename(excel_file),
+            "sha256": workbook_sha256(excel_file),
+            "fields": total_fields,
+        },
+        "selection": sorted(fields) if fields else None,
+        "host": socket.gethostname(),
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "fields": entries,
+    }
+    path = os.path.join(output_directory, manifest_name(index, count))
+    write_json_atomic(path, manifest)
+    logger.info("Shard manifest written: %s", path)
+    return path
+
+
+def merge_manifests(output_directory):
+    """
+    Combine the shard manifests in a directory into one manifest and verify coverage
+
+    The shards must come from the same workbook, shard count and field selection;
+    every shard must be present, no field may appear in more than one shard or on
+    the wrong shard, no field may have failed, and together they must cover every
+    field of the batch.
+
+    Args:
+        output_directory (str): Shared directory holding the shard manifests
+
+    Returns:
+        tuple: (path of the merged manifest or None, list of problems found)
+    """
+    paths = sorted(name for name in os.listdir(output_directory)
+                   if name.startswith("manifest-shard-") and name.endswith(".json"))
+    if not paths:
+        return None, [f"No shard manifests found in {output_directory}"]
+
+    manifests = []
+    problems = []
+    for name in paths:
+        with open(os.path.join(output_directory, name), encoding="utf-8") as f:
+            manifests.append((name, json.load(f)))
+
+    first = manifests[0][1]
+    count = first["shards"]
+    for name, manifest in manifests:
+        for key, label in (("shards", "shard count"), ("selection", "field selection")):
+            if manifest[key] != first[key]:
+                problems.append(f"{name} has a different {label} ({manifest[key]} vs {first[key]})")
+        if manifest["workbook"] != first["workbook"]:
+            problems.append(f"{name} was generated from a different workbook")
+
+    # Every shard exactly once
+    seen = {}
+    for name, manifest in manifests:
+        seen.setdefault(manifest["shard"], []).append(name)
+    for index in range(1, count + 1):
+        if index not in seen:
+            problems.append(f"Shard {index}/{count} has no manifest")
+        elif len(seen[index]) > 1:
+            problems.append(f"Shard {index}/{count} has several manifests: {', '.join(seen[index])}")
+
+    # Every field on its own shard, exactly once, and rendered
+    owners = {}
+    merged_fields = []
+    for name, manifest in manifests:
+        for entry in manifest["fields"]:
+            expected = shard_of(entry["name"], count)
+            if expected != manifest["shard"]:
+                problems.append(f"{entry['name']} is in shard {manifest['shard']} but belongs to shard {expected}")
+            if entry["name"] in owners and owners[entry["name"]] != manifest["shard"]:
+                problems.append(f"{entry['name']} appears in shards {owners[entry['name']]} and {manifest['shard']}")
+            owners.setdefault(entry["name"], manifest["shard"])
+            if entry["status"] != "ok":
+                problems.append(f"{entry['name']} failed in shard {manifest['shard']}")
+            merged_fields.append(dict(entry, shard=manifest["shard"]))
+
+    total = first["workbook"]["fields"]
+    if len(merged_fields) != total:
+        problems.append(f"Shards cover {len(merged_fields)} fields but the batch has {total}")
+
+    merged = {
+        "version": MANIFEST_VERSION,
+        "shards": count,
+        "workbook": first["workbook"],
+        "selection": first["selection"],
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "complete": not problems,
+        "problems": problems,
+        "fields": sorted(merged_fields, key=lambda entry: entry["name"]),
+    }
+    path = os.path.join(output_directory, MERGED_MANIFEST)
+    write_json_atomic(path, merged)
+    return path, problems
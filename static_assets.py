@@ -0,0 +1,136 @@
+"""
+Content-hashed static assets for long-lived browser caching
+
+By default every report inlines its stylesheet and PDF download script and
+links the logos and farmland picture in assest/ by plain name, so nothing can
+be cached for long. ``--hashed-assets`` instead copies the shared files into
+``static/`` under names carrying a hash of their content, and the reports link
+those:
+
+    assest/sidralogo.png  ->  static/sidralogo.3e04194a48d6.png
+    report stylesheet     ->  static/report.7fb5572a2c36.css
+    PDF download script   ->  static/report.e99f770f44e2.js
+
+A hashed file never changes, so browsers and CDNs can cache it forever
+(``Cache-Control: immutable``) and fetch it once however many reports link it;
+a changed asset gets a new name. ``static/manifest.json`` maps each source to
+its hashed name:
+
+    {"version": 1, "assets": {"assest/sidralogo.png": "sidralogo.3e04194a48d6.png",
+                              "report.css": "report.7fb5572a2c36.css", ...}}
+
+Older hashed files are kept, so reports written by an earlier build keep working.
+
+Usage:
+    python static_assets.py [--static-dir static]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import textwrap
+
+import journal
+
+MANIFEST_VERSION = 1
+
+# Shared directory of the hashed files, next to assest/, images/ and reports/
+STATIC_DIR = "static"
+MANIFEST = "manifest.json"
+
+# Directory of the source assets
+ASSET_DIR = "assest"
+
+# Manifest keys of the report stylesheet and script
+REPORT_CSS = "report.css"
+REPORT_JS = "report.js"
+
+# Characters of the SHA-256 kept in a hashed name
+HASH_LENGTH = 12
+
+# src/href attributes pointing at assest/ from the reports directory; one template
+# has a stray space after the file name
+ASSET_REFERENCE = re.compile(r'(src|href)="\.\./assest/([^"/]+?)\s*"')
+
+
+def hashed_name(name, data):
+    """Return name with a hash of data inserted before the extension, e.g. logo.4f1c2a9be03d.png"""
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}"
+
+
+def _sources():
+    """Yield (manifest key, file name, content) for every file to fingerprint"""
+    import generate_report
+
+    for name in sorted(os.listdir(ASSET_DIR)):
+        path = os.path.join(ASSET_DIR, name)
+        if os.path.isfile(path) and not name.startswith("."):
+            with open(path, "rb") as f:
+                yield f"{ASSET_DIR}/{name}", name, f.read()
+    yield REPORT_CSS, REPORT_CSS, textwrap.dedent(generate_report.REPORT_CSS).strip().encode("utf-8") + b"\n"
+    yield REPORT_JS, REPORT_JS, textwrap.dedent(generate_report.REPORT_JS).strip().encode("utf-8") + b"\n"
+
+
+def build(static_dir=STATIC_DIR):
+    """
+    Write the hashed copy of every shared asset and the manifest
+
+    Files already there are left alone, so a build with no changes writes nothing.
+
+    Args:
+        static_dir (str): Directory for the hashed files
+
+    Returns:
+        dict: Manifest key mapped to the hashed file name
+    """
+    os.makedirs(static_dir, exist_ok=True)
+    assets = {}
+    for key, name, data in _sources():
+        hashed = hashed_name(name, data)
+        path = os.path.join(static_dir, hashed)
+        if not os.path.exists(path):
+            journal.write_bytes_atomic(path, data)
+        assets[key] = hashed
+
+    manifest = {"version": MANIFEST_VERSION, "assets": assets}
+    if read_manifest(static_dir) != assets:
+        journal.write_json_atomic(os.path.join(static_dir, MANIFEST), manifest)
+    return assets
+
+
+def read_manifest(static_dir=STATIC_DIR):
+    """Return the assets of the manifest in static_dir, or None if there is no usable manifest"""
+    try:
+        with open(os.path.join(static_dir, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest.get("assets")
+
+
+def url(assets, key):
+    """Return the link to a hashed asset from the reports directory"""
+    return f"../{STATIC_DIR}/{assets[key]}"
+
+
+def rewrite(html, assets):
+    """Point the assest/ references of a report at the hashed copies in static/"""
+    def replace(match):
+        key = f"{ASSET_DIR}/{match.group(2)}"
+        if key not in assets:
+            return match.group(0)
+        return f'{match.group(1)}="{url(assets, key)}"'
+
+    return ASSET_REFERENCE.sub(replace, html)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy the shared report assets into content-hashed files")
+    parser.add_argument("--static-dir", default=STATIC_DIR, help="Directory for the hashed files (default: static)")
+    args = parser.parse_args()
+    for key, hashed in build(args.static_dir).items():
+        print(f"{key:<28} -> {os.path.join(args.static_dir, hashed)}")
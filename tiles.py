@@ -0,0 +1,385 @@
+"""
+Deep-zoom tile pyramids of the index maps
+
+Pages 2-6 show every index map as a 220px image, so the detail of a large
+field is lost, and embedding the full-resolution image would make the reports
+enormous. With ``--tiles`` every index image of the batch is cut into a tile
+pyramid before rendering starts:
+
+    static/tiles/<hash>/pyramid.json       sizes of the levels
+    static/tiles/<hash>/0/0_0.png          level 0: the whole image in one tile
+    static/tiles/<hash>/1/0_0.png ...      every level twice the size of the one before
+    static/tiles/<hash>/<top>/<col>_<row>.png   the full-resolution image in TILE_SIZE tiles
+
+A pyramid is named after a hash of the image's content, so it is written once
+and shared by every field, report and later batch with the same image; a
+pyramid is built in a temporary directory and renamed into place, so a crashed
+or concurrent build never leaves half a pyramid behind. Missing pyramids are
+built in a process pool.
+
+The index images of the report get a ``data-tiles`` link to their pyramid and
+the report a small viewer (VIEWER): clicking an image opens it full screen,
+where scrolling zooms and dragging pans, and only the tiles of the visible
+part at the level matching the zoom are fetched. The 220px images in the
+report, and its size, stay as they are.
+
+Usage:
+    python tiles.py IMAGE [IMAGE ...] [--tiles-dir static/tiles]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import static_assets
+
+logger = logging.getLogger(__name__)
+
+PYRAMID_VERSION = 1
+
+# Shared directory of the pyramids, inside the directory of the hashed static assets
+TILES_DIR = os.path.join(static_assets.STATIC_DIR, "tiles")
+
+# Side of a tile in pixels; the lowest level fits in a single tile
+TILE_SIZE = 256
+
+# Descriptor of a pyramid, written last
+DESCRIPTOR = "pyramid.json"
+
+# Characters of the SHA-256 of the image kept in a pyramid's name
+HASH_LENGTH = 16
+
+# Viewer added to reports with tiles: full-screen, wheel zoom, drag pan, visible tiles only
+VIEWER = """
+<style>
+    img[data-tiles] { cursor: zoom-in; }
+    .tile-viewer { position: fixed; inset: 0; z-index: 100; display: flex; flex-direction: column; background: rgba(17, 24, 39, 0.92); }
+    .tile-viewer-bar { display: flex; justify-content: space-between; align-items: center; padding: 8px 16px; color: #fff; font: 14px sans-serif; }
+    .tile-viewer-bar button { color: #fff; font-size: 24px; line-height: 1; background: none; border: 0; cursor: pointer; }
+    .tile-viewer-view { position: relative; flex: 1; overflow: hidden; cursor: grab; touch-action: none; }
+    .tile-viewer-view img { position: absolute; image-rendering: pixelated; user-select: none; -webkit-user-drag: none; }
+</style>
+<script>
+(function () {
+    function show(base, pyramid, title) {
+        var overlay = document.createElement('div');
+        overlay.className = 'tile-viewer';
+        overlay.innerHTML = '<div class="tile-viewer-bar"><span></span><button type="button" title="Close">&times;</button></div>'
+            + '<div class="tile-viewer-view"></div>';
+        overlay.querySelector('span').textContent = title + ' - scroll to zoom, drag to pan';
+        document.body.appendChild(overlay);
+        var view = overlay.querySelector('.tile-viewer-view');
+        var levels = pyramid.levels, size = pyramid.tile_size, full = levels[levels.length - 1];
+        var scale = Math.min(view.clientWidth / full.width, view.clientHeight / full.height);
+        var x = (view.clientWidth - full.width * scale) / 2, y = (view.clientHeight - full.height * scale) / 2;
+        var shown = {};
+
+        function draw() {
+            var number = levels.length - 1;
+            while (number > 0 && levels[number - 1].width >= full.width * scale) number--;
+            var level = levels[number], k = full.width * scale / level.width, step = size * k;
+            var wanted = {};
+            var c0 = Math.max(0, Math.floor(-x / step)), c1 = Math.min(level.columns - 1, Math.floor((view.clientWidth - x) / step));
+            var r0 = Math.max(0, Math.floor(-y / step)), r1 = Math.min(level.rows - 1, Math.floor((view.clientHeight - y) / step));
+            for (var r = r0; r <= r1; r++) {
+                for (var c = c0; c <= c1; c++) {
+                    var key = number + '/' + c + '_' + r;
+                    var tile = shown[key];
+                    if (!tile) {
+                        tile = shown[key] = document.createElement('img');
+                        tile.src = base + key + '.' + pyramid.format;
+                        tile.alt = '';
+                        tile.draggable = false;
+                        view.appendChild(tile);
+                    }
+                    wanted[key] = true;
+                    tile.style.left = (x + c * step) + 'px';
+                    tile.style.top = (y + r * step) + 'px';
+                    tile.style.width = Math.min(size, level.width - c * size) * k + 'px';
+                    tile.style.height = Math.min(size, level.height - r * size) * k + 'px';
+                }
+            }
+            for (var name in shown) {
+                if (!wanted[name]) {
+                    view.removeChild(shown[name]);
+                    delete shown[name];
+                }
+            }
+        }
+
+        function close() {
+            document.removeEventListener('keydown', onKey);
+            document.body.removeChild(overlay);
+        }
+
+        function onKey(event) {
+            if (event.key === 'Escape') close();
+        }
+
+        view.addEventListener('wheel', function (event) {
+            event.preventDefault();
+            var rect = view.getBoundingClientRect(), px = event.clientX - rect.left, py = event.clientY - rect.top;
+            var factor = Math.exp(-event.deltaY * 0.002);
+            var limit = Math.min(view.clientWidth / full.width, view.clientHeight / full.height);
+            factor = Math.max(limit / 2, Math.min(16, scale * factor)) / scale;
+            x = px - (px - x) * factor;
+            y = py - (py - y) * factor;
+            scale *= factor;
+            draw();
+        }, { passive: false });
+        view.addEventListener('pointerdown', function (event) {
+            var startX = event.clientX - x, startY = event.clientY - y;
+            view.setPointerCapture(event.pointerId);
+            function move(e) {
+                x = e.clientX - startX;
+                y = e.clientY - startY;
+                draw();
+            }
+            function up() {
+                view.removeEventListener('pointermove', move);
+                view.removeEventListener('pointerup', up);
+            }
+            view.addEventListener('pointermove', move);
+            view.addEventListener('pointerup', up);
+        });
+        overlay.querySelector('button').addEventListener('click', close);
+        document.addEventListener('keydown', onKey);
+        draw();
+    }
+
+    document.addEventListener('click', function (event) {
+        var image = event.target.closest && event.target.closest('img[data-tiles]');
+        if (!image) return;
+        var base = image.getAttribute('data-tiles');
+        fetch(base + 'pyramid.json')
+            .then(function (response) { return response.json(); })
+            .then(function (pyramid) { show(base, pyramid, image.alt); })
+            .catch(function (error) { console.error('Tile pyramid failed to load:', error); });
+    });
+})();
+</script>
+"""
+
+
+def content_hash(data):
+    """Name of the pyramid of an image's bytes"""
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def url(digest):
+    """Link to a pyramid's directory from the reports directory"""
+    return f"../{TILES_DIR.replace(os.sep, '/')}/{digest}/"
+
+
+def has_pyramid(digest, tiles_dir=TILES_DIR):
+    return os.path.exists(os.path.join(tiles_dir, digest, DESCRIPTOR))
+
+
+def build_pyramid(data, tiles_dir=TILES_DIR):
+    """
+    Cut an image into a tile pyramid, unless its pyramid already exists
+
+    Args:
+        data (bytes): Raw image bytes
+        tiles_dir (str): Directory of the pyramids
+
+    Returns:
+        str: Name of the pyramid (content_hash of data)
+    """
+    from PIL import Image
+
+    digest = content_hash(data)
+    directory = os.path.join(tiles_dir, digest)
+    if has_pyramid(digest, tiles_dir):
+        return digest
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert("RGBA") if source.mode not in ("RGB", "RGBA", "L", "LA") else source.copy()
+
+    # Halve the full-resolution image until it fits in a single tile
+    images = [image]
+    while max(images[-1].size) > TILE_SIZE:
+        images.append(images[-1].reduce(2))
+    images.reverse()
+
+    os.makedirs(tiles_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f".{digest}.", dir=tiles_dir)
+    try:
+        levels = []
+        for number, level_image in enumerate(images):
+            width, height = level_image.size
+            columns, rows = -(-width // TILE_SIZE), -(-height // TILE_SIZE)
+            os.makedirs(os.path.join(temp_dir, str(number)))
+            for row in range(rows):
+                for column in range(columns):
+                    box = (column * TILE_SIZE, row * TILE_SIZE,
+                           min(width, (column + 1) * TILE_SIZE), min(height, (row + 1) * TILE_SIZE))
+                    level_image.crop(box).save(os.path.join(temp_dir, str(number), f"{column}_{row}.png"), "PNG")
+            levels.append({"width": width, "height": height, "columns": columns, "rows": rows})
+        descriptor = {"version": PYRAMID_VERSION, "tile_size": TILE_SIZE, "format": "png", "levels": levels}
+        with open(os.path.join(temp_dir, DESCRIPTOR), "w", encoding="utf-8") as f:
+            json.dump(descriptor, f)
+        try:
+            os.rename(temp_dir, directory)
+        except OSError:
+            # Another worker built the same pyramid first
+            if not has_pyramid(digest, tiles_dir):
+                raise
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return digest
+
+
+def build_pyramids(images, tiles_dir=TILES_DIR, workers=None):
+    """
+    Build the missing pyramids of many images, in a process pool when there are several
+
+    Args:
+        images (dict): content_hash mapped to the raw image bytes
+        tiles_dir (str): Directory of the pyramids
+        workers (int): Processes to build in, default the CPU count
+
+    Returns:
+        int: Number of pyramids built
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    missing = [data for digest, data in images.items() if not has_pyramid(digest, tiles_dir)]
+    if len(missing) <= 1:
+        for data in missing:
+            build_pyramid(data, tiles_dir)
+        return len(missing)
+    with ProcessPoolExecutor(max_workers=min(len(missing), workers or os.cpu_count() or 1)) as pool:
+        list(pool.map(build_pyramid, missing, [tiles_dir] * len(missing)))
+    return len(missing)
+
+
+def apply_tiles(df, field_images, tiles_dir=TILES_DIR):
+    """
+    Build the pyramids of every index image of the batch and add their names to the rows
+
+    Old images imagery.py found to be the same as the current ones get no pyramid of
+    their own; the page shows the current image, and its pyramid, in both places.
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        field_images (list): Each row's {image file name: raw bytes}, in the order of df
+
+    Returns:
+        tuple: (copy of df with the "Tiles <INDEX> <current|old>" columns, number of pyramids
+            in the batch, number of them built)
+    """
+    import advisory
+    import imagery
+
+    images = {}
+    df = df.copy()
+    for index in advisory.INDICES:
+        stale = imagery.stale_mask(df, index)
+        for slot in imagery.SLOTS:
+            name = imagery.image_file(index, slot)
+            digests = []
+            for position, row_images in enumerate(field_images):
+                data = row_images.get(name)
+                if data is None or (slot == "old" and stale[position]):
+                    digests.append(None)
+                    continue
+                digest = content_hash(data)
+                images.setdefault(digest, data)
+                digests.append(digest)
+            df[f"Tiles {index} {slot}"] = digests
+    built = build_pyramids(images, tiles_dir)
+    return df, len(images), built
+
+
+def apply_and_build(df, field_images, tiles_dir=TILES_DIR):
+    """apply_tiles, logging how many pyramids were built and how many were already there"""
+    try:
+        df, total, built = apply_tiles(df, field_images, tiles_dir)
+    except Exception as e:
+        # Reports without tiles are still reports; the images just can't be zoomed into
+        logger.error("Error building tile pyramids: %s", e)
+        return df
+    logger.info("Tile pyramids: %d images, %d built, %d already in %s", total, built, total - built, tiles_dir)
+    return df
+
+
+def image_tiles(row):
+    """
+    Pyramids of the images of a row
+
+    Args:
+        row (pandas.Series): Row with the columns of apply_tiles
+
+    Returns:
+        dict: Image file name mapped to the name of its pyramid, empty without tiles
+    """
+    import advisory
+    import imagery
+
+    found = {}
+    for index in advisory.INDICES:
+        for slot in imagery.SLOTS:
+            digest = row.get(f"Tiles {index} {slot}")
+            if isinstance(digest, str):
+                found[imagery.image_file(index, slot)] = digest
+    return found
+
+
+def add_viewer(html, field_name, found):
+    """
+    Link the index images of a full report to their pyramids and add the viewer
+
+    Args:
+        html (str): Combined report HTML
+        field_name (str): Sanitized name of the field, as in the image paths
+        found (dict): Image file name mapped to pyramid name, from image_tiles
+    """
+    if not found:
+        return html
+    for image_file, digest in found.items():
+        source = f'src="../images/{field_name}/{image_file}"'
+        html = html.replace(source, f'{source} data-tiles="{url(digest)}"')
+    return html.replace("</body>", VIEWER + "</body>", 1)
+
+
+def pyramid_files(digest, tiles_dir=TILES_DIR):
+    """Yield (path relative to tiles_dir with "/" separators, content) of every file of a pyramid"""
+    directory = os.path.join(tiles_dir, digest)
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                yield os.path.relpath(path, tiles_dir).replace(os.sep, "/"), f.read()
+
+
+def add_argument(parser, default=False):
+    """Add --tiles to an argparse parser"""
+    parser.add_argument("--tiles", action="store_true", default=default,
+                        help=f"Cut the index images into deep-zoom tile pyramids in {TILES_DIR}/ and let the "
+                             f"reports zoom into them")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cut images into deep-zoom tile pyramids")
+    parser.add_argument("images", nargs="+", help="Image files")
+    parser.add_argument("--tiles-dir", default=TILES_DIR, help=f"Directory of the pyramids (default: {TILES_DIR})")
+    args = parser.parse_args(argv)
+
+    for path in args.images:
+        with open(path, "rb") as f:
+            digest = build_pyramid(f.read(), args.tiles_dir)
+        with open(os.path.join(args.tiles_dir, digest, DESCRIPTOR), encoding="utf-8") as f:
+            levels = json.load(f)["levels"]
+        print(f"{path} -> {os.path.join(args.tiles_dir, digest)} ({len(levels)} levels, "
+              f"{sum(level['columns'] * level['rows'] for level in levels)} tiles)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Pre-flight validation of the workbook before a batch starts
+
+A missing or misnamed column, a date that doesn't parse or an index value out
+of range otherwise only shows up as a per-page "Error getting ..." print and an
+"N/A" in the report, after the batch has spent its time rendering. With
+``--validate`` the rows of the batch are checked before anything is rendered:
+
+- schema: every column the pages read is there; a misnamed one is reported
+  with the closest header of the sheet ("Old NDVI Value" -> "Old NDVI value")
+- dates: every image date parses, and each index has a current and old date
+  after the same fallbacks the pages use (CURRENT_DATE_FALLBACKS)
+- values: current and old index values are numbers inside the index's range
+  (VALUE_RANGES), and every advisory has text
+- images: every image column has a picture anchored in the field's row; the
+  anchors are read from the drawing parts without decompressing any image
+
+Each check is done column by column over all rows at once. Problems are
+printed as a summary and written to ``<output>/validation.csv``, one line per
+bad cell (sheet row, field, column, severity, problem). Errors are problems
+that make a page show N/A or "nan"; warnings are handled by a fallback, such as
+the default image for a missing picture. With ``--strict`` the batch aborts
+before rendering when there is any error.
+
+Usage:
+    python validation.py [--excel demo.xlsx] [--output validation.csv] [--strict]
+"""
+import argparse
+import csv
+import difflib
+import logging
+import os
+from collections import namedtuple
+
+import advisory
+import journal
+import logs
+import workbooks
+
+logger = logging.getLogger(__name__)
+
+# Name of the report in the output directory
+REPORT = "validation.csv"
+
+ERROR = "error"
+WARNING = "warning"
+
+# Plausible range of each index; NDVI-like indices are normalized differences,
+# RECI (NIR / red edge - 1) is a ratio without an upper bound in theory
+VALUE_RANGES = {
+    "NDVI": (-1.0, 1.0),
+    "NDMI": (-1.0, 1.0),
+    "RECI": (-1.0, 20.0),
+    "MSAVI": (-1.0, 1.0),
+    "NDRE": (-1.0, 1.0),
+}
+
+# Columns without which a page shows N/A, and columns that only feed a fallback or page 1
+REQUIRED_COLUMNS = ["Field"] + [
+    column
+    for index in advisory.INDICES
+    for column in (f"{index} value", f"Old {index} value", f"{index} Image date", f"Old {index} Image date",
+                   f"{index} ADVISORY")
+]
+OPTIONAL_COLUMNS = ["Crop", "Maturity", "Area", "Language", "Old Date", "Current  image"] + [
+    f"{index} change" for index in advisory.INDICES
+]
+
+# Columns each page falls back to, in order, when an index's own image date is empty
+CURRENT_DATE_FALLBACKS = {index: ["NDMI Image date", "Current  image"] for index in advisory.INDICES if index != "NDMI"}
+OLD_DATE_FALLBACKS = {index: ["Old Date"] for index in advisory.INDICES if index != "NDMI"}
+
+# Most rows listed for each problem in the printed summary; the CSV has them all
+SUMMARY_ROWS = 5
+
+Problem = namedtuple("Problem", ["row", "field", "column", "severity", "message"])
+
+
+def _blank(df, column):
+    """True where a cell is empty, "-" or "nan" """
+    import numpy as np
+
+    missing = df[column].isna().to_numpy().copy()
+    entered = np.flatnonzero(~missing)
+    missing[entered] = [str(value).strip() in ("", "-", "nan") for value in df[column].to_numpy(dtype=object)[entered]]
+    return missing
+
+
+class Validator:
+    """
+    Collects the problems of the rows of a batch
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        sheet_rows (list): Worksheet row of every row of df, None if unknown
+    """
+
+    def __init__(self, df, sheet_rows=None):
+        self.df = df
+        self.sheet_rows = sheet_rows if sheet_rows is not None else [None] * len(df)
+        if "Field" in df.columns:
+            self.fields = ["" if value is None else str(value).strip()
+                           for value in df["Field"].astype(object).where(df["Field"].notna(), None)]
+        else:
+            self.fields = [""] * len(df)
+        self.problems = []
+
+    def add(self, mask, column, severity, message):
+        """Record a problem for every row where mask is True; message may be a function of the row position"""
+        import numpy as np
+
+        for position in np.flatnonzero(mask):
+            text = message(position) if callable(message) else message
+            self.problems.append(Problem(self.sheet_rows[position], self.fields[position], column, severity, text))
+
+    def check_schema(self):
+        """Report the missing columns, suggesting the closest unused header of the sheet"""
+        headers = [str(column) for column in self.df.columns]
+        expected = set(REQUIRED_COLUMNS) | set(OPTIONAL_COLUMNS)
+        unused = [header for header in headers if header not in expected]
+        normalized = {" ".join(header.split()).lower(): header for header in unused}
+        for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+            if column in self.df.columns:
+                continue
+            severity = ERROR if column in REQUIRED_COLUMNS else WARNING
+            match = normalized.get(" ".join(column.split()).lower()) \
+                or next(iter(difflib.get_close_matches(column, unused, n=1, cutoff=0.8)), None)
+            hint = f"; did you mean {match!r}?" if match else ""
+            self.problems.append(Problem(None, "", column, severity, f"column is missing{hint}"))
+
+    def check_fields(self):
+        if "Field" in self.df.columns:
+            self.add(_blank(self.df, "Field"), "Field", ERROR, "field name is empty")
+
+    def check_values(self):
+        """Current and old index values must be numbers in range; changes only warn"""
+        import numpy as np
+        import pandas as pd
+
+        for index in advisory.INDICES:
+            low, high = VALUE_RANGES[index]
+            for column, severity in ((f"{index} value", ERROR), (f"Old {index} value", ERROR),
+                                     (f"{index} change", WARNING)):
+                if column not in self.df.columns:
+                    continue
+                raw = self.df[column]
+                numbers = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=float)
+                blank = _blank(self.df, column)
+                not_number = np.isnan(numbers) & ~blank
+                self.add(blank & (severity == ERROR), column, severity, "value is missing")
+                self.add(not_number, column, severity,
+                         lambda position, raw=raw: f"{str(raw.iloc[position]).strip()!r} is not a number")
+                if column.endswith(" change"):
+                    bound = high - low
+                    out = np.abs(numbers) > bound
+                    text = f"outside the possible change of {index} (±{bound:g})"
+                else:
+                    out = (numbers < low) | (numbers > high)
+                    text = f"outside the range of {index} ({low:g} to {high:g})"
+                self.add(out, column, severity, lambda position, numbers=numbers, text=text: f"{numbers[position]:g} is {text}")
+            column = f"{index} ADVISORY"
+            if column in self.df.columns:
+                self.add(_blank(self.df, column), column, ERROR, "advisory is empty")
+
+    def check_dates(self):
+        """Every date must parse, and each index needs a current and old date after the page fallbacks"""
+        import numpy as np
+
+        parsed = {}
+        empty = {}
+        date_columns = [f"{prefix}{index} Image date" for index in advisory.INDICES for prefix in ("", "Old ")]
+        for column in date_columns + ["Old Date", "Current  image"]:
+            if column not in self.df.columns:
+                continue
+            # Dates repeat across fields, so each distinct text is only parsed once
+            dates = advisory.map_unique(self.df[column], advisory.parse_date)
+            blank = _blank(self.df, column)
+            raw = self.df[column]
+            self.add((dates == None) & ~blank, column, ERROR,  # noqa: E711 - elementwise comparison
+                     lambda position, raw=raw: f"{str(raw.iloc[position]).strip()!r} is not a date")
+            parsed[column] = dates != None  # noqa: E711
+            empty[column] = raw.isna().to_numpy()
+
+        none = np.zeros(len(self.df), dtype=bool)
+        for index in advisory.INDICES:
+            for column, fallbacks, text in ((f"{index} Image date", CURRENT_DATE_FALLBACKS, "current"),
+                                            (f"Old {index} Image date", OLD_DATE_FALLBACKS, "old")):
+                # A page only moves on to the next column when a cell is empty, not when it doesn't parse
+                has_date = none
+                for name in reversed([column] + fallbacks.get(index, [])):
+                    has_date = parsed.get(name, none) | (empty.get(name, none) & has_date)
+                self.add(~has_date, column, ERROR, f"no {text} image date, the page shows N/A")
+
+    def check_images(self, anchors):
+        """
+        Report the image columns without a picture in a field's row
+
+        Args:
+            anchors (dict): Worksheet row mapped to the image file names anchored in it
+        """
+        import numpy as np
+
+        import generate_report
+
+        for header, image_file in generate_report.IMAGE_COLUMNS.items():
+            missing = np.array([row is not None and image_file not in anchors.get(row, ())
+                                for row in self.sheet_rows], dtype=bool)
+            self.add(missing, header, WARNING, f"no image anchored; the default {image_file} is used")
+
+    def run(self, anchors=None):
+        """Run every check and return the problems, errors first"""
+        self.check_schema()
+        self.check_fields()
+        self.check_values()
+        self.check_dates()
+        if anchors is not None:
+            self.check_images(anchors)
+        order = {ERROR: 0, WARNING: 1}
+        self.problems.sort(key=lambda p: (order[p.severity], p.row is not None, p.row or 0))
+        return self.problems
+
+
+def validate(df, excel_file=None):
+    """
+    Check the rows of a batch before rendering
+
+    Args:
+        df (pandas.DataFrame): Workbook rows, as read for the batch
+        excel_file (str): Workbook the rows come from; when given, the image
+            anchors are checked too and problems carry the worksheet row
+
+    Returns:
+        list: Problem for every bad cell or missing column, errors first
+    """
+    sheet_rows = anchors = None
+    # Merged workbooks (see workbooks.py) have no single sheet for the anchors to be checked against
+    if excel_file is not None and "Field" in df.columns and not workbooks.is_pattern(excel_file):
+        import field_index
+        import generate_report
+
+        index = field_index.FieldIndex(excel_file)
+        # Like the renderers, a field's images come from the first row with its name
+        sheet_rows = [index.rows.get(value) for value in df["Field"].astype(object)]
+        anchors = index.image_anchors(generate_report.IMAGE_COLUMNS)
+    return Validator(df, sheet_rows).run(anchors)
+
+
+def write_report(problems, path):
+    """Write the problems as CSV, atomically"""
+    import io
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["row", "field", "column", "severity", "problem"])
+    for problem in problems:
+        writer.writerow(["" if problem.row is None else problem.row, problem.field, problem.column,
+                         problem.severity, problem.message])
+    journal.write_text_atomic(path, buffer.getvalue())
+
+
+def log_summary(problems):
+    """Log the number of problems and the first rows of each column with problems, at their severity"""
+    errors = sum(problem.severity == ERROR for problem in problems)
+    logger.info("Validation: %d errors, %d warnings", errors, len(problems) - errors)
+    groups = {}
+    for problem in problems:
+        groups.setdefault((problem.severity, problem.column), []).append(problem)
+    for (severity, column), group in groups.items():
+        level = logging.ERROR if severity == ERROR else logging.WARNING
+        logger.log(level, "  %-7s %s (%d)", severity.upper(), column, len(group))
+        for problem in group[:SUMMARY_ROWS]:
+            where = f"row {problem.row} ({problem.field}): " if problem.row is not None else \
+                f"{problem.field}: " if problem.field else ""
+            logger.log(level, "            %s%s", where, problem.message)
+        if len(group) > SUMMARY_ROWS:
+            logger.log(level, "            ... and %d more", len(group) - SUMMARY_ROWS)
+
+
+def check(df, excel_file, output_directory, strict=False):
+    """
+    Validate the rows of a batch, log a summary and write the report
+
+    Args:
+        df (pandas.DataFrame): Workbook rows
+        excel_file (str): Workbook the rows come from
+        output_directory (str): Directory for validation.csv
+        strict (bool): Fail on any error
+
+    Returns:
+        bool: False if strict and there are errors, so the batch should abort
+    """
+    problems = validate(df, excel_file)
+    log_summary(problems)
+    os.makedirs(output_directory, exist_ok=True)
+    path = os.path.join(output_directory, REPORT)
+    write_report(problems, path)
+    logger.info("Validation report written: %s", path)
+    if strict and any(problem.severity == ERROR for problem in problems):
+        logger.error("Aborting: the workbook has errors (--strict)")
+        return False
+    return True
+
+
+def add_arguments(parser, default=False):
+    """Add --validate and --strict to an argparse parser"""
+    parser.add_argument("--validate", action="store_true", default=default,
+                        help=f"Check the workbook's columns, dates, values and images before rendering "
+                             f"and write {REPORT} to the output directory")
+    parser.add_argument("--strict", action="store_true", default=default,
+                        help="Validate and abort before rendering if the workbook has errors")
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Check a workbook before generating reports")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--output", default=None, help="Write the problems to a CSV file")
+    parser.add_argument("--strict", action="store_true", help="Exit with status 1 if there are errors")
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df = pd.read_excel(args.excel)
+    problems = validate(df, args.excel)
+    log_summary(problems)
+    if args.output:
+        write_report(problems, args.output)
+        logger.info("Validation report written: %s", args.output)
+    if args.strict and any(problem.severity == ERROR for problem in problems):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Merged input from many workbooks, one row per field with the newest imagery
+
+Every week the teams deliver several workbooks in the demo.xlsx schema, with
+overlapping fields. Given a glob pattern instead of a workbook
+(``--excel "weekly/*.xlsx"``), generate_report.read_selected_fields merges
+them instead of reading one workbook:
+
+- every matching workbook is read in a process pool, one workbook per task:
+  its selected rows (field_index.FieldIndex) and the media parts of the
+  images anchored in them, without decompressing any image
+- rows of the same field are resolved by their newest image date, the latest
+  of the "<INDEX> Image date" columns of the index pages, as whole-column
+  pandas operations; on a tie the workbook later in name order wins, so
+  dated file names (``2025-07-14.xlsx``) need no dates in the rows
+- only the images of the winning rows are read, again in the process pool,
+  straight from the media parts found in the first pass
+
+The merged rows get a "Source workbook" column with the file each row came
+from. The batch, pipeline, report server and job queue accept a pattern
+wherever they accept a workbook; a batch over a pattern is journaled and
+sharded under a hash of all the matching workbooks.
+
+Usage:
+    python workbooks.py "weekly/*.xlsx" [--field NAME]
+"""
+import argparse
+import glob
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Column the merged rows carry the name of their workbook in
+SOURCE_COLUMN = "Source workbook"
+
+# Field column the rows are merged on; FieldIndex finds the fields in column A
+FIELD_COLUMN = "Field"
+
+
+def is_pattern(excel_file):
+    """True if the workbook argument is a glob pattern of workbooks rather than one workbook"""
+    return excel_file is not None and glob.has_magic(excel_file)
+
+
+def expand(pattern):
+    """
+    The workbooks a glob pattern matches, in name order
+
+    Excel's "~$" lock files of open workbooks are left out.
+
+    Raises:
+        FileNotFoundError: If the pattern matches no workbook
+    """
+    paths = sorted(path for path in glob.glob(pattern)
+                   if os.path.isfile(path) and not os.path.basename(path).startswith("~$"))
+    if not paths:
+        raise FileNotFoundError(f"No workbooks match {pattern}")
+    return paths
+
+
+def workbook_sha256(excel_file):
+    """SHA-256 of a workbook, or of the names and contents of every workbook a pattern matches"""
+    from journal import file_sha256
+
+    if not is_pattern(excel_file):
+        return file_sha256(excel_file)
+    sha = hashlib.sha256()
+    for path in expand(excel_file):
+        sha.update(f"{os.path.basename(path)}\0{file_sha256(path)}\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def field_entries(excel_file):
+    """(field name, worksheet row) of every row of a workbook, or of all the workbooks a pattern matches"""
+    import field_index
+
+    paths = expand(excel_file) if is_pattern(excel_file) else [excel_file]
+    return [entry for path in paths for entry in field_index.FieldIndex(path).entries]
+
+
+def _read_workbook(task):
+    """
+    Read the selected rows of one workbook and locate their images (runs in a worker process)
+
+    Args:
+        task (tuple): (path, field patterns or None, image columns)
+
+    Returns:
+        tuple: (dataframe of the rows with their worksheet row in "_row",
+            {worksheet row: {image file name: media part}})
+    """
+    import field_index
+
+    path, patterns, image_columns = task
+    index = field_index.FieldIndex(path)
+    selected = index.entries if patterns is None else index.select(patterns)
+    if not selected:
+        return None, {}
+    rows = [r for _, r in selected]
+    df = index.read_rows(rows)
+    df["_row"] = rows
+    parts = {}
+    for (r, image_file), part in index.image_parts(rows, image_columns).items():
+        parts.setdefault(r, {})[image_file] = part
+    return df, parts
+
+
+def _read_parts(task):
+    """Read media parts of one workbook package (runs in a worker process)"""
+    import zipfile
+
+    path, parts = task
+    with zipfile.ZipFile(path) as package:
+        return [package.read(part) for part in parts]
+
+
+def image_dates(df, columns):
+    """
+    Newest of the image date columns of every row, NaT where a row has none
+
+    The dates are text with stray whitespace in most workbooks ("2025-07-11\\n"),
+    so every column is stripped and parsed as a whole.
+    """
+    import pandas as pd
+
+    dates = []
+    for column in columns:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values.astype("string").str.strip(), errors="coerce", format="mixed")
+        dates.append(values)
+    if not dates:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    return pd.concat(dates, axis=1).max(axis=1)
+
+
+def merge_rows(df, date_columns):
+    """
+    Keep one row per field: the one with the newest image date
+
+    Args:
+        df (pandas.DataFrame): Rows of every workbook, with their workbook position in
+            "_source" and worksheet row in "_row"
+        date_columns (list): Image date columns a row's date is the newest of
+
+    Returns:
+        pandas.DataFrame: The winning rows, in the order the fields first appear
+    """
+    names = (df[FIELD_COLUMN] if FIELD_COLUMN in df.columns else df.iloc[:, 0]).astype(str)
+    # Fields are numbered in the order they first appear, to keep the merged rows in that order
+    ranked = df.assign(_field=names, _newest=image_dates(df, date_columns),
+                       _first=names.groupby(names, sort=False).ngroup())
+    # Rows without any date lose to dated ones; ties go to the later workbook, then the later row
+    ranked = ranked.sort_values(["_newest", "_source", "_row"], na_position="first", kind="stable")
+    winners = ranked.drop_duplicates("_field", keep="last").sort_values("_first", kind="stable")
+    return winners.drop(columns=["_field", "_newest", "_first"])
+
+
+def read_merged(pattern, patterns=None, workers=None):
+    """
+    Read the rows of every workbook a pattern matches, one per field, and the winning rows' images
+
+    Args:
+        pattern (str): Glob pattern of the workbooks
+        patterns (list): Field names or glob patterns, None for every field
+        workers (int): Worker processes, the number of CPUs by default
+
+    Returns:
+        tuple: (dataframe of the merged rows, list with each row's {image file name: raw bytes}),
+            (None, []) when no row matches, like generate_report.read_selected_fields
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    import pandas as pd
+
+    import index_pages
+
+    paths = expand(pattern)
+    image_columns = index_pages.image_columns()
+    date_columns = [entry.image_column for entry in index_pages.INDEX_PAGES]
+
+    with ProcessPoolExecutor(max_workers=min(len(paths), workers or os.cpu_count() or 1)) as pool:
+        results = list(pool.map(_read_workbook, [(path, patterns, image_columns) for path in paths]))
+        frames = [df.assign(_source=position) for position, (df, _) in enumerate(results) if df is not None]
+        if not frames:
+            return None, []
+        all_rows = pd.concat(frames, ignore_index=True)
+        merged = merge_rows(all_rows, date_columns).reset_index(drop=True)
+
+        # Only the winning rows' images are decompressed, each workbook's in one task
+        wanted = {}
+        for position, (source, row) in enumerate(zip(merged["_source"], merged["_row"])):
+            for image_file, part in results[source][1].get(row, {}).items():
+                wanted.setdefault(source, []).append((position, image_file, part))
+        sources = list(wanted)
+        images = [{} for _ in range(len(merged))]
+        read = pool.map(_read_parts, [(paths[source], [part for _, _, part in wanted[source]]) for source in sources])
+        for source, data in zip(sources, read):
+            for (position, image_file, _), image in zip(wanted[source], data):
+                images[position][image_file] = image
+
+    logger.info("Merged %d workbooks: %d rows, %d fields, %d older rows dropped",
+                len(paths), len(all_rows), len(merged), len(all_rows) - len(merged))
+    merged[SOURCE_COLUMN] = [os.path.basename(paths[source]) for source in merged["_source"]]
+    return merged.drop(columns=["_source", "_row"]), images
+
+
+def main(argv=None):
+    import pandas as pd
+
+    import field_index
+    import index_pages
+    import logs
+
+    parser = argparse.ArgumentParser(description="Merge the workbooks a glob pattern matches, one row per field")
+    parser.add_argument("pattern", help='Glob pattern of the workbooks, e.g. "weekly/*.xlsx"')
+    field_index.add_field_argument(parser)
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df, field_images = read_merged(args.pattern, args.field)
+    if df is None:
+        logger.warning("No fields found in %s", args.pattern)
+        return
+    dates = image_dates(df, [entry.image_column for entry in index_pages.INDEX_PAGES])
+    for (_, row), date, images in zip(df.iterrows(), dates, field_images):
+        date = "no date" if pd.isna(date) else date.strftime("%Y-%m-%d")
+        print(f"{row.iloc[0]}  {date}  {row[SOURCE_COLUMN]}  {len(images)} images")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""
+Management zones: every field split into 3-5 zones by its five index maps
+
+Agronomists split a field into management zones by eye from its current
+index images. With ``--zones`` every field's current NDVI, NDMI, RECI, MSAVI
+and NDRE images are decoded (see index_maps.py) before rendering starts and:
+
+- the values of the five maps are stacked into one feature row per pixel of
+  the field
+- the rows are clustered with a mini-batch k-means (Sculley, 2010): k-means++
+  seeding, then batches of BATCH_SIZE rows assigned to the nearest centre and
+  the centres moved by per-centre learning rates, all as array operations and
+  seeded with SEED, so a field always gets the same zones
+- with ``--zones`` alone the number of zones is the one of ZONE_COUNTS with
+  the best Calinski-Harabasz score; ``--zones 4`` fixes it
+- the zones are numbered from the lowest mean value to the highest, so zone 1
+  is the weakest part of the field
+
+The report of a field with zones gets a page 7 with the zone map and the share
+of the field and mean index values of every zone. The zones are added to the
+workbook rows as "Zones ..." columns, so they reach the batch, pipeline,
+isolated and server paths alike, and are listed in ``<output>/zones.csv``.
+
+A field's zones are cached in CACHE_DIR under a hash of its five images and
+the zone count, so a later batch only clusters the fields whose images
+changed; the missing fields are clustered in a process pool.
+
+Usage:
+    python zones.py [--excel demo.xlsx] [--zones auto|3|4|5] [--output zones.csv]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Part of the cache key; bump when the clustering or the cached results change
+ZONES_VERSION = 1
+
+# Cached zones of every field, named after the hash of its images
+CACHE_DIR = os.path.join("cache", "zones")
+
+# Name of the report in the output directory
+REPORT = "zones.csv"
+
+# Zone counts the best one is chosen from
+ZONE_COUNTS = (3, 4, 5)
+
+# Seed of the k-means++ seeding and of the mini-batches
+SEED = 0
+
+# Pixels per mini-batch, and the most batches per clustering
+BATCH_SIZE = 2048
+MAX_ITERATIONS = 200
+
+# Batches stop once no centre moves more than this (squared scale positions)
+TOLERANCE = 1e-7
+
+# Pixels the k-means++ seeding picks the first centres from
+SEEDING_SAMPLE = 10000
+
+# Pixels assigned to their nearest centre at a time
+ASSIGN_CHUNK = 1 << 20
+
+# Longest side in pixels of the zone map
+MAP_SIZE = 440
+
+# Zone colours, weakest zone first
+ZONE_COLORS = {
+    1: ["#a6d96a"],
+    2: ["#d73027", "#1a9850"],
+    3: ["#d73027", "#fee08b", "#1a9850"],
+    4: ["#d73027", "#fdae61", "#a6d96a", "#1a9850"],
+    5: ["#d73027", "#fdae61", "#fee08b", "#a6d96a", "#1a9850"],
+}
+
+
+def zone_count(value):
+    """argparse type of --zones: "auto" or one of ZONE_COUNTS"""
+    if value == "auto":
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        count = None
+    if count not in ZONE_COUNTS:
+        raise argparse.ArgumentTypeError(f"zones must be 'auto' or one of {', '.join(map(str, ZONE_COUNTS))}")
+    return count
+
+
+def field_features(images):
+    """
+    Stack the decoded current index maps of a field into one feature row per field pixel
+
+    Maps of another size than the first one are resampled to it (nearest pixel).
+
+    Args:
+        images (dict): The field's {image file name: raw bytes}
+
+    Returns:
+        tuple: (float32 array (pixels, indices), boolean image of the field pixels,
+            list of the indices used); None when no current image could be decoded
+    """
+    import numpy as np
+
+    import advisory
+    import imagery
+    import index_maps
+
+    maps, indices = [], []
+    for index in advisory.INDICES:
+        data = images.get(imagery.image_file(index, "current"))
+        values = index_maps.decode(data, index) if data is not None else None
+        if values is None:
+            continue
+        if maps and values.shape != maps[0].shape:
+            height, width = maps[0].shape
+            rows = (np.arange(height) * values.shape[0] // height)
+            columns = (np.arange(width) * values.shape[1] // width)
+            values = values[rows][:, columns]
+        maps.append(values)
+        indices.append(index)
+    if not maps:
+        return None
+    stack = np.stack(maps, axis=-1)
+    inside = ~np.isnan(stack).any(axis=-1)
+    return stack[inside], inside, indices
+
+
+def _nearest(points, centers):
+    """Nearest centre of every point and the squared distance to it"""
+    import numpy as np
+
+    distances = ((points ** 2).sum(axis=1)[:, None] - 2 * points @ centers.T + (centers ** 2).sum(axis=1)[None, :])
+    nearest = distances.argmin(axis=1)
+    return nearest, np.maximum(distances[np.arange(len(points)), nearest], 0)
+
+
+def _seed_centers(features, count, rng):
+    """k-means++ seeding on a sample of the features"""
+    import numpy as np
+
+    sample = features[rng.choice(len(features), min(len(features), SEEDING_SAMPLE), replace=False)]
+    centers = [sample[rng.integers(len(sample))]]
+    closest = ((sample - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, count):
+        total = closest.sum()
+        # A sample of identical pixels: the extra centres end up as empty zones
+        choice = rng.choice(len(sample), p=closest / total) if total > 0 else rng.integers(len(sample))
+        centers.append(sample[choice])
+        closest = np.minimum(closest, ((sample - sample[choice]) ** 2).sum(axis=1))
+    return np.array(centers, dtype=np.float64)
+
+
+def assign(features, centers):
+    """
+    Nearest centre of every feature row, ASSIGN_CHUNK rows at a time
+
+    Returns:
+        tuple: (int array of zones, inertia: the sum of the squared distances)
+    """
+    import numpy as np
+
+    labels = np.empty(len(features), dtype=np.intp)
+    inertia = 0.0
+    for start in range(0, len(features), ASSIGN_CHUNK):
+        chunk = features[start:start + ASSIGN_CHUNK].astype(np.float64)
+        labels[start:start + ASSIGN_CHUNK], distances = _nearest(chunk, centers)
+        inertia += float(distances.sum())
+    return labels, inertia
+
+
+def mini_batch_kmeans(features, count, seed=SEED):
+    """
+    Cluster feature rows with a seeded mini-batch k-means
+
+    Args:
+        features (numpy.ndarray): (rows, features) array
+        count (int): Number of clusters
+        seed (int): Seed of the seeding and the batches
+
+    Returns:
+        tuple: (centers (count, features), cluster of every row, inertia)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = _seed_centers(features, count, rng)
+    seen = np.zeros(count)
+    for _ in range(MAX_ITERATIONS):
+        batch = features[rng.integers(0, len(features), min(BATCH_SIZE, len(features)))].astype(np.float64)
+        nearest, _ = _nearest(batch, centers)
+        members = nearest[:, None] == np.arange(count)
+        batch_counts = members.sum(axis=0)
+        sums = members.T.astype(np.float64) @ batch
+        seen += batch_counts
+        # Each centre moves towards the mean of its batch members by batch count / all members seen
+        moved = batch_counts > 0
+        step = np.zeros_like(centers)
+        step[moved] = (sums[moved] - batch_counts[moved, None] * centers[moved]) / seen[moved, None]
+        centers += step
+        if (step ** 2).sum(axis=1).max() < TOLERANCE:
+            break
+    labels, inertia = assign(features, centers)
+    return centers, labels, inertia
+
+
+def calinski_harabasz(features, labels, count, inertia):
+    """Ratio of the between-zone to the within-zone dispersion, each per degree of freedom"""
+    import numpy as np
+
+    rows = len(features)
+    if count < 2 or rows <= count:
+        return 0.0
+    total = float(((features - features.mean(axis=0)) ** 2).sum())
+    if inertia <= 0:
+        return float("inf")
+    return ((total - inertia) / (count - 1)) / (inertia / (rows - count))
+
+
+def cluster(features, zones="auto", seed=SEED):
+    """
+    Split the pixels of a field into zones numbered from the weakest
+
+    Args:
+        features (numpy.ndarray): (pixels, indices) array from field_features
+        zones: "auto" for the best of ZONE_COUNTS, or the number of zones
+
+    Returns:
+        tuple: (zone of every pixel from 0, number of zones, centers in zone order)
+    """
+    import numpy as np
+
+    counts = ZONE_COUNTS if zones == "auto" else (zones,)
+    best = None
+    for count in counts:
+        count = min(count, len(features))
+        centers, labels, inertia = mini_batch_kmeans(features, count, seed)
+        score = calinski_harabasz(features, labels, count, inertia)
+        if best is None or score > best[0]:
+            best = (score, centers, labels)
+    _, centers, labels = best
+
+    # Drop the centres no pixel is nearest to, and number the zones by their mean value
+    used = np.bincount(labels, minlength=len(centers)) > 0
+    order = [zone for zone in np.argsort(centers.mean(axis=1), kind="stable") if used[zone]]
+    numbers = np.full(len(centers), -1)
+    numbers[order] = np.arange(len(order))
+    return numbers[labels], len(order), centers[order]
+
+
+def zone_map(labels, inside, count):
+    """
+    PNG of the zones, transparent outside the field, at most MAP_SIZE pixels wide or high
+
+    Returns:
+        str: data: URI of the PNG
+    """
+    import numpy as np
+    from PIL import Image
+
+    palette = np.zeros((count + 1, 4), dtype=np.uint8)
+    for zone, color in enumerate(ZONE_COLORS[count]):
+        palette[zone] = [int(color[i:i + 2], 16) for i in (1, 3, 5)] + [255]
+    image = np.full(inside.shape, count, dtype=np.intp)
+    image[inside] = labels
+
+    height, width = inside.shape
+    scale = MAP_SIZE / max(height, width)
+    rows = (np.arange(max(1, round(height * scale))) / scale).astype(np.intp).clip(0, height - 1)
+    columns = (np.arange(max(1, round(width * scale))) / scale).astype(np.intp).clip(0, width - 1)
+    output = io.BytesIO()
+    Image.fromarray(palette[image[rows][:, columns]], "RGBA").save(output, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def field_zones(images, zones="auto"):
+    """
+    Management zones of one field
+
+    Args:
+        images (dict): The field's {image file name: raw bytes}
+        zones: "auto" or the number of zones
+
+    Returns:
+        dict: {"count": zones, "indices": indices clustered on, "map": zone map data: URI,
+            "zones": [{"zone": number from 1, "share": percent of the field,
+            "means": {index: mean scale position}}, ...]}; None without decodable images
+    """
+    import numpy as np
+
+    stacked = field_features(images)
+    if stacked is None or not len(stacked[0]):
+        return None
+    features, inside, indices = stacked
+    labels, count, _ = cluster(features, zones)
+    pixels = np.bincount(labels, minlength=count)
+    sums = np.stack([np.bincount(labels, weights=features[:, i], minlength=count) for i in range(len(indices))],
+                    axis=1)
+    return {
+        "count": count,
+        "indices": indices,
+        "map": zone_map(labels, inside, count),
+        "zones": [{"zone": zone + 1,
+                   "share": round(100 * float(pixels[zone]) / len(labels), 1),
+                   "means": {index: round(float(sums[zone, i] / pixels[zone]), 3)
+                             for i, index in enumerate(indices)}}
+                  for zone in range(count)],
+    }
+
+
+def cache_key(images, zones):
+    """Hash of the current index images of a field and the zone count, naming its cache entry"""
+    import advisory
+    import imagery
+
+    digest = hashlib.sha256(f"zones {ZONES_VERSION} {zones}".encode("ascii"))
+    for index in advisory.INDICES:
+        data = images.get(imagery.image_file(index, "current"))
+        digest.update(index.encode("ascii"))
+        digest.update(hashlib.sha256(data).digest() if data is not None else b"-")
+    return digest.hexdigest()
+
+
+def cache_path(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{key[:32]}.json")
+
+
+def load_cached(key, cache_dir=CACHE_DIR):
+    """The cached zones of a cache key, None when there are none (or they're unreadable)"""
+    try:
+        with open(cache_path(key, cache_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _compute_and_cache(task):
+    """Cluster one field and cache its zones (run in the process pool)"""
+    import journal
+
+    images, zones, key, cache_dir = task
+    result = field_zones(images, zones)
+    if result is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        journal.write_text_atomic(cache_path(key, cache_dir), json.dumps(result))
+    return result
+
+
+def compute_zones(field_images, zones="auto", cache_dir=CACHE_DIR, workers=None):
+    """
+    Zones of every field of a batch, from the cache or clustered in a process pool
+
+    Args:
+        field_images (list): Each row's {image file name: raw bytes}
+        zones: "auto" or the number of zones
+        cache_dir (str): Directory of the cached zones
+        workers (int): Processes to cluster in, default the CPU count
+
+    Returns:
+        tuple: (list with every row's field_zones result or None, number of fields clustered)
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    keys = [cache_key(images, zones) for images in field_images]
+    results = [load_cached(key, cache_dir) for key in keys]
+    # Fields with the same images are clustered once
+    missing = {}
+    for position, (key, result) in enumerate(zip(keys, results)):
+        if result is None:
+            missing.setdefault(key, []).append(position)
+    tasks = [(field_images[positions[0]], zones, key, cache_dir) for key, positions in missing.items()]
+    if len(tasks) <= 1:
+        computed = [_compute_and_cache(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(tasks), workers or os.cpu_count() or 1)) as pool:
+            computed = list(pool.map(_compute_and_cache, tasks))
+    for positions, result in zip(missing.values(), computed):
+        for position in positions:
+            results[position] = result
+    return results, len(tasks)
+
+
+def apply_zones(df, field_images, zones="auto", cache_dir=CACHE_DIR):
+    """
+    Add the zones of every field to the workbook rows
+
+    Returns:
+        tuple: (copy of df with the columns "Zones count", "Zones indices", "Zones map"
+            and "Zones stats" (JSON list of the zones), list of report rows (field, zone,
+            share, mean of every index), number of fields clustered rather than cached)
+    """
+    import pandas as pd
+
+    import advisory
+
+    results, clustered = compute_zones(field_images, zones, cache_dir)
+    df = df.copy()
+    df["Zones count"] = pd.array([result["count"] if result else None for result in results], dtype="Int64")
+    df["Zones indices"] = [", ".join(result["indices"]) if result else None for result in results]
+    df["Zones map"] = [result["map"] if result else None for result in results]
+    df["Zones stats"] = [json.dumps(result["zones"]) if result else None for result in results]
+
+    names = df["Field"].astype(str) if "Field" in df.columns else pd.Series(df.index, index=df.index).astype(str)
+    rows = []
+    for name, result in zip(names, results):
+        for zone in (result or {}).get("zones", []):
+            rows.append([name, zone["zone"], zone["share"]]
+                        + [zone["means"].get(index, "") for index in advisory.INDICES])
+    return df, rows, clustered
+
+
+def write_report(rows, path):
+    """Write the zones of every field as CSV, atomically"""
+    import csv
+
+    import advisory
+    import journal
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["field", "zone", "share_percent"] + [f"mean_{index.lower()}" for index in advisory.INDICES])
+    writer.writerows(rows)
+    journal.write_text_atomic(path, buffer.getvalue())
+
+
+def apply_and_report(df, field_images, zones="auto", output_directory=None):
+    """apply_zones, logging how many fields were clustered and writing zones.csv to the output directory"""
+    try:
+        df, rows, clustered = apply_zones(df, field_images, zones)
+    except Exception as e:
+        # Reports without the zones page are still reports
+        logger.error("Error clustering management zones: %s", e)
+        return df
+    zoned = int(df["Zones count"].notna().sum())
+    logger.info("Management zones: %d fields zoned, %d clustered, the rest from %s", zoned, clustered, CACHE_DIR)
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+        path = os.path.join(output_directory, REPORT)
+        write_report(rows, path)
+        logger.info("Zones report written: %s", path)
+    return df
+
+
+def has_zones(df):
+    """True when the field of a single row dataframe has management zones"""
+    if df.empty or "Zones stats" not in df.columns:
+        return False
+    return isinstance(df["Zones stats"].iloc[0], str)
+
+
+def add_argument(parser, default=None):
+    """Add --zones to an argparse parser"""
+    parser.add_argument("--zones", nargs="?", const="auto", default=default, type=zone_count, metavar="K",
+                        help="Split every field into management zones by its five index maps and add a zone "
+                             f"page; K is one of {', '.join(map(str, ZONE_COUNTS))} (default: the best fit)")
+
+
+def main(argv=None):
+    import advisory
+    import generate_report
+    import logs
+
+    parser = argparse.ArgumentParser(description="Split the fields of a workbook into management zones")
+    parser.add_argument("--excel", default="demo.xlsx", help="Excel file with crop data (default: demo.xlsx)")
+    parser.add_argument("--zones", default="auto", type=zone_count, metavar="K",
+                        help=f"Number of zones, one of {', '.join(map(str, ZONE_COUNTS))} (default: the best fit)")
+    parser.add_argument("--output", default=None, help="Write the zones to a CSV file")
+    logs.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logs.configure_from_args(args)
+
+    df, field_images = generate_report.read_selected_fields(args.excel)
+    if df is None:
+        logger.warning("No fields found in %s", args.excel)
+        return
+    _, rows, _ = apply_zones(df, field_images, args.zones)
+    if args.output:
+        write_report(rows, args.output)
+        logger.info("Zones report written: %s", args.output)
+    else:
+        for name, zone, share, *means in rows:
+            values = "  ".join(f"{index} {mean:.2f}" for index, mean in zip(advisory.INDICES, means) if mean != "")
+            print(f"{name}  zone {zone}  {share:5.1f}%  {values}")
+
+
+if __name__ == "__main__":
+    main()